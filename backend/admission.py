@@ -0,0 +1,97 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    """A request turned away by a RouteBudget, with the status and Retry-After to answer with"""
+
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class RouteBudget:
+    """
+    Admission control for one expensive route: concurrency budget, bounded queue and deadline.
+
+    At most max_in_flight requests run at once and at most max_queued more
+    wait for a slot; past that a request is rejected straight away with 429.
+    A queued request that does not get a slot before its deadline is
+    rejected with 503. Both carry Retry-After, and neither ties up a worker
+    thread, so a burst on this route cannot starve the cheap ones. Admitted
+    requests get their deadline, measured from arrival, to degrade by rather
+    than overrun.
+
+    Exports admission_requests_total{route,result} (admitted, rejected_queue_full,
+    rejected_deadline) and admission_wait_seconds{route}.
+
+    Args:
+        name: route label in the metrics
+        max_in_flight: requests served at once
+        max_queued: requests waiting for a slot
+        deadline: seconds a request has from arrival, or None
+        retry_after: seconds suggested to rejected clients
+    """
+
+    def __init__(self, name, max_in_flight, max_queued=0, deadline=None, retry_after=1):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Hold a slot for the duration of the block
+
+        Raises:
+            Overloaded: the queue is full (429) or the deadline passed while queued (503)
+
+        Yields:
+            the request's deadline as a time.monotonic() value, or None
+        """
+        arrived = time.monotonic()
+        deadline = arrived + self.deadline if self.deadline is not None else None
+        if self._semaphore.locked():
+            if self.queued >= self.max_queued:
+                self._reject("rejected_queue_full")
+                raise Overloaded(429, self.retry_after, f"Too many {self.name} requests in progress")
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), None if deadline is None else max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                self._reject("rejected_deadline")
+                raise Overloaded(503, self.retry_after, f"No capacity for {self.name} requests before the deadline")
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        metrics.inc("admission_requests_total", route=self.name, result="admitted")
+        metrics.observe("admission_wait_seconds", time.monotonic() - arrived, route=self.name)
+        self.in_flight += 1
+        try:
+            yield deadline
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _reject(self, result):
+        self.rejected += 1
+        metrics.inc("admission_requests_total", route=self.name, result=result)
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "queued": self.queued, "rejected": self.rejected}
+
+
+metrics.describe("admission_requests_total", "Requests to budgeted routes, by whether they were admitted or rejected and why")
+metrics.describe("admission_wait_seconds", "Time an admitted request waited for a slot in its route's budget")
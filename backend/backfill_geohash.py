@@ -0,0 +1,41 @@
+"""
+One-off migration: store the geohash GET /events/nearby queries on existing events.
+
+create_event, update_event and the events import now write a "geohash" field
+computed from latitude/longitude. This script adds (or corrects) it on every
+event written before that, in batches of up to 500 updates.
+
+Usage (from the backend folder, with the same credentials as the server):
+    python backfill_geohash.py [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+
+from geo import with_geohash
+from main import db, repo
+
+
+async def backfill(dry_run=False):
+    summary = {"events": 0, "updated": 0}
+    batch = db.batch()
+    async for event_id, event in repo.iter_documents("events", fields=["latitude", "longitude", "geohash"]):
+        summary["events"] += 1
+        geohash = with_geohash(event)["geohash"]
+        if "geohash" in event and event["geohash"] == geohash:
+            continue
+        batch.update(db.collection("events").document(event_id), {"geohash": geohash})
+        summary["updated"] += 1
+        if len(batch) >= 500 and not dry_run:
+            await batch.commit()
+            batch = db.batch()
+    if len(batch) and not dry_run:
+        await batch.commit()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add geohashes to existing events")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(backfill(args.dry_run)), indent=4))
@@ -0,0 +1,48 @@
+"""
+One-off migration: stamp a version, updatedAt and createdAt on documents written before them.
+
+Every write to users, communities, events and posts now stores a version and
+updatedAt, and creates also store createdAt: /sync finds changes by version
+and the feeds are ordered by createdAt (Firestore leaves documents without
+it out). This script stamps the documents missing either, in batches of up to
+500 updates. A document without createdAt is taken to have been created when
+it was last updated, or now when that is not known either; documents that
+have both are left alone.
+
+Usage (from the backend folder, with the same credentials as the server):
+    python backfill_versions.py [--dry-run]
+"""
+import argparse
+import asyncio
+import json
+
+from main import db, repo
+from sync import CREATED_AT_FIELD, SYNC_COLLECTIONS, UPDATED_AT_FIELD, VERSION_FIELD
+
+
+async def backfill(dry_run=False):
+    summary = {}
+    for collection in SYNC_COLLECTIONS:
+        counts = summary[collection] = {"documents": 0, "updated": 0}
+        batch = db.batch()
+        async for doc_id, document in repo.iter_documents(collection, fields=[VERSION_FIELD, UPDATED_AT_FIELD, CREATED_AT_FIELD]):
+            counts["documents"] += 1
+            missing_created = not document.get(CREATED_AT_FIELD)
+            if document.get(VERSION_FIELD) is not None and not missing_created:
+                continue
+            changes = {CREATED_AT_FIELD: document[UPDATED_AT_FIELD]} if missing_created and document.get(UPDATED_AT_FIELD) else {}
+            batch.update(db.collection(collection).document(doc_id), repo.stamped(collection, changes, created=missing_created))
+            counts["updated"] += 1
+            if len(batch) >= 500 and not dry_run:
+                await batch.commit()
+                batch = db.batch()
+        if len(batch) and not dry_run:
+            await batch.commit()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add versions and creation times to existing documents")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(backfill(args.dry_run)), indent=4))
@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for the backend.
+
+Run from the backend directory, e.g. ``python -m benchmarks.async_vs_sync``.
+They use the in-memory FakeFirestore, so no credentials or network are needed.
+"""
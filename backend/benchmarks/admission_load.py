@@ -0,0 +1,127 @@
+"""
+Cheap-route latency during a matching storm, with and without admission control.
+
+--storm clients call /find-similar-users for the largest synthetic event in
+a loop while --cheap clients call / and /communities/{id}, for --seconds
+per phase. Match precomputation is turned off, so every match is answered
+live, the way a burst on an event that has not been built yet is: from the
+feature store, filled by its users listener as at startup, or with
+--no-feature-store from Firestore and find_top_similar_users, as before
+the listener's first snapshot. The fake evaluates that Firestore query on
+the event loop, where Firestore runs it server-side, so the cheap routes'
+latency in that mode includes the fake's scans. Phases:
+
+    baseline: the cheap routes alone
+    unbudgeted: the storm with no concurrency budget or deadline, as before
+    budgeted: the storm with the configured MATCH_* budget and deadline
+
+The cheap routes' p99 should stay near the baseline when budgeted. For the
+storm, responses are counted by status (429/503 are rejections) and by
+whether the match was degraded to meet its deadline.
+
+Runs through the ASGI app on the in-memory Firestore, with the model loaded
+from the local Hugging Face cache (HF_HUB_OFFLINE=1) as in benchmarks.suite.
+
+Usage:
+    python -m benchmarks.admission_load --users 20000 --storm 64 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+os.environ.setdefault("NLP_WARMUP", "lazy")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import httpx
+
+import main
+from admission import RouteBudget
+from benchmarks.suite import seed, summarize
+
+
+async def phase(client, args, rng, communities, attendees, storm):
+    stop = time.perf_counter() + args.seconds
+    cheap = {"health": [], "community": []}
+    statuses, degraded = Counter(), Counter()
+    match_latencies = []
+
+    async def cheap_client():
+        while time.perf_counter() < stop:
+            route = rng.choice(list(cheap))
+            path = "/" if route == "health" else f"/communities/{rng.choice(communities)}"
+            started = time.perf_counter()
+            # In-process requests to async routes never suspend on their own, so
+            # yield first; the wait for the event loop is part of the latency
+            await asyncio.sleep(0)
+            (await client.get(path)).raise_for_status()
+            cheap[route].append(time.perf_counter() - started)
+
+    async def storm_client():
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            response = await client.get("/find-similar-users", params={"user_id": rng.choice(attendees), "event_id": "event-0", "top_n": 5})
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                match_latencies.append(time.perf_counter() - started)
+                degraded.update(response.json().get("degraded", []))
+            else:
+                # What a well-behaved client does with Retry-After, scaled down
+                await asyncio.sleep(float(response.headers.get("retry-after", 1)) / 10)
+
+    await asyncio.gather(*(cheap_client() for _ in range(args.cheap)), *(storm_client() for _ in range(storm)))
+    return {
+        "cheap": {route: summarize(samples) for route, samples in cheap.items() if samples},
+        **({"matches": {
+            "statuses": dict(statuses),
+            "degraded": dict(degraded),
+            "latency": summarize(match_latencies) if match_latencies else None,
+        }} if storm else {}),
+    }
+
+
+async def run(args):
+    dataset = seed(args.users, args.seed)
+    rng = random.Random(args.seed)
+    attendees = [user["id"] for user in dataset["users"] if "event-0" in user["signedUpEventIds"] and user["interests"]]
+    communities = [community["id"] for community in dataset["communities"]]
+    main.match_store.schedule = lambda event_id: None
+    if args.feature_store:
+        # As at startup; the listener fills the feature store live matches are scored from
+        main.feature_store.listen(main.listen_db.collection("users"), on_change=main._sync_matches)
+        await asyncio.get_running_loop().run_in_executor(None, main.feature_store.wait_ready)
+
+    budget = main.match_budget
+    results = {
+        "users": args.users,
+        "event_attendees": len(attendees),
+        "storm_clients": args.storm,
+        "cheap_clients": args.cheap,
+        "source": "feature_store" if args.feature_store else "firestore",
+    }
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=120) as client:
+        # Load the model and embed the dataset's interests before timing anything
+        await client.get("/find-similar-users", params={"user_id": attendees[0], "event_id": "event-0"})
+        results["budget"] = {"max_in_flight": budget.max_in_flight, "max_queued": budget.max_queued, "deadline": budget.deadline}
+        results["baseline"] = await phase(client, args, rng, communities, attendees, 0)
+        main.match_budget = RouteBudget("find-similar-users", max_in_flight=10 ** 6)
+        results["unbudgeted"] = await phase(client, args, rng, communities, attendees, args.storm)
+        main.match_budget = budget
+        results["budgeted"] = await phase(client, args, rng, communities, attendees, args.storm)
+    main.feature_store.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--storm", type=int, default=64, help="concurrent /find-similar-users clients")
+    parser.add_argument("--cheap", type=int, default=8, help="concurrent clients of the cheap routes")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--no-feature-store", dest="feature_store", action="store_false", help="answer live matches from Firestore")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
@@ -0,0 +1,89 @@
+"""
+Load-test comparison of the async /users route against a blocking equivalent.
+
+Both apps serve the same in-memory documents with the same simulated Firestore
+round-trip latency. The sync baseline is a plain ``def`` route that blocks a
+threadpool worker for the whole round trip, as the routes did before the
+async repository layer; the async route yields the event loop instead.
+
+Usage:
+    python -m benchmarks.async_vs_sync --requests 2000 --concurrency 200 --latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+os.environ.setdefault("NLP_WARMUP", "lazy")
+
+import httpx
+from fastapi import FastAPI
+
+import main
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load(app, path, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def sync_app(client, latency):
+    app = FastAPI()
+
+    @app.get("/users")
+    def get_users():
+        # Same documents and copying as the fake's stream, behind a blocking wait
+        time.sleep(latency)
+        return [doc.to_dict() for doc in client.collection("users")._run()]
+
+    return app
+
+
+async def run(args):
+    for i in range(args.documents):
+        await main.db.collection("users").add({"id": f"user-{i}", "name": f"User {i}", "interests": ["Hiking"]})
+    main.db.latency = args.latency
+
+    return {
+        "documents": args.documents,
+        "latency_s": args.latency,
+        "sync": await load(sync_app(main.db, args.latency), "/users", args.requests, args.concurrency),
+        "async": await load(main.app, "/users", args.requests, args.concurrency),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--documents", type=int, default=50)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
@@ -0,0 +1,114 @@
+"""
+Change feed fan-out: delta delivery to thousands of subscribers vs polling.
+
+Subscribers are split between the whole posts feed and a feed filtered by one
+of --communities communities; each drains its Subscription in its own task,
+like a /changes response does, except --stalled of them that never read and
+are reset once their buffer is full. Posts are then created one by one
+through the repository at --rate per second, and each delivery's latency is
+measured from the write to the subscriber receiving it, across FakeFirestore's
+listener thread and the event loop.
+
+"polling" is what clients do today: re-read the whole posts collection on
+every refresh. Its reads are what one refresh of every subscriber would
+cost, against the feed's one read per change for the whole process.
+
+Usage:
+    python -m benchmarks.change_feed --subscribers 1000 5000 --posts 200
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from benchmarks.document_lookup import summarize
+from change_feed import ChangeFeed
+from fake_firestore import FakeFirestore
+from repository import Repository
+
+
+async def drain(subscription, written, latencies):
+    while (messages := await subscription.get()) is not None:
+        received = time.perf_counter()
+        for message in messages:
+            # Messages are shared by all their subscribers, so each is parsed once
+            if message not in written:
+                delta = json.loads(message.json)
+                written[message] = written.get(delta["id"]) if delta["type"] == "added" else None
+            if written[message] is not None:
+                latencies.append(received - written[message])
+
+
+async def run_size(args, count, rng):
+    client = FakeFirestore()
+    repo = Repository(client)
+    await repo.bulk_create("posts", [
+        {"id": f"seed-{i}", "communityId": f"comm-{i % args.communities}", "content": "seed"}
+        for i in range(args.seed_posts)
+    ])
+    feed = ChangeFeed(max_buffer=args.buffer)
+    feed.listen("posts", client.collection("posts"))
+
+    gc.collect()
+    tracemalloc.start()
+    subscriptions = [
+        feed.subscribe(["posts"], *(("community", f"comm-{rng.randrange(args.communities)}") if i % 2 else ()))
+        for i in range(count)
+    ]
+    subscription_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    written, latencies = {}, []
+    stalled = int(count * args.stalled)
+    tasks = [asyncio.create_task(drain(subscription, written, latencies)) for subscription in subscriptions[stalled:]]
+    await asyncio.sleep(0.1)
+
+    client.reset_counters()
+    started = time.perf_counter()
+    for i in range(args.posts):
+        post_id = f"post-{i}"
+        written[post_id] = time.perf_counter()
+        await repo.create("posts", {"id": post_id, "communityId": f"comm-{i % args.communities}", "content": "x" * 200})
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - started
+    stats = feed.stats()
+    feed.close()
+    await asyncio.gather(*tasks)
+
+    return {
+        "subscribers": count,
+        "stalled": stalled,
+        "bytes_per_subscriber": subscription_bytes / count,
+        "delivery": summarize(latencies) if latencies else None,
+        "deliveries_per_second": stats["delivered"] / elapsed,
+        "overflows": stats["overflows"],
+        "feed_reads": client.reads,
+        "polling_reads_per_refresh": count * (args.seed_posts + args.posts),
+    }
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    return {
+        "posts": args.posts,
+        "communities": args.communities,
+        "buffer": args.buffer,
+        "sizes": [await run_size(args, count, rng) for count in args.subscribers],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--seed-posts", type=int, default=1000)
+    parser.add_argument("--communities", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=100, help="posts created per second")
+    parser.add_argument("--buffer", type=int, default=256)
+    parser.add_argument("--stalled", type=float, default=0.01, help="fraction of subscribers that never read")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
@@ -0,0 +1,91 @@
+"""
+Reconnect after a few changes: GET /sync deltas vs reloading every list.
+
+A synthetic dataset (about 50k documents with the default 28k users) is
+written through a versioned Repository, a client is taken to have synced
+right after that, and then --changes documents across the four collections
+are updated and --deletes posts deleted. "full" is what a reconnect costs
+today: reading every collection whole, as /users, /communities, /events
+and /posts do. "delta" is sync() from the client's token. Bytes are the
+JSON the client downloads, reads are the fake's billed document reads.
+
+Runs on FakeFirestore with --latency seconds per round trip. The fake
+evaluates the version query by scanning its collection, where Firestore
+walks an index, so the delta's wall time still grows with the collection
+here while its reads and bytes only grow with the changes.
+
+Usage:
+    python -m benchmarks.delta_sync --users 28000 --changes 100
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmarks.document_lookup import summarize
+from fake_firestore import FakeFirestore
+from repository import Repository, encode_cursor
+from sync import SYNC_COLLECTIONS, VersionClock, sync
+from synthetic_data import generate_dataset
+
+
+async def full_reload(repo):
+    return {collection: await repo.list(collection) for collection in SYNC_COLLECTIONS}
+
+
+async def delta(repo, clock, token):
+    return await sync(repo, clock, list(SYNC_COLLECTIONS), token)
+
+
+async def measure(client, load, repeats):
+    samples = []
+    for _ in range(repeats):
+        client.reset_counters()
+        started = time.perf_counter()
+        result = await load()
+        samples.append(time.perf_counter() - started)
+    body = json.dumps(result, default=str, separators=(",", ":")).encode("utf-8")
+    return {**summarize(samples), "reads": client.reads, "bytes": len(body)}
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = FakeFirestore(latency=args.latency)
+    clock = VersionClock()
+    repo = Repository(client, versions=clock)
+    dataset = generate_dataset(args.users, seed=args.seed)
+    for collection in SYNC_COLLECTIONS:
+        await repo.bulk_create(collection, dataset[collection])
+    documents = sum(len(dataset[collection]) for collection in SYNC_COLLECTIONS)
+
+    # The client's last sync, just before the changes
+    token = encode_cursor([clock.now()])
+    ids = [(collection, document["id"]) for collection in SYNC_COLLECTIONS for document in dataset[collection]]
+    for collection, doc_id in rng.sample(ids, args.changes):
+        await repo.update(collection, doc_id, {"description" if collection != "users" else "bio": f"edited {doc_id}"})
+    for post in rng.sample(dataset["posts"], args.deletes):
+        await repo.delete("posts", post["id"])
+
+    full = await measure(client, lambda: full_reload(repo), args.repeats)
+    changes = await measure(client, lambda: delta(repo, clock, token), args.repeats)
+    return {
+        "documents": documents,
+        "changes": args.changes,
+        "deletes": args.deletes,
+        "full": full,
+        "delta": changes,
+        "bytes_ratio": full["bytes"] / changes["bytes"],
+        "reads_ratio": full["reads"] / changes["reads"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=28000)
+    parser.add_argument("--changes", type=int, default=100)
+    parser.add_argument("--deletes", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
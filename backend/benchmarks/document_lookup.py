@@ -0,0 +1,77 @@
+"""
+Before/after latency of fetching a community by its app-level id.
+
+"query" is the old pattern: where("id", "==", x).get()[0] followed by a
+document(...).get(), i.e. two round trips. "point" is the direct
+document(x).get() the routes use now.
+
+With FIRESTORE_EMULATOR_HOST set the benchmark talks to the Firestore emulator
+(project GCLOUD_PROJECT, default "demo-togather"); otherwise it uses
+FakeFirestore with --latency seconds per simulated round trip.
+
+Usage:
+    python -m benchmarks.document_lookup --documents 1000 --lookups 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from fake_firestore import FakeFirestore
+
+
+def make_client(latency):
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore
+        return firestore.AsyncClient(project=os.getenv("GCLOUD_PROJECT", "demo-togather"))
+    return FakeFirestore(latency=latency)
+
+
+async def query_lookup(collection, community_id):
+    snapshot = (await collection.where("id", "==", community_id).get())[0]
+    return (await collection.document(snapshot.id).get()).to_dict()
+
+
+async def point_lookup(collection, community_id):
+    return (await collection.document(community_id).get()).to_dict()
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+    return {"mean_ms": sum(ordered) / len(ordered) * 1000, "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+async def run(args):
+    client = make_client(args.latency)
+    collection = client.collection(args.collection)
+    ids = [f"bench-comm-{i}" for i in range(args.documents)]
+    for start in range(0, len(ids), 500):
+        batch = client.batch()
+        for community_id in ids[start:start + 500]:
+            batch.set(collection.document(community_id), {"id": community_id, "name": community_id, "memberCount": 0})
+        await batch.commit()
+
+    rng = random.Random(0)
+    targets = [rng.choice(ids) for _ in range(args.lookups)]
+    results = {"documents": args.documents, "lookups": args.lookups, "emulator": bool(os.getenv("FIRESTORE_EMULATOR_HOST"))}
+    for name, lookup in (("query", query_lookup), ("point", point_lookup)):
+        samples = []
+        for community_id in targets:
+            started = time.perf_counter()
+            await lookup(collection, community_id)
+            samples.append(time.perf_counter() - started)
+        results[name] = summarize(samples)
+    results["speedup"] = results["query"]["mean_ms"] / results["point"]["mean_ms"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--collection", default="bench_communities")
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
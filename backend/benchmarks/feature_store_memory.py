@@ -0,0 +1,94 @@
+"""
+Memory of the matching features: user dicts vs the columnar FeatureStore.
+
+"documents" is what matching used to hold: the users' to_dict() profiles as
+Firestore returns them (password, avatar, bios and all). "match_dicts" keeps
+only what find_top_similar_users reads (id, name, interests) as one dict per
+user. "feature_store" is FeatureStore and its interest vocabulary after
+applying the same users, with interests as int32 CSR term ids and interned
+ids and names. Each is measured with tracemalloc as the memory still allocated
+once it is built, and reported per 100k users.
+
+Synthetic users (synthetic_data) are decoded from JSON so every
+representation owns its strings like a listener snapshot would. Interests
+are embedded with a hashing stand-in of the model's dimension; the stand-in
+only changes the values, not the sizes. --weights adds the bio/prompt
+embedding rows and categorical codes stored when MATCH_WEIGHTS uses them.
+
+Usage:
+    python -m benchmarks.feature_store_memory --users 100000
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmarks.search import hashing_embed
+from feature_store import FeatureStore
+from interest_vocabulary import InterestVocabulary
+from nlp import parse_similarity_weights
+from synthetic_data import generate_dataset
+
+CHUNK_SIZE = 5000
+
+
+def measure(build):
+    """Bytes still allocated after build() returns, and its result"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return allocated, result
+
+
+def decode(chunks):
+    return [user for chunk in chunks for user in json.loads(chunk)]
+
+
+def build_store(chunks, weights):
+    store = FeatureStore(InterestVocabulary(hashing_embed), hashing_embed, weights=weights)
+    for chunk in chunks:
+        store.upsert_many(json.loads(chunk))
+    return store
+
+
+def run(args):
+    users = generate_dataset(args.users, seed=args.seed)["users"]
+    chunks = [json.dumps(users[start:start + CHUNK_SIZE]) for start in range(0, len(users), CHUNK_SIZE)]
+    del users
+    weights = parse_similarity_weights(args.weights)
+
+    documents_bytes, documents = measure(lambda: decode(chunks))
+    match_dicts_bytes, _ = measure(lambda: [
+        {"id": user["id"], "name": user.get("name"), "interests": user.get("interests") or []}
+        for user in decode(chunks)
+    ])
+    del documents
+    store_bytes, store = measure(lambda: build_store(chunks, weights))
+
+    per_100k = 100000 / args.users
+    return {
+        "users": args.users,
+        "weights": weights,
+        "vocabulary": len(store.vocabulary),
+        "bytes_per_100k_users": {
+            "documents": round(documents_bytes * per_100k),
+            "match_dicts": round(match_dicts_bytes * per_100k),
+            "feature_store": round(store_bytes * per_100k),
+            "feature_store_columns": round(store.nbytes() * per_100k),
+        },
+        "documents_vs_feature_store": documents_bytes / store_bytes,
+        "match_dicts_vs_feature_store": match_dicts_bytes / store_bytes,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--weights", default="interests=1", help="MATCH_WEIGHTS to size the store for")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(run(parser.parse_args()), indent=4))
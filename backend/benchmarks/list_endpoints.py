@@ -0,0 +1,79 @@
+"""
+Memory and latency of GET /users: whole collection vs one slim page.
+
+Seeds FakeFirestore with N copies of the mock user schema and requests
+/users through the ASGI app, once without parameters (the previous
+behaviour) and once as a Discovery-style page
+(limit=50&fields=id,name,avatarUrl,interests&order_by=name). Peak Python
+allocations are measured with tracemalloc in a separate untimed request. Latency
+includes the fake's in-memory query, not a network round trip.
+
+Usage:
+    python -m benchmarks.list_endpoints --sizes 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+os.environ.setdefault("NLP_WARMUP", "lazy")
+
+import httpx
+
+import main
+
+PAGE_PARAMS = {"limit": 50, "fields": "id,name,avatarUrl,interests", "order_by": "name"}
+
+
+def seed(size):
+    store = main.db._store("users")
+    store.clear()
+    template = main.MOCK_USERS[0]
+    for i in range(size):
+        user_id = f"user-{i}"
+        store[user_id] = {**template, "id": user_id, "name": f"User {i}", "email": f"user{i}@test.com"}
+
+
+async def measure(client, params, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        response = await client.get("/users", params=params)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+    size = len(response.content)
+
+    # Separate pass: tracemalloc slows allocation-heavy code down considerably
+    tracemalloc.start()
+    await client.get("/users", params=params)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "peak_alloc_mb": peak / 2**20,
+        "response_kb": size / 1024,
+    }
+
+
+async def run(args):
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for size in args.sizes:
+            seed(size)
+            results.append({
+                "documents": size,
+                "full_collection": await measure(client, {}, args.repeats),
+                "page": await measure(client, PAGE_PARAMS, args.repeats),
+            })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeats", type=int, default=3)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
@@ -0,0 +1,123 @@
+"""
+Concurrent joins of one community: read-modify-write PATCH vs atomic membership.
+
+"patch" is what the app does today: read the community, append the user to
+members, bump memberCount and write both back. Concurrent joins read the
+same snapshot, so later writes overwrite earlier ones and joins are lost.
+"atomic" is Membership with ArrayUnion/Increment in a transaction that only
+reads the user. "sharded" is Membership with subcollection storage and a
+sharded counter, which additionally stops writing the community document.
+
+Lost joins are the expected minus the final memberCount; community writes
+(counted on the fake only) stand in for the per-document write rate that
+Firestore throttles.
+
+With FIRESTORE_EMULATOR_HOST set the benchmark talks to the Firestore emulator
+(project GCLOUD_PROJECT, default "demo-togather"); otherwise it uses
+FakeFirestore with --latency seconds per simulated round trip.
+
+Usage:
+    python -m benchmarks.membership_contention --joins 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.document_lookup import make_client
+from fake_firestore import FakeFirestore
+from membership import SHARDS_FIELD, Membership
+from repository import Repository
+
+
+async def patch_join(repo, membership, community_id, user_id):
+    communities, users = repo.collection("communities"), repo.collection("users")
+    community = (await communities.document(community_id).get()).to_dict()
+    user = (await users.document(user_id).get()).to_dict()
+    await communities.document(community_id).update({
+        "members": community["members"] + [user_id],
+        "memberCount": community["memberCount"] + 1,
+    })
+    await users.document(user_id).update({"joinedCommunityIds": user["joinedCommunityIds"] + [community_id]})
+
+
+async def atomic_join(repo, membership, community_id, user_id):
+    await membership.join(community_id, user_id)
+
+
+STRATEGIES = {
+    "patch": (patch_join, "array", 0),
+    "atomic": (atomic_join, "array", 0),
+    "sharded": (atomic_join, "subcollection", None),
+}
+
+
+async def seed(client, community_id, joins, shards):
+    # Fresh ids per strategy, so emulator runs do not see each other's writes
+    users = [f"{community_id}-user-{i}" for i in range(joins)]
+    for start in range(0, len(users), 500):
+        batch = client.batch()
+        for user_id in users[start:start + 500]:
+            batch.set(client.collection("users").document(user_id), {"id": user_id, "joinedCommunityIds": []})
+        await batch.commit()
+    community = {"id": community_id, "name": "Hot community", "members": [], "memberCount": 0}
+    if shards:
+        community[SHARDS_FIELD] = shards
+    await client.collection("communities").document(community_id).set(community)
+    return users
+
+
+async def run_strategy(args, name):
+    join, storage, shards = STRATEGIES[name]
+    client = make_client(args.latency)
+    repo = Repository(client, max_concurrency=args.concurrency)
+    membership = Membership(repo, "communities", "joinedCommunityIds", "members", "memberCount", storage)
+    community_id = f"bench-{name}-{int(time.time())}"
+    users = await seed(client, community_id, args.joins, args.shards if shards is None else shards)
+    fake = isinstance(client, FakeFirestore)
+    community_path = f"communities/{community_id}"
+    community_writes = client._versions.get(community_path, 0) if fake else None
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    errors = 0
+
+    async def one(user_id):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await join(repo, membership, community_id, user_id)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(user_id) for user_id in users))
+    elapsed = time.perf_counter() - started
+
+    snapshot = await client.collection("communities").document(community_id).get()
+    community = (await membership.with_member_counts([snapshot.to_dict()]))[0]
+    return {
+        "seconds": elapsed,
+        "joins_per_second": len(users) / elapsed,
+        "member_count": community["memberCount"],
+        "lost_joins": len(users) - community["memberCount"],
+        "failed_joins": errors,
+        "community_writes": client._versions.get(community_path, 0) - community_writes if fake else None,
+        "aborted_transactions": client.aborts if fake else None,
+    }
+
+
+async def run(args):
+    results = {"joins": args.joins, "concurrency": args.concurrency, "shards": args.shards}
+    for name in args.strategies:
+        results[name] = await run_strategy(args, name)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--joins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--shards", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=list(STRATEGIES))
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
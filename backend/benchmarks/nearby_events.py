@@ -0,0 +1,93 @@
+"""
+GET /events/nearby: geohash range queries vs scanning every event.
+
+"scan" is what the app does today: read all events and keep those within the
+radius. "geohash" is geo.nearby_events. Events are spread with the same density
+over an area that grows with the collection, so the number of events near any
+point stays the same while the collection grows: geohash reads should stay
+flat (a few times the results) while the scan reads grow linearly.
+
+Runs on FakeFirestore, seeded directly; reads are the fake's billed document
+reads and the metric to compare. The fake evaluates every query by scanning
+its whole collection, where Firestore walks an index, so its wall time grows
+with the collection for both strategies and only shows the cost of the reads
+returned on top of that.
+
+Usage:
+    python -m benchmarks.nearby_events --events 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+
+import numpy as np
+
+from benchmarks.document_lookup import summarize
+from fake_firestore import FakeFirestore
+from geo import haversine_km, nearby_events, with_geohash
+from repository import Repository
+
+CENTER = (22.3193, 114.1694)
+
+
+def seed(client, count, density, rng):
+    side = math.sqrt(count / density)
+    store = client._store("events")
+    store.clear()
+    for i in range(count):
+        event = with_geohash({
+            "id": f"event-{i}",
+            "name": f"Event {i}",
+            "latitude": CENTER[0] + rng.uniform(-side / 2, side / 2),
+            "longitude": CENTER[1] + rng.uniform(-side / 2, side / 2),
+        })
+        store[event["id"]] = event
+    return side
+
+
+async def scan(repo, latitude, longitude, radius_km):
+    events = await repo.list("events")
+    distances = haversine_km(latitude, longitude, np.array([e["latitude"] for e in events]), np.array([e["longitude"] for e in events]))
+    return [event for event, distance in zip(events, distances) if distance <= radius_km]
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    results = {"radius_km": args.radius, "density_per_square_degree": args.density, "sizes": []}
+    for count in args.events:
+        client = FakeFirestore(latency=args.latency)
+        repo = Repository(client)
+        side = seed(client, count, args.density, rng)
+        points = [
+            (CENTER[0] + rng.uniform(-side / 4, side / 4), CENTER[1] + rng.uniform(-side / 4, side / 4))
+            for _ in range(args.queries)
+        ]
+        entry = {"events": count}
+        for name, query in (("geohash", nearby_events), ("scan", scan)):
+            samples, matches = [], 0
+            client.reset_counters()
+            for latitude, longitude in points:
+                started = time.perf_counter()
+                matches += len(await query(repo, latitude, longitude, args.radius))
+                samples.append(time.perf_counter() - started)
+            entry[name] = {
+                **summarize(samples),
+                "results_per_query": matches / len(points),
+                "reads_per_query": client.reads / len(points),
+            }
+        results["sizes"].append(entry)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--events", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--density", type=float, default=2000, help="events per square degree")
+    parser.add_argument("--radius", type=float, default=5.0, help="query radius in km")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=4))
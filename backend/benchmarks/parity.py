@@ -0,0 +1,141 @@
+"""
+Check that the batched matcher scores like the original per-pair loop.
+
+The reference is the loop the matcher replaced: model.encode on each user's
+raw interest strings, cosine_similarity between the two lists, then the
+max over the candidate's interests and the mean over the target's. It does
+not go through the embedding cache or the interest vocabulary, so a change
+to either (or to the similarity table) shows up as a difference.
+
+find_top_similar_users (interests only) and score_candidates are run for
+--targets synthetic users against --candidates others with near-synonym
+merging turned off. Every score must equal the reference within --tolerance
+(float32 rounding), and the top matches must carry the --top-n best
+reference scores. Exits with status 1 and the differences on stderr when
+they do not, so it can gate a change to the matcher.
+
+The drift that merging at INTEREST_MERGE_THRESHOLD adds on top of that is
+reported separately (largest score difference and how many of the
+reference's top matches are kept); it is expected and does not fail the
+check.
+
+Runs offline with the model loaded from the local Hugging Face cache
+(HF_HUB_OFFLINE=1), as in benchmarks.suite.
+
+Usage:
+    python -m benchmarks.parity --candidates 1000 --targets 5
+"""
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+import nlp
+from synthetic_data import generate_dataset
+
+
+class Reference:
+    """Per-pair interest scores as the original loop computed them"""
+
+    def __init__(self, model):
+        self.model = model
+        self._embeddings = {}
+
+    def embeddings(self, interests):
+        # Each distinct string is encoded once; the vectors are the ones
+        # model.encode gives for the raw strings
+        new = [interest for interest in dict.fromkeys(interests) if interest not in self._embeddings]
+        if new:
+            self._embeddings.update(zip(new, self.model.encode(new)))
+        return np.asarray([self._embeddings[interest] for interest in interests])
+
+    def score(self, interests1, interests2):
+        if not interests1 or not interests2:
+            return 0.0
+        similarity_matrix = cosine_similarity(self.embeddings(interests1), self.embeddings(interests2))
+        return float(np.mean(np.max(similarity_matrix, axis=1)))
+
+
+def check(reference, users, target, top_n, tolerance):
+    """Differences between the batched matcher and the reference for one target"""
+    candidates = [user for user in users if user["id"] != target["id"] and user.get("interests")]
+    expected = {user["id"]: reference.score(target["interests"], user["interests"]) for user in candidates}
+    best = sorted(expected.values(), reverse=True)[:top_n]
+
+    problems = []
+    scores = nlp.score_candidates(target["interests"], [user["interests"] for user in candidates])
+    for user, score in zip(candidates, scores):
+        if abs(float(score) - expected[user["id"]]) > tolerance:
+            problems.append(f"{target['id']} -> {user['id']}: score_candidates {float(score)} vs reference {expected[user['id']]}")
+
+    result = nlp.find_top_similar_users({"users": users}, target["id"], top_n, weights={"interests": 1.0})
+    if not isinstance(result, dict) or "error" in result:
+        return problems + [f"{target['id']}: find_top_similar_users failed: {result}"]
+    top = [match["similarity_score"] for match in result["top_matches"]]
+    for match in result["top_matches"]:
+        if abs(match["similarity_score"] - expected[match["id"]]) > tolerance:
+            problems.append(f"{target['id']} -> {match['id']}: {match['similarity_score']} vs reference {expected[match['id']]}")
+    if len(top) != len(best) or np.abs(np.array(top) - np.array(best)).max(initial=0) > tolerance:
+        problems.append(f"{target['id']}: top scores {top} vs reference {best}")
+    return problems
+
+
+def merge_drift(reference, users, targets, top_n):
+    """Largest score difference and share of the reference's top matches kept, with merging on"""
+    largest, kept = 0.0, []
+    for target in targets:
+        candidates = [user for user in users if user["id"] != target["id"] and user.get("interests")]
+        expected = np.array([reference.score(target["interests"], user["interests"]) for user in candidates])
+        scores = nlp.score_candidates(target["interests"], [user["interests"] for user in candidates])
+        largest = max(largest, float(np.abs(scores - expected).max(initial=0)))
+        kept.append(len(set(np.argsort(-expected, kind="stable")[:top_n]) & set(np.argsort(-scores, kind="stable")[:top_n])) / top_n)
+    return {"max_abs_difference": largest, "top_n_kept": float(np.mean(kept)) if kept else 1.0}
+
+
+def _use_vocabulary(merge_threshold):
+    nlp.interest_vocabulary.merge_threshold = merge_threshold
+    nlp.interest_vocabulary.clear()
+
+
+def run(args):
+    users = generate_dataset(args.candidates + 1, seed=args.seed)["users"]
+    reference = Reference(nlp.get_model())
+    targets = [user for user in users if user.get("interests")][:args.targets]
+    configured = nlp.interest_vocabulary.merge_threshold
+
+    # Above 1 nothing is merged, so the engine must match the reference exactly
+    _use_vocabulary(1.01)
+    problems = []
+    for target in targets:
+        problems += check(reference, users, target, args.top_n, args.tolerance)
+
+    _use_vocabulary(configured)
+    drift = merge_drift(reference, users, targets, args.top_n)
+    summary = {
+        "candidates": args.candidates,
+        "targets": len(targets),
+        "top_n": args.top_n,
+        "tolerance": args.tolerance,
+        "mismatches": len(problems),
+        "merging": {"merge_threshold": configured, "merged_terms": nlp.interest_vocabulary.merged, **drift},
+    }
+    return summary, problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--candidates", type=int, default=1000)
+    parser.add_argument("--targets", type=int, default=5)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=1e-5)
+    parser.add_argument("--seed", type=int, default=0)
+    summary, problems = run(parser.parse_args())
+    print(json.dumps(summary, indent=4))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
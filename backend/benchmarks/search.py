@@ -0,0 +1,119 @@
+"""
+GET /search latency at growing index sizes.
+
+Indexes synthetic communities, events and posts (synthetic_data), saves and
+memory-maps the segment, then times keyword and hybrid (keyword + embedding
+re-rank) queries, plus queries right after a batch of incremental writes
+that are still pending in memory.
+
+Document embeddings come from a deterministic hashing stand-in of the
+model's dimension by default, so a 100k index builds in seconds; the ranking
+work per query is the same. --model embeds with MiniLM instead (the model
+has to be in the local Hugging Face cache).
+
+Usage:
+    python -m benchmarks.search --documents 10000 100000
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import numpy as np
+
+from benchmarks.suite import summarize
+from search_index import SEARCH_FIELDS, SearchIndex
+from synthetic_data import INTERESTS, generate_dataset
+
+DIMENSION = 384
+
+
+def hashing_embed(texts):
+    vectors = np.zeros((len(texts), DIMENSION), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in text.lower().split():
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            vectors[row, int.from_bytes(digest, "little") % DIMENSION] += 1.0
+    return vectors + 1e-3
+
+
+def documents(count, seed):
+    """About count searchable documents, mostly posts as in the real data"""
+    dataset = generate_dataset(max(count // 2, 10), seed=seed)
+    corpus = {collection: dataset[collection] for collection in SEARCH_FIELDS}
+    rng = random.Random(seed)
+    posts = corpus["posts"]
+    while sum(len(docs) for docs in corpus.values()) < count:
+        post = rng.choice(posts)
+        posts.append({**post, "id": f"post-{len(posts)}", "content": f"{post['content']} {rng.choice(INTERESTS).lower()} #{len(posts)}"})
+    return corpus
+
+
+def timed(function, queries):
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        function(query)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def run(args):
+    embed = hashing_embed
+    if args.model:
+        import nlp
+        embed = nlp.run_model
+    rng = random.Random(args.seed)
+    queries = [" ".join(rng.sample(INTERESTS, rng.randint(1, 2))).lower() for _ in range(args.queries)]
+    results = []
+    for count in args.documents:
+        corpus = documents(count, args.seed)
+        directory = tempfile.mkdtemp(prefix="search-bench-")
+        try:
+            index = SearchIndex(directory, embed, compact_every=10 ** 9)
+            started = time.perf_counter()
+            for collection, docs in corpus.items():
+                for start in range(0, len(docs), 1024):
+                    index.upsert_many(collection, docs[start:start + 1024])
+            build = time.perf_counter() - started
+            started = time.perf_counter()
+            index.save()
+            save = time.perf_counter() - started
+            started = time.perf_counter()
+            index = SearchIndex(directory, embed, compact_every=10 ** 9)
+            load = time.perf_counter() - started
+
+            entry = {
+                "documents": index.stats()["documents"],
+                "build_seconds": build,
+                "save_seconds": save,
+                "load_seconds": load,
+                "disk_mb": sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names) / 2 ** 20,
+                "keyword": timed(lambda query: index.search(query, semantic=False), queries),
+                "hybrid": timed(lambda query: index.search(query), queries),
+                # No term matches, so these rank the whole embedding matrix
+                "semantic_fallback": timed(lambda query: index.search("qqqq zzzz"), queries),
+            }
+            posts = corpus["posts"]
+            index.upsert_many("posts", [{**post, "content": post["content"] + " updated"} for post in posts[:args.pending]])
+            entry["hybrid_with_pending"] = {"pending": args.pending, **timed(lambda query: index.search(query), queries)}
+            results.append(entry)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {"queries": args.queries, "model": bool(args.model), "sizes": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--pending", type=int, default=500, help="incremental writes left uncompacted")
+    parser.add_argument("--model", action="store_true", help="embed with MiniLM instead of the hashing stand-in")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(run(parser.parse_args()), indent=4))
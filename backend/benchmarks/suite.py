@@ -0,0 +1,274 @@
+"""
+Benchmark suite for the backend hot paths, written as JSON for run-to-run comparison.
+
+Sections:
+    matcher: find_top_similar_users at 10/100/1k/10k candidates (cold and warm
+        embedding cache and interest vocabulary), compare_interests_transformer
+        per call, and the batched scores against the original per-pair loop
+    lists: GET /users (whole and paged), /communities, /events and /posts at
+        several collection sizes, with and without the response cache
+    e2e: p50/p95/p99 per route under concurrent mixed load through the ASGI app
+
+Everything runs offline: Firestore is the in-memory fake, data comes from
+synthetic_data with a fixed seed, and the model is loaded from the local
+Hugging Face cache (HF_HUB_OFFLINE=1), so it has to have been downloaded once.
+
+Usage:
+    python -m benchmarks.suite --out bench.json
+    python -m benchmarks.suite --only matcher --baseline bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("FIRESTORE_BACKEND", "memory")
+os.environ.setdefault("NLP_WARMUP", "lazy")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+import httpx
+import numpy as np
+
+import main
+import nlp
+from benchmarks.async_vs_sync import percentile
+from benchmarks.parity import Reference
+from synthetic_data import generate_dataset
+
+SECTIONS = ("matcher", "lists", "e2e")
+
+
+def timed(function, repeats):
+    """Latency summary in milliseconds of repeated calls"""
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "p99_ms": percentile(samples, 0.99) * 1000,
+    }
+
+
+def seed(users, seed=0):
+    """Replace the fake's contents with a synthetic dataset of the given size"""
+    dataset = generate_dataset(users, seed=seed)
+    for collection, documents in dataset.items():
+        store = main.db._store(collection)
+        store.clear()
+        store.update((document["id"], document) for document in documents)
+    main.response_cache.invalidate(*dataset)
+    return dataset
+
+
+# --- Matcher ---
+
+def bench_matcher(args):
+    users = generate_dataset(max(args.candidates) + 1, seed=args.seed)["users"]
+    target = users[0]
+    nlp.get_model()
+
+    results = {"find_top_similar_users": []}
+    for count in args.candidates:
+        users_data = {"users": users[:count + 1]}
+        nlp.embedding_cache.clear()
+        nlp.interest_vocabulary.clear()
+        cold = timed(lambda: nlp.find_top_similar_users(users_data, target["id"]), 1)
+        warm = timed(lambda: nlp.find_top_similar_users(users_data, target["id"]), args.repeats)
+        results["find_top_similar_users"].append({"candidates": count, "cold_ms": cold["mean_ms"], **warm})
+
+    rng = random.Random(args.seed)
+    pairs = [(rng.choice(users)["interests"], rng.choice(users)["interests"]) for _ in range(args.repeats * 20)]
+    started = time.perf_counter()
+    for first, second in pairs:
+        nlp.compare_interests_transformer(first, second)
+    results["compare_interests_transformer"] = {"calls": len(pairs), "mean_ms": (time.perf_counter() - started) / len(pairs) * 1000}
+
+    # Batched scores against the original model.encode + cosine_similarity loop;
+    # the difference includes near-synonym merging (benchmarks.parity checks
+    # the engine with merging off)
+    candidates = [user for user in users[1:101] if user.get("interests")]
+    batched = nlp.score_candidates(target["interests"], [user["interests"] for user in candidates])
+    reference = Reference(nlp.get_model())
+    expected = np.array([reference.score(target["interests"], user["interests"]) for user in candidates])
+    results["parity"] = {"candidates": len(candidates), "max_abs_difference": float(np.abs(batched - expected).max())}
+    return results
+
+
+# --- List endpoints ---
+
+async def bench_lists(args, client):
+    results = []
+    for size in args.sizes:
+        seed(size, args.seed)
+        routes = {
+            "users_full": ("/users", {}, None),
+            "users_page": ("/users", {"limit": 50, "fields": "id,name,avatarUrl,interests", "order_by": "name"}, None),
+            "communities": ("/communities", {}, "communities"),
+            "events": ("/events", {}, "events"),
+            "posts_page": ("/posts", {"limit": 50}, "posts"),
+        }
+        entry = {"users": size}
+        for name, (path, params, tag) in routes.items():
+            async def uncached():
+                if tag:
+                    main.response_cache.invalidate(tag)
+                (await client.get(path, params=params)).raise_for_status()
+
+            async def cached():
+                (await client.get(path, params=params)).raise_for_status()
+
+            entry[name] = await timed_async(uncached, args.repeats)
+            if tag:
+                entry[name + "_cached"] = await timed_async(cached, args.repeats)
+        results.append(entry)
+    return results
+
+
+async def timed_async(function, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await function()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+# --- End to end ---
+
+async def bench_e2e(args, client):
+    dataset = seed(args.e2e_users, args.seed)
+    rng = random.Random(args.seed)
+    attendees = [user["id"] for user in dataset["users"] if "event-0" in user["signedUpEventIds"] and user["interests"]]
+    communities = [community["id"] for community in dataset["communities"]]
+
+    def request():
+        route = rng.choices(["posts", "community", "events", "match"], weights=[4, 3, 2, 1])[0]
+        if route == "posts":
+            return route, "/posts", {"limit": 20}
+        if route == "community":
+            return route, f"/communities/{rng.choice(communities)}", {}
+        if route == "events":
+            return route, "/events", {}
+        return route, "/find-similar-users", {"user_id": rng.choice(attendees), "event_id": "event-0", "top_n": 5}
+
+    # Warm up: fill the response cache, load the model and let the match lists
+    # of the event be built, so the timed run measures the steady state
+    for path, params in (("/posts", {"limit": 20}), ("/events", {})):
+        await client.get(path, params=params)
+    await client.get("/find-similar-users", params={"user_id": attendees[0], "event_id": "event-0"})
+    for _ in range(100):
+        if main.match_store.has_event("event-0"):
+            break
+        await asyncio.sleep(0.05)
+
+    latencies = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(route, path, params):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            response.raise_for_status()
+            latencies.setdefault(route, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*request()) for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "users": args.e2e_users,
+        "event_attendees": len(attendees),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "throughput_rps": args.requests / elapsed,
+        "all": summarize([sample for samples in latencies.values() for sample in samples]),
+        "routes": {route: summarize(samples) for route, samples in sorted(latencies.items())},
+    }
+
+
+# --- Run and compare ---
+
+def environment():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {
+        "revision": revision,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "model": nlp.model_status(),
+    }
+
+
+def compare(current, baseline, path=""):
+    """Ratio current / baseline of every *_ms value present in both runs"""
+    changes = {}
+    if isinstance(current, dict) and isinstance(baseline, dict):
+        for key, value in current.items():
+            if key in baseline:
+                changes.update(compare(value, baseline[key], f"{path}.{key}" if path else key))
+    elif isinstance(current, list) and isinstance(baseline, list):
+        for index, (value, previous) in enumerate(zip(current, baseline)):
+            changes.update(compare(value, previous, f"{path}[{index}]"))
+    elif path.endswith("_ms") and isinstance(current, (int, float)) and baseline:
+        changes[path] = current / baseline
+    return changes
+
+
+async def run(args):
+    results = {}
+    if "matcher" in args.only:
+        results["matcher"] = await asyncio.to_thread(bench_matcher, args)
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if "lists" in args.only:
+                results["lists"] = await bench_lists(args, client)
+            if "e2e" in args.only:
+                results["e2e"] = await bench_e2e(args, client)
+    results["environment"] = environment()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--only", nargs="+", choices=SECTIONS, default=list(SECTIONS))
+    parser.add_argument("--candidates", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--e2e-users", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results to this file instead of stdout")
+    parser.add_argument("--baseline", help="previous results file to compare *_ms values against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            results["change_vs_baseline"] = compare(results, json.load(f))
+    output = json.dumps(results, indent=4)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,112 @@
+"""
+Check that paging through sync() advances and returns every change.
+
+Documents are written to --collections of the synced collections through a
+versioned Repository whose clock hands out each version to --ties writes,
+as writes from several workers can share a version, and then --deletes
+posts are deleted. The changes are drained with sync(limit=--limit) until
+hasMore is false, both from scratch and from a token taken before the
+writes, for each collection alone and for all of them together. Every
+document and delete must come back exactly once, and the drain must finish
+within one call per change. Exits with status 1 and the problems on stderr
+otherwise.
+
+Runs on FakeFirestore.
+
+Usage:
+    python -m benchmarks.sync_paging --limit 1
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import Counter
+
+from fake_firestore import FakeFirestore
+from repository import Repository, encode_cursor
+from sync import SYNC_COLLECTIONS, VersionClock, sync
+from synthetic_data import generate_dataset
+
+
+class TiedClock(VersionClock):
+    """VersionClock giving the same version to ties consecutive writes"""
+
+    def __init__(self, ties):
+        super().__init__()
+        self.ties = ties
+        self._given = 0
+
+    def next(self):
+        if self._given % self.ties == 0:
+            self._version = super().next()
+        self._given += 1
+        return self._version
+
+
+async def drain(repo, clock, collections, since, limit, most_calls):
+    """(upserted (collection, id) counts, deleted (collection, id) counts, calls) of paging from since"""
+    upserted, deleted = Counter(), Counter()
+    for calls in range(1, most_calls + 1):
+        result = await sync(repo, clock, collections, since, limit, overlap=0)
+        for collection, delta in result["changes"].items():
+            upserted.update((collection, document["id"]) for document in delta["upserted"])
+            deleted.update((collection, doc_id) for doc_id in delta["deleted"])
+        since = result["token"]
+        if not result["hasMore"]:
+            return upserted, deleted, calls
+    return upserted, deleted, None
+
+
+async def check(collections, users, ties, deletes, limit):
+    """Problems found draining collections with sync(limit=limit)"""
+    clock = TiedClock(ties)
+    repo = Repository(FakeFirestore(), versions=clock)
+    dataset = generate_dataset(users, seed=0)
+    before = encode_cursor([clock.now() - 1])
+    for collection in collections:
+        await repo.bulk_create(collection, dataset[collection])
+    written = {(collection, document["id"]) for collection in collections for document in dataset[collection]}
+    removed = set()
+    if "posts" in collections:
+        for post in dataset["posts"][:deletes]:
+            await repo.delete("posts", post["id"])
+            removed.add(("posts", post["id"]))
+
+    problems = []
+    for name, since in (("scratch", None), ("token", before)):
+        upserted, deleted, calls = await drain(repo, clock, collections, since, limit, len(written) + len(removed) + 1)
+        if calls is None:
+            problems.append(f"{name}: hasMore still set after {len(written) + len(removed) + 1} calls")
+        expected = written - removed
+        if set(upserted) != expected:
+            problems.append(f"{name}: {len(expected - set(upserted))} documents missing, {len(set(upserted) - expected)} unexpected")
+        if since is not None and set(deleted) != removed:
+            problems.append(f"{name}: {len(removed - set(deleted))} deletes missing")
+        repeated = [key for key, times in (upserted + deleted).items() if times > 1]
+        if repeated:
+            problems.append(f"{name}: {len(repeated)} changes returned more than once, e.g. {repeated[0]}")
+    return {"collections": list(collections), "documents": len(written), "deletes": len(removed), "limit": limit}, problems
+
+
+async def run(args):
+    summaries, problems = [], []
+    for collections in ([name] for name in args.collections) if len(args.collections) > 1 else []:
+        summary, found = await check(collections, args.users, args.ties, args.deletes, args.limit)
+        summaries.append(summary)
+        problems += found
+    summary, found = await check(args.collections, args.users, args.ties, args.deletes, args.limit)
+    return [*summaries, summary], problems + found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--collections", nargs="+", default=list(SYNC_COLLECTIONS), choices=SYNC_COLLECTIONS)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--ties", type=int, default=3, help="consecutive writes sharing a version")
+    parser.add_argument("--deletes", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=1)
+    summaries, problems = asyncio.run(run(parser.parse_args()))
+    print(json.dumps(summaries, indent=4))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,88 @@
+import codecs
+import json
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import body is not valid NDJSON or a JSON array of objects"""
+
+
+async def iter_ndjson(chunks):
+    """Yield one document per non-empty line of a streamed NDJSON body"""
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield _parse_line(line, line_number)
+    if buffer.strip():
+        yield _parse_line(buffer, line_number + 1)
+
+
+def _parse_line(line, line_number):
+    try:
+        document = json.loads(line)
+    except ValueError as e:
+        raise ImportFormatError(f"Line {line_number}: {e}") from e
+    if not isinstance(document, dict):
+        raise ImportFormatError(f"Line {line_number}: expected a JSON object")
+    return document
+
+
+async def iter_json_array(chunks):
+    """
+    Yield the objects of a streamed JSON array without buffering the whole body
+
+    Elements are decoded with JSONDecoder.raw_decode as soon as they are
+    complete; consumed text is dropped from the buffer.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    text = ""
+    position = 0
+    state = "start"
+
+    async for chunk in chunks:
+        text = text[position:] + utf8.decode(chunk)
+        position = 0
+        while True:
+            while position < len(text) and text[position] in " \t\r\n":
+                position += 1
+            if position >= len(text):
+                break
+            character = text[position]
+            if state == "start":
+                if character != "[":
+                    raise ImportFormatError("Expected a JSON array")
+                position += 1
+                state = "element"
+            elif state == "separator":
+                if character == ",":
+                    position += 1
+                    state = "element"
+                elif character == "]":
+                    position += 1
+                    state = "done"
+                else:
+                    raise ImportFormatError(f"Unexpected '{character}' between array elements")
+            elif state == "element":
+                if character == "]":
+                    position += 1
+                    state = "done"
+                    continue
+                if character != "{":
+                    raise ImportFormatError("Expected a JSON object in the array")
+                try:
+                    document, position = decoder.raw_decode(text, position)
+                except ValueError:
+                    # Incomplete object: wait for the next chunk
+                    break
+                state = "separator"
+                yield document
+            else:
+                raise ImportFormatError("Unexpected data after the end of the array")
+
+    if state != "done":
+        raise ImportFormatError("Truncated JSON array")
@@ -0,0 +1,316 @@
+import asyncio
+import json
+import secrets
+import time
+from collections import deque
+
+from metrics import metrics
+
+# Filters a subscription can use per collection, and the field each one reads:
+# a document matches when that field (a list, a single id, or "id" for the
+# document's own id) holds the filter's id
+FILTER_FIELDS = {
+    "users": {"community": "joinedCommunityIds", "event": "signedUpEventIds"},
+    "communities": {"community": "id"},
+    "events": {"community": "communityId", "event": "id"},
+    "posts": {"community": "communityId", "event": "eventId"},
+}
+# Never sent to subscribers (nor returned by GET /sync): credentials, contact
+# details and the prompts only matching reads
+PRIVATE_FIELDS = {"users": ("password", "email", "privatePrompts")}
+
+
+class SubscriberLimitError(Exception):
+    pass
+
+
+class Message:
+    """A delta or control message, serialized once for every subscriber it goes to"""
+
+    __slots__ = ("json", "sse")
+
+    def __init__(self, cursor, text):
+        self.json = text
+        self.sse = f"id: {cursor}\ndata: {text}\n\n".encode("utf-8")
+
+
+class Subscription:
+    """
+    One client's filtered view of the feed, with a bounded buffer.
+
+    Filled by ChangeFeed on the event loop and drained by the client's
+    response with get().
+    """
+
+    def __init__(self, keys, max_buffer):
+        self.keys = keys
+        self.max_buffer = max_buffer
+        self.closed = False
+        self._buffer = deque()
+        self._wakeup = asyncio.Event()
+
+    def push(self, message):
+        """Buffer message; False, buffering nothing, when the buffer is full"""
+        if len(self._buffer) >= self.max_buffer:
+            return False
+        self._buffer.append(message)
+        self._wakeup.set()
+        return True
+
+    def reset(self, message):
+        """Drop everything buffered for message (the reset telling the client to reload)"""
+        self._buffer.clear()
+        self._buffer.append(message)
+        self._wakeup.set()
+
+    async def get(self, timeout=None):
+        """
+        Buffered messages, waiting up to timeout seconds for the first one
+
+        Returns:
+            list of Message, empty on timeout, or None once closed
+        """
+        if not self._buffer and not self.closed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.closed:
+            return None
+        messages = list(self._buffer)
+        self._buffer.clear()
+        return messages
+
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+
+
+class ChangeFeed:
+    """
+    Document-level deltas of Firestore collections, fanned out to subscribers.
+
+    listen() subscribes once per collection with on_snapshot. The listener
+    thread serializes every added, modified or removed document once and
+    hands it to the event loop, which appends it to the buffer of each
+    subscription whose filter it matches; subscribers are indexed by filter,
+    so a delta costs one append per interested client, not a scan of all of
+    them. A subscription filtered by a community or event is also sent
+    "added" or "removed" when a document starts or stops matching (a user
+    leaving the event), so the filter ids each document had are kept per
+    collection. The initial snapshot only records those; clients load the
+    lists once and then apply deltas.
+
+    Every message carries a cursor. Buffers are bounded: a subscriber more
+    than max_buffer messages behind has them dropped for a single "reset",
+    telling it to reload its lists. The last history deltas are kept so a
+    reconnecting client can resume after its last cursor; cursors older than
+    that, or from another process, get a reset too.
+
+    Args:
+        max_buffer: messages buffered per subscriber
+        history: deltas kept for resuming
+        max_subscribers: subscriptions served at once
+    """
+
+    def __init__(self, max_buffer=256, history=1024, max_subscribers=10000):
+        self.max_buffer = max_buffer
+        self.max_subscribers = max_subscribers
+        # Cursors are "<epoch>:<seq>", so ones from before a restart are recognised
+        self.epoch = secrets.token_hex(4)
+        self._seq = 0
+        self._history = deque(maxlen=history)
+        self._subscribers = {}
+        self._subscriptions = set()
+        # Filter keys per document id, each only touched by its collection's listener thread
+        self._matched = {}
+        self._keys = {}
+        self._watches = []
+        self._loop = None
+        self.changes = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    # --- Listening ---
+
+    def listen(self, collection, query, on_change=None):
+        """
+        Publish the changes to query's documents as collection's deltas
+
+        Must be called from the event loop the subscribers are served on.
+
+        Args:
+            collection: one of FILTER_FIELDS
+            query: collection or query supporting on_snapshot (the sync client's, or FakeFirestore's)
+            on_change: optional callable(documents, initial), called on the
+                listener thread with every snapshot's changed documents (None
+                for removed ones) as {id: data}, and initial=True for the
+                first snapshot, which holds every document
+
+        Returns:
+            the watch, also stopped by close()
+        """
+        self._loop = asyncio.get_running_loop()
+        self._matched[collection] = None
+        watch = query.on_snapshot(lambda documents, changes, read_time: self._on_snapshot(collection, changes, on_change))
+        self._watches.append(watch)
+        return watch
+
+    def _on_snapshot(self, collection, changes, on_change=None):
+        try:
+            matched = self._matched[collection]
+            initial = matched is None
+            if initial:
+                matched = self._matched[collection] = {}
+            private = PRIVATE_FIELDS.get(collection, ())
+            deltas = []
+            documents = {}
+            for change in changes:
+                doc_id = change.document.id
+                before = matched.get(doc_id, ())
+                change_type = change.type.name.lower()
+                if change_type == "removed":
+                    after, data = (), None
+                    documents[doc_id] = None
+                else:
+                    document = documents[doc_id] = change.document.to_dict()
+                    after = self._filter_keys(collection, doc_id, document)
+                    if not initial:
+                        data = {key: value for key, value in document.items() if key not in private}
+                        data = json.dumps({**data, "id": doc_id}, default=str, ensure_ascii=False, separators=(",", ":"))
+                if after:
+                    matched[doc_id] = after
+                else:
+                    matched.pop(doc_id, None)
+                if not initial:
+                    deltas.append((doc_id, change_type, data, before, after))
+            if deltas:
+                self._loop.call_soon_threadsafe(self._publish, collection, deltas)
+            if on_change is not None:
+                on_change(documents, initial)
+        except Exception:
+            metrics.inc("change_feed_errors_total", collection=collection)
+
+    def _filter_keys(self, collection, doc_id, document):
+        keys = []
+        for kind, field in FILTER_FIELDS[collection].items():
+            values = doc_id if field == "id" else document.get(field)
+            for value in values if isinstance(values, list) else (values,):
+                if isinstance(value, str) and value:
+                    key = (collection, kind, value)
+                    # Interned, as the same few ids recur across documents
+                    keys.append(self._keys.setdefault(key, key))
+        return tuple(keys)
+
+    def _publish(self, collection, deltas):
+        started = time.perf_counter()
+        for doc_id, change_type, data, before, after in deltas:
+            self._seq += 1
+            cursor = f"{self.epoch}:{self._seq}"
+            routes = {(collection, None, None): change_type}
+            for key in after:
+                routes[key] = "modified" if key in before else "added"
+            for key in before:
+                if key not in after:
+                    routes[key] = "removed"
+            messages = {}
+            routed = {}
+            for key, key_type in routes.items():
+                if key_type not in messages:
+                    messages[key_type] = Message(cursor, (
+                        f'{{"cursor":"{cursor}","collection":"{collection}","type":"{key_type}",'
+                        f'"id":{json.dumps(doc_id)},"data":{data if key_type != "removed" else "null"}}}'
+                    ))
+                routed[key] = messages[key_type]
+            self._history.append((self._seq, routed))
+            for key, message in routed.items():
+                for subscription in self._subscribers.get(key, ()):
+                    self._deliver(subscription, message)
+            self.changes += 1
+            metrics.inc("change_feed_changes_total", collection=collection)
+        metrics.observe("change_feed_publish_seconds", time.perf_counter() - started)
+
+    def _deliver(self, subscription, message):
+        if subscription.push(message):
+            self.delivered += 1
+        else:
+            self.overflows += 1
+            subscription.reset(self._control("reset"))
+
+    def _control(self, message_type):
+        cursor = f"{self.epoch}:{self._seq}"
+        return Message(cursor, f'{{"cursor":"{cursor}","type":"{message_type}"}}')
+
+    # --- Subscribers ---
+
+    @property
+    def full(self):
+        return len(self._subscriptions) >= self.max_subscribers
+
+    def subscribe(self, collections, kind=None, value=None, since=None):
+        """
+        Start buffering the deltas of collections, optionally only those matching a filter
+
+        The subscription's first message is "ready" with the current cursor,
+        preceded by the deltas after since when resuming (or a "reset" when
+        they are no longer kept).
+
+        Args:
+            collections: collection names, each supporting kind
+            kind, value: filter, e.g. ("community", community_id)
+            since: cursor of the last message the client received
+
+        Raises:
+            SubscriberLimitError: max_subscribers are already subscribed
+        """
+        if self.full:
+            raise SubscriberLimitError(f"{self.max_subscribers} subscribers already connected")
+        subscription = Subscription(tuple((collection, kind, value) for collection in collections), self.max_buffer)
+        self._subscriptions.add(subscription)
+        for key in subscription.keys:
+            self._subscribers.setdefault(key, set()).add(subscription)
+        if since is not None:
+            self._replay(subscription, since)
+        self._deliver(subscription, self._control("ready"))
+        return subscription
+
+    def _replay(self, subscription, since):
+        epoch, _, seq = since.partition(":")
+        seq = int(seq) if seq.isdigit() else -1
+        oldest = self._history[0][0] if self._history else self._seq + 1
+        if epoch != self.epoch or not 0 <= seq <= self._seq or seq + 1 < oldest:
+            self._deliver(subscription, self._control("reset"))
+            return
+        for entry_seq, routed in self._history:
+            if entry_seq > seq:
+                for key in subscription.keys:
+                    if key in routed:
+                        self._deliver(subscription, routed[key])
+
+    def unsubscribe(self, subscription):
+        subscription.close()
+        self._subscriptions.discard(subscription)
+        for key in subscription.keys:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def close(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+        for subscription in list(self._subscriptions):
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "tracked_documents": sum(len(matched or ()) for matched in self._matched.values()),
+            "history": len(self._history),
+            "changes": self.changes,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,169 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from tracing import count
+
+
+def normalize_interest(text):
+    """Canonical form used to address an interest: trimmed, single-spaced, case-folded."""
+    return " ".join(str(text).split()).casefold()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of sentence embeddings.
+
+    Entries are keyed by a hash of the model name and the normalized text, so
+    "Hiking" and " hiking " share one vector and switching models never serves
+    stale embeddings. Lookups go to a bounded in-process LRU first and then to
+    an optional sqlite file that survives restarts.
+
+    Args:
+        model_name: name of the model producing the embeddings
+        max_entries: maximum number of vectors kept in memory
+        path: optional sqlite file for the persistent store
+    """
+
+    def __init__(self, model_name, max_entries=10000, path=None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_calls = 0
+        self.encoded_texts = 0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def key(self, text):
+        normalized = normalize_interest(text)
+        return hashlib.sha1(f"{self.model_name}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, keys):
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        keys = list(keys)
+        # sqlite caps the number of bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).copy()
+        return found
+
+    def _store_on_disk(self, items):
+        if self._db is None or not items:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, text, vector) VALUES (?, ?, ?, ?)",
+            [(key, self.model_name, text, vector.tobytes()) for key, text, vector in items],
+        )
+        self._db.commit()
+
+    def encode(self, texts, encoder):
+        """
+        Return embeddings for texts, calling encoder only for unseen ones
+
+        Args:
+            texts: list of strings to embed
+            encoder: callable taking a list of strings and returning a 2D array
+
+        Returns:
+            float32 array with one row per input text
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            vectors = {}
+            pending = []
+            for key in keys:
+                if key in vectors:
+                    self.hits += 1
+                    continue
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+                    self.hits += 1
+                else:
+                    pending.append(key)
+
+            if pending:
+                for key, vector in self._load_from_disk(set(pending)).items():
+                    self._remember(key, vector)
+                    vectors[key] = vector
+                    self.disk_hits += 1
+
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in vectors and key not in missing:
+                    missing[key] = normalize_interest(text)
+            self.misses += len(missing)
+        count("embedding_cache_hits", len(keys) - len(missing))
+        count("embedding_cache_misses", len(missing))
+
+        if missing:
+            # The model runs outside the lock so concurrent readers are not blocked
+            # on a forward pass; the worst case is two threads encoding the same text.
+            encoded = np.asarray(encoder(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                self.encode_calls += 1
+                self.encoded_texts += len(missing)
+                stored = []
+                for (key, text), vector in zip(missing.items(), encoded):
+                    self._remember(key, vector)
+                    vectors[key] = vector
+                    stored.append((key, text, vector))
+                self._store_on_disk(stored)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "encode_calls": self.encode_calls,
+                "encoded_texts": self.encoded_texts,
+            }
+
+    def clear(self):
+        """Drop the in-memory entries and reset counters; the disk store is kept."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+            self.encode_calls = self.encoded_texts = 0
@@ -0,0 +1,544 @@
+import asyncio
+import functools
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import Aborted, AlreadyExists, NotFound
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, SERVER_TIMESTAMP, ArrayRemove, ArrayUnion, Increment
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+# Sentinel for fields a document does not have
+_MISSING = object()
+
+# Field path Firestore uses for the document id (FieldPath.document_id())
+DOCUMENT_ID = "__name__"
+
+
+class FakeFirestore:
+    """
+    In-memory stand-in for Firestore's AsyncClient.
+
+    Implements the subset of the async API the backend uses (collections and
+    subcollections, documents, add/set/update/delete with the ArrayUnion/
+    ArrayRemove/Increment transforms, batched get_all, transactions, where/
+    order_by/limit/start_after/select queries, streaming and on_snapshot
+    listeners) so the routes can run offline, e.g. in benchmarks.
+    An optional per-call latency simulates the network round trip, and the
+    reads/writes counters mirror how Firestore bills document operations.
+    Transactions are optimistic: a commit aborts when a document the
+    transaction read has been written since, and aborts counts how often.
+
+    Args:
+        latency: seconds to sleep on every simulated round trip
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._collections = {}
+        self._versions = {}
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+        self.aborts = 0
+        self._watches = []
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts, read_only)
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        """Batched lookup of many documents in a single round trip, like AsyncClient.get_all"""
+        references = list(references)
+        await self._round_trip()
+        self.reads += len(references)
+        for reference in references:
+            if transaction is not None:
+                transaction._record_read(reference)
+            data = self._store(reference.collection_name).get(reference.id)
+            if data is not None and field_paths is not None:
+                data = _project(data, field_paths)
+            yield FakeDocumentSnapshot(reference, _copy(data) if data is not None else None)
+
+    def _store(self, name):
+        return self._collections.setdefault(name, {})
+
+    def _write(self, kind, reference, data=None, merge=False):
+        store = self._store(reference.collection_name)
+        if kind == "delete":
+            store.pop(reference.id, None)
+        elif kind == "update" or (merge and reference.id in store):
+            _apply_update(store[reference.id], data)
+        else:
+            store[reference.id] = _transform(_MISSING, data)
+        self._versions[reference.path] = self._versions.get(reference.path, 0) + 1
+        self.writes += 1
+        for watch in list(self._watches):
+            if watch._collection == reference.collection_name:
+                watch._notify(reference.id, store.get(reference.id))
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def reset_counters(self):
+        self.reads = self.writes = self.round_trips = self.aborts = 0
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def get(self, field_path):
+        value = _lookup(self._data or {}, field_path)
+        return None if value is _MISSING else _copy(value)
+
+    def to_dict(self):
+        return _copy(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection, doc_id):
+        self._client = client
+        self.collection_name = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self.collection_name}/{self.id}"
+
+    def collection(self, name):
+        # Subcollections are stored under their full path, e.g. "communities/comm-1/members"
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None, transaction=None):
+        await self._client._round_trip()
+        self._client.reads += 1
+        if transaction is not None:
+            transaction._record_read(self)
+        data = self._client._store(self.collection_name).get(self.id)
+        if data is not None and field_paths is not None:
+            data = _project(data, field_paths)
+        return FakeDocumentSnapshot(self, _copy(data) if data is not None else None)
+
+    async def create(self, data):
+        await self._client._round_trip()
+        if self.id in self._client._store(self.collection_name):
+            raise AlreadyExists(f"Document already exists: {self.path}")
+        self._client._write("set", self, data)
+
+    async def set(self, data, merge=False):
+        await self._client._round_trip()
+        self._client._write("set", self, data, merge)
+
+    async def update(self, data):
+        await self._client._round_trip()
+        if self.id not in self._client._store(self.collection_name):
+            raise NotFound(f"No document to update: {self.path}")
+        self._client._write("update", self, data)
+
+    async def delete(self):
+        await self._client._round_trip()
+        self._client._write("delete", self)
+
+
+class FakeWriteBatch:
+    """Buffers writes and applies them together in a single round trip on commit"""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    async def commit(self):
+        await self._client._round_trip()
+        return self._apply()
+
+    def _apply(self):
+        # Validate first so a failing update leaves the batch unapplied
+        for kind, reference, _, _ in self._writes:
+            if kind == "update" and reference.id not in self._client._store(reference.collection_name):
+                raise NotFound(f"No document to update: {reference.path}")
+        for kind, reference, data, merge in self._writes:
+            self._client._write(kind, reference, data, merge)
+        writes, self._writes = self._writes, []
+        return writes
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Writes buffered until commit, like a batch, plus the private hooks
+    async_transactional drives (_begin/_commit/_rollback), so transactional
+    code runs unchanged against the fake. _commit raises Aborted when a
+    document read through the transaction changed in the meantime, which makes
+    async_transactional retry the whole function.
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    def _record_read(self, reference):
+        self._read_versions.setdefault(reference.path, self._client._versions.get(reference.path, 0))
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    async def _begin(self, retry_id=None):
+        await self._client._round_trip()
+        self._id = _new_id().encode("ascii")
+
+    async def _commit(self):
+        await self._client._round_trip()
+        for path, version in self._read_versions.items():
+            if self._client._versions.get(path, 0) != version:
+                self._client.aborts += 1
+                self._clean_up()
+                raise Aborted(f"Transaction lost contention on {path}")
+        writes = self._apply()
+        self._clean_up()
+        return writes
+
+    async def _rollback(self):
+        self._clean_up()
+
+
+class FakeQuery:
+    def __init__(self, client, collection, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        options = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "cursor": self._cursor,
+            "fields": self._fields,
+        }
+        options.update(changes)
+        return FakeQuery(self._client, self._collection, **options)
+
+    def where(self, field_path, op_string, value):
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Unsupported operator '{op_string}'")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def _sort_key(self, doc_id, data):
+        # Firestore breaks ties on the document id after the explicit orderings
+        return tuple(_type_rank(_field_value(doc_id, data, field)) for field, _ in self._orders) + (_type_rank(doc_id),)
+
+    def _descending(self):
+        flags = [str(direction).upper().startswith("DESC") for _, direction in self._orders]
+        # The implicit document id ordering follows the last explicit direction
+        return flags + [flags[-1] if flags else False]
+
+    def _matches(self, doc_id, data):
+        for field, op, value in self._filters:
+            if not _OPERATORS[op](_field_value(doc_id, data, field), value):
+                return False
+        # Firestore drops documents that lack an ordered field
+        return all(_field_value(doc_id, data, field) is not _MISSING for field, _ in self._orders)
+
+    def _run(self):
+        store = self._client._store(self._collection)
+        descending = self._descending()
+        rows = [(self._sort_key(doc_id, data), doc_id, data) for doc_id, data in store.items() if self._matches(doc_id, data)]
+        if len(set(descending)) == 1:
+            rows.sort(key=lambda row: row[0], reverse=descending[0])
+        else:
+            rows.sort(key=functools.cmp_to_key(lambda a, b: _compare_keys(a[0], b[0], descending)))
+
+        if self._cursor is not None:
+            if isinstance(self._cursor, FakeDocumentSnapshot):
+                cursor_key = self._sort_key(self._cursor.id, self._cursor._data or {})
+            else:
+                cursor_key = tuple(_type_rank(self._cursor.get(field, _MISSING)) for field, _ in self._orders)
+            # Rows are sorted, so everything after the first row past the cursor is kept
+            for position, row in enumerate(rows):
+                if _compare_keys(row[0][:len(cursor_key)], cursor_key, descending) > 0:
+                    rows = rows[position:]
+                    break
+            else:
+                rows = []
+
+        if self._limit is not None:
+            rows = rows[:self._limit]
+
+        snapshots = []
+        for _, doc_id, data in rows:
+            if self._fields is not None:
+                data = _project(data, self._fields)
+            reference = FakeDocumentReference(self._client, self._collection, doc_id)
+            snapshots.append(FakeDocumentSnapshot(reference, _copy(data)))
+        self._client.reads += max(len(snapshots), 1)
+        return snapshots
+
+    async def get(self):
+        await self._client._round_trip()
+        return self._run()
+
+    async def stream(self):
+        await self._client._round_trip()
+        for snapshot in self._run():
+            yield snapshot
+
+    def on_snapshot(self, callback):
+        return FakeWatch(self, callback)
+
+
+class FakeWatch:
+    """
+    Snapshot listener returned by on_snapshot, like the sync client's Watch.
+
+    The callback runs on a background thread with (documents, changes,
+    read_time): once with every matching document ADDED, then after writes
+    with the documents that were added, modified or removed. Writes that land
+    while the callback runs are delivered together in its next call, and
+    every delivered change is billed as a read. Only the query's filters are
+    applied; documents are not ordered.
+    """
+
+    def __init__(self, query, callback):
+        self._client = query._client
+        self._collection = query._collection
+        self._query = query
+        self._callback = callback
+        self._documents = {}
+        self._pending = {
+            doc_id: _copy(data)
+            for doc_id, data in self._client._store(self._collection).items()
+            if query._matches(doc_id, data)
+        }
+        self._client.reads += len(self._pending)
+        # Ids matching as of the last queued change, only touched by the writing thread
+        self._known = set(self._pending)
+        self._initial = True
+        self._closed = False
+        self._condition = threading.Condition()
+        self._client._watches.append(self)
+        self._thread = threading.Thread(target=self._run, name="fake-firestore-watch", daemon=True)
+        self._thread.start()
+
+    def _notify(self, doc_id, data):
+        # Called on the writing thread, so the data is copied before it can change again
+        if data is not None and not self._query._matches(doc_id, data):
+            data = None
+        if data is None and doc_id not in self._known:
+            return
+        if data is None:
+            self._known.discard(doc_id)
+        else:
+            self._known.add(doc_id)
+        with self._condition:
+            self._pending[doc_id] = _copy(data) if data is not None else None
+            self._condition.notify()
+        self._client.reads += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._initial and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                pending, self._pending, self._initial = self._pending, {}, False
+            changes = []
+            for doc_id, data in pending.items():
+                reference = FakeDocumentReference(self._client, self._collection, doc_id)
+                previous = self._documents.get(doc_id)
+                if data is None:
+                    if previous is not None:
+                        del self._documents[doc_id]
+                        changes.append(DocumentChange(ChangeType.REMOVED, previous, -1, -1))
+                    continue
+                snapshot = FakeDocumentSnapshot(reference, data)
+                self._documents[doc_id] = snapshot
+                change_type = ChangeType.ADDED if previous is None else ChangeType.MODIFIED
+                changes.append(DocumentChange(change_type, snapshot, -1, -1))
+            self._callback(list(self._documents.values()), changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self in self._client._watches:
+            self._client._watches.remove(self)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._collection, doc_id or _new_id())
+
+    async def add(self, data, document_id=None):
+        reference = self.document(document_id)
+        await reference.set(data)
+        return None, reference
+
+
+def _compare_keys(left, right, descending):
+    for left_value, right_value, flag in zip(left, right, descending):
+        if left_value != right_value:
+            result = 1 if left_value > right_value else -1
+            return -result if flag else result
+    return 0
+
+
+def _type_rank(value):
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, repr(value))
+
+
+def _field_value(doc_id, data, field_path):
+    if field_path == DOCUMENT_ID:
+        return doc_id
+    return _lookup(data, field_path)
+
+
+def _lookup(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _project(data, fields):
+    projected = {}
+    for field_path in fields:
+        value = _lookup(data, field_path)
+        if value is _MISSING:
+            continue
+        target = projected
+        parts = field_path.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return projected
+
+
+def _apply_update(document, changes):
+    for field_path, value in changes.items():
+        target = document
+        parts = field_path.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        if value is DELETE_FIELD:
+            target.pop(parts[-1], None)
+        else:
+            target[parts[-1]] = _transform(target.get(parts[-1], _MISSING), value)
+
+
+def _transform(current, value):
+    """New value of a field written with value, applying Firestore's transform sentinels"""
+    if isinstance(value, Increment):
+        numeric = isinstance(current, (int, float)) and not isinstance(current, bool)
+        return (current if numeric else 0) + value.value
+    if isinstance(value, ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in items:
+                items.append(_copy(item))
+        return items
+    if isinstance(value, ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        return {key: _transform(_MISSING, item) for key, item in value.items() if item is not DELETE_FIELD}
+    return _copy(value)
+
+
+def _copy(value):
+    """Deep copy for JSON-like documents, much cheaper than copy.deepcopy"""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _new_id():
+    return uuid.uuid4().hex[:20]
+
+
+def _compare(check):
+    def compare(field_value, value):
+        if field_value is _MISSING:
+            return False
+        try:
+            return check(field_value, value)
+        except TypeError:
+            return False
+    return compare
+
+
+_OPERATORS = {
+    "==": _compare(lambda a, b: a == b),
+    "!=": _compare(lambda a, b: a != b),
+    "<": _compare(lambda a, b: a < b),
+    "<=": _compare(lambda a, b: a <= b),
+    ">": _compare(lambda a, b: a > b),
+    ">=": _compare(lambda a, b: a >= b),
+    "in": _compare(lambda a, b: a in b),
+    "not-in": _compare(lambda a, b: a not in b),
+    "array_contains": _compare(lambda a, b: isinstance(a, list) and b in a),
+    "array_contains_any": _compare(lambda a, b: isinstance(a, list) and any(item in a for item in b)),
+}
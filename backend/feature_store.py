@@ -0,0 +1,501 @@
+import json
+import sys
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from embedding_cache import normalize_interest
+from metrics import metrics
+from nlp import CATEGORICAL_SIGNALS, MATCH_BATCH_SIZE, SIMILARITY_WEIGHTS, TEXT_SIGNALS, normalize_rows, profile_text, top_n_indices, weighted_similarity
+from tracing import span
+
+# Rows reserved up front; every column doubles when full
+INITIAL_ROWS = 1024
+# Dead interest ids tolerated in the flat buffer before it is compacted
+MIN_GARBAGE = 4096
+
+
+class FeatureStore:
+    """
+    Columnar matching features of every user, kept current by a Firestore listener.
+
+    Instead of profile dicts, each user is a row. Interests are int32 term
+    ids of an InterestVocabulary in one flat buffer addressed by per-row
+    start/length columns (CSR offsets), and interest similarities come from
+    the vocabulary's precomputed table. Weighted categorical signals are int32 codes
+    and weighted bio/prompt texts are float32 embedding rows. User ids, names
+    and event ids are interned strings, and each event keeps its attendees'
+    rows in an int32 array. Responses show the interests as each user wrote
+    them: a term id can stand for a merged near-synonym or another spelling,
+    so rows whose spellings differ from their terms' keep a tuple of them.
+
+    listen() subscribes to the users collection with on_snapshot and the
+    listener thread applies every change, adding new interests to the
+    vocabulary and embedding texts there. match() therefore never reads Firestore, runs the model or builds
+    a dict per user: it gathers the event's rows from the columns and scores
+    them like find_top_similar_users (max-then-mean interests, weighted
+    signals), with the same response format.
+
+    With an index (UserIndex), the listener upserts every changed profile
+    into it as well. When that index is in "ivf" mode, on events of more than
+    shortlist_size attendees match() only scores the shortlist_size attendees
+    nearest the user in the index rather than all of them; an "exact" index
+    never narrows the candidates, so matching stays exact.
+
+    Args:
+        vocabulary: InterestVocabulary the interests are mapped to
+        embed_text: callable mapping bios/prompts to embeddings, needed when those are weighted
+        weights: signal weights (default nlp.SIMILARITY_WEIGHTS)
+        index: optional UserIndex to keep current and shortlist candidates from
+        shortlist_size: attendees taken from the index per match
+    """
+
+    def __init__(self, vocabulary, embed_text=None, weights=None, index=None, shortlist_size=200):
+        self.vocabulary = vocabulary
+        self.embed_text = embed_text
+        self.weights = dict(SIMILARITY_WEIGHTS if weights is None else weights)
+        self.index = index
+        self.shortlist_size = shortlist_size
+        self.uses_signals = any(weight for signal, weight in self.weights.items() if signal != "interests")
+        text_signals = [signal for signal in TEXT_SIGNALS if self.weights.get(signal)]
+        if text_signals and embed_text is None:
+            raise ValueError(f"embed_text is needed to weight {', '.join(text_signals)}")
+
+        # Readers hold _lock; writers (the listener thread) are serialized by
+        # _write_lock and only take _lock to publish, never while embedding
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._watch = None
+        self.on_change = None
+        self.changes_applied = 0
+
+        self._rows = {}
+        self._user_ids = []
+        self._names = []
+        self._spellings = []
+        self._events = []
+        self._free_rows = []
+        self._capacity = INITIAL_ROWS
+        self._starts = np.zeros(INITIAL_ROWS, dtype=np.int64)
+        self._lengths = np.zeros(INITIAL_ROWS, dtype=np.int32)
+        self._flat = np.zeros(INITIAL_ROWS * 4, dtype=np.int32)
+        self._flat_size = 0
+        self._garbage = 0
+
+        self._codes = {}
+        self._categorical = {
+            signal: np.full(INITIAL_ROWS, -1, dtype=np.int32)
+            for signal in CATEGORICAL_SIGNALS if self.weights.get(signal)
+        }
+        self._texts = {signal: None for signal in text_signals}
+        self._text_hashes = {signal: np.zeros(INITIAL_ROWS, dtype=np.int64) for signal in text_signals}
+
+        self._event_rows = {}
+        self._event_arrays = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def ready(self):
+        """Whether the listener has delivered its first snapshot"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    # --- Sync ---
+
+    def listen(self, query, on_change=None):
+        """
+        Keep the store in sync with query's documents (the users collection)
+
+        Args:
+            query: collection or query supporting on_snapshot (the sync client's, or FakeFirestore's)
+            on_change: called on the listener thread as on_change(user_id,
+                user, previous_events, changed) after every applied change,
+                with user None for removals
+
+        Returns:
+            the watch, also stopped by close()
+        """
+        self.on_change = on_change
+        self._watch = query.on_snapshot(self._on_snapshot)
+        return self._watch
+
+    def _on_snapshot(self, documents, changes, read_time):
+        started = time.perf_counter()
+        try:
+            users = [{**change.document.to_dict(), "id": change.document.id} for change in changes if change.type.name != "REMOVED"]
+            removed = [change.document.id for change in changes if change.type.name == "REMOVED"]
+            applied = [(user, *result) for user, result in zip(users, self.upsert_many(users))]
+            applied += [(None, *self.remove(user_id)) for user_id in removed]
+            if self.index is not None:
+                for user in users:
+                    self.index.upsert(user)
+                for user_id in removed:
+                    self.index.remove(user_id)
+            if self.on_change is not None:
+                for user, user_id, previous_events, changed in applied:
+                    self.on_change(user_id, user, previous_events, changed)
+        except Exception:
+            metrics.inc("feature_store_errors_total")
+        finally:
+            self._ready.set()
+        metrics.observe("feature_store_apply_seconds", time.perf_counter() - started)
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    # --- Updates ---
+
+    def upsert_many(self, users):
+        """
+        Insert or refresh users from full profiles
+
+        Returns:
+            (user_id, previous_events, changed) per user with an id, where
+            changed says whether a matching feature (name, interests or a
+            weighted signal) differs from what was stored
+        """
+        parsed = [_parse(user, self._categorical, self._texts) for user in users if user.get("id")]
+        with self._write_lock:
+            # One vocabulary call for the whole batch, split back per user
+            flat = [term for _, _, interests, _, _, _ in parsed for term in interests]
+            ids = self.vocabulary.add(flat) if flat else np.zeros(0, dtype=np.int32)
+            splits = np.cumsum([len(interests) for _, _, interests, _, _, _ in parsed])[:-1]
+            parsed = [(user[0], user[1], user_ids, *user[2:]) for user, user_ids in zip(parsed, np.split(ids, splits))]
+            text_changes = self._embed_texts(parsed)
+            with self._lock:
+                results = [self._apply(*user, text_changes) for user in parsed]
+                self.changes_applied += len(results)
+                return results
+
+    def upsert(self, user):
+        results = self.upsert_many([user])
+        return results[0] if results else None
+
+    def remove(self, user_id):
+        """Drop a user; returns (user_id, previous_events, changed)"""
+        with self._write_lock, self._lock:
+            row = self._rows.pop(user_id, None)
+            if row is None:
+                return user_id, set(), False
+            previous_events = set(self._events[row])
+            self._set_events(row, ())
+            self._garbage += int(self._lengths[row])
+            self._lengths[row] = 0
+            self._user_ids[row] = self._names[row] = None
+            self._spellings[row] = None
+            self._free_rows.append(row)
+            self.changes_applied += 1
+            return user_id, previous_events, True
+
+    def _embed_texts(self, parsed):
+        """Embeddings of the weighted texts that differ from the stored ones, keyed by (signal, user_id)"""
+        changes, pending = {}, {}
+        for user_id, _, _, _, _, _, texts in parsed:
+            row = self._rows.get(user_id)
+            for signal, text in texts.items():
+                text_hash = hash(text) if text else 0
+                if row is not None and self._text_hashes[signal][row] == text_hash:
+                    continue
+                changes[signal, user_id] = (text_hash, None)
+                if text:
+                    pending.setdefault(text, []).append((signal, user_id))
+        if pending:
+            vectors = normalize_rows(self.embed_text(list(pending)))
+            for vector, keys in zip(vectors, pending.values()):
+                for key in keys:
+                    changes[key] = (changes[key][0], vector)
+        return changes
+
+    def _apply(self, user_id, name, ids, interests, events, codes, texts, text_changes):
+        row = self._rows.get(user_id)
+        changed = row is None
+        if row is None:
+            row = self._allocate(user_id)
+        previous_events = set(self._events[row])
+
+        if not np.array_equal(self._interest_ids(row), ids):
+            changed = True
+            self._garbage += int(self._lengths[row])
+            # Zeroed first so a compaction on the way does not keep the old slice
+            self._lengths[row] = 0
+            self._starts[row] = self._append_ids(ids)
+            self._lengths[row] = len(ids)
+        spellings = tuple(interests)
+        if spellings == tuple(self.vocabulary.terms[term] for term in ids.tolist()):
+            # The vocabulary's own spellings, nothing to keep
+            spellings = None
+        if self._spellings[row] != spellings:
+            changed = True
+            self._spellings[row] = None if spellings is None else tuple(sys.intern(interest) for interest in spellings)
+        if self._names[row] != name:
+            changed = True
+            self._names[row] = None if name is None else sys.intern(name)
+        for signal, value in codes.items():
+            code = -1 if value is None else self._codes.setdefault(value, len(self._codes))
+            if self._categorical[signal][row] != code:
+                changed = True
+                self._categorical[signal][row] = code
+        for signal in texts:
+            change = text_changes.get((signal, user_id))
+            if change is None:
+                continue
+            changed = True
+            text_hash, vector = change
+            self._text_hashes[signal][row] = text_hash
+            if vector is not None and self._texts[signal] is None:
+                self._texts[signal] = np.zeros((self._capacity, len(vector)), dtype=np.float32)
+            if self._texts[signal] is not None:
+                self._texts[signal][row] = 0.0 if vector is None else vector
+        self._set_events(row, events)
+        return user_id, previous_events, changed
+
+    def _allocate(self, user_id):
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._user_ids)
+            if row >= self._capacity:
+                self._grow(2 * self._capacity)
+            self._user_ids.append(None)
+            self._names.append(None)
+            self._spellings.append(None)
+            self._events.append(())
+        self._user_ids[row] = sys.intern(user_id)
+        self._rows[self._user_ids[row]] = row
+        self._lengths[row] = 0
+        for values in self._categorical.values():
+            values[row] = -1
+        for signal, hashes in self._text_hashes.items():
+            hashes[row] = 0
+            if self._texts[signal] is not None:
+                self._texts[signal][row] = 0.0
+        return row
+
+    def _grow(self, capacity):
+        self._starts = _grown(self._starts, capacity, 0)
+        self._lengths = _grown(self._lengths, capacity, 0)
+        self._categorical = {signal: _grown(values, capacity, -1) for signal, values in self._categorical.items()}
+        self._text_hashes = {signal: _grown(values, capacity, 0) for signal, values in self._text_hashes.items()}
+        self._texts = {signal: None if values is None else _grown(values, capacity, 0.0) for signal, values in self._texts.items()}
+        self._capacity = capacity
+
+    def _append_ids(self, ids):
+        """Write ids at the end of the flat buffer, compacting or growing it first if needed"""
+        if self._flat_size + len(ids) > len(self._flat):
+            if self._garbage >= max(MIN_GARBAGE, self._flat_size // 2):
+                self._compact()
+            if self._flat_size + len(ids) > len(self._flat):
+                self._flat = _grown(self._flat, max(2 * len(self._flat), self._flat_size + len(ids)), 0)
+        start = self._flat_size
+        self._flat[start:start + len(ids)] = ids
+        self._flat_size += len(ids)
+        return start
+
+    def _compact(self):
+        live = np.flatnonzero(self._lengths[:len(self._user_ids)] > 0)
+        flat, offsets = self._gather(live)
+        self._flat[:len(flat)] = flat
+        self._starts[live] = offsets
+        self._flat_size = len(flat)
+        self._garbage = 0
+
+    def _set_events(self, row, events):
+        previous = self._events[row]
+        if set(previous) == set(events):
+            return
+        for event_id in set(previous) - set(events):
+            attendees = self._event_rows.get(event_id)
+            if attendees is not None:
+                attendees.remove(row)
+                if not attendees:
+                    del self._event_rows[event_id]
+            self._event_arrays.pop(event_id, None)
+        for event_id in set(events) - set(previous):
+            self._event_rows.setdefault(sys.intern(event_id), array("i")).append(row)
+            self._event_arrays.pop(event_id, None)
+        self._events[row] = tuple(sys.intern(event_id) for event_id in events)
+
+    # --- Queries ---
+
+    def attends(self, user_id, event_id):
+        """Whether the store has user_id as an attendee of event_id"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            return row is not None and event_id in self._events[row]
+
+    def match(self, user_id, event_id, top_n=1, deadline=None):
+        """
+        Top attendees of event_id for user_id, in find_top_similar_users' response format
+
+        With a deadline, candidates are scored MATCH_BATCH_SIZE at a time and
+        the result degrades as find_top_similar_users' does: "partial" when
+        only the batches scored in time are ranked, "jaccard" when no batch
+        was. The bio/prompt signals are stored embeddings here, so they never
+        need dropping.
+        """
+        shortlist = None
+        if self.index is not None and self.index.mode == "ivf" and len(self._event_rows.get(event_id, ())) > self.shortlist_size:
+            with span("index.search"):
+                shortlist = [candidate for candidate, _ in self.index.search(user_id, event_id, k=self.shortlist_size)]
+        with self._lock:
+            rows = self._event_array(event_id)
+            if not len(rows):
+                return _error("No users found")
+            target = self._rows.get(user_id)
+            if target is None or event_id not in self._events[target]:
+                return _error(f"User with ID {user_id} not found")
+            target_ids = self._interest_ids(target)
+            if not len(target_ids):
+                return _error("Target user has no interests in attribute 'interests'")
+            candidates = rows[(rows != target) & (self._lengths[rows] > 0)]
+            if shortlist:
+                candidates = candidates[np.isin(candidates, [self._rows.get(candidate, -1) for candidate in shortlist])]
+            if not len(candidates):
+                return _error("No similar users found")
+
+            degraded = []
+            with span("match.score", candidates=len(candidates)):
+                scores = self._score_until(target_ids, candidates, deadline)
+            if not len(scores):
+                # Out of time before the first batch: exact matches need no table
+                scores = self._jaccard(target_ids, candidates)
+                degraded.append("jaccard")
+            elif len(scores) < len(candidates):
+                candidates = candidates[:len(scores)]
+                degraded.append("partial")
+            if self.uses_signals:
+                with span("match.signals"):
+                    scores = weighted_similarity(scores[None, :], self.weights, self._signals([target]), self._signals(candidates))[0]
+            with span("match.rank"):
+                best = top_n_indices(scores, top_n)
+            result = {
+                "target_user": {
+                    "id": user_id,
+                    "name": self._names[target] or "Unknown",
+                    "interests": self._interests(target),
+                },
+                "top_matches": [
+                    {
+                        "id": self._user_ids[candidates[i]],
+                        "name": self._names[candidates[i]] or "Unknown",
+                        "similarity_score": float(scores[i]),
+                        "interests": self._interests(candidates[i]),
+                    }
+                    for i in best
+                ],
+            }
+        if degraded:
+            result["degraded"] = degraded
+            for reason in degraded:
+                metrics.inc("match_degraded_total", reason=reason)
+        return result
+
+    def _event_array(self, event_id):
+        # Sorted attendee rows, cached until the event's attendees change
+        rows = self._event_arrays.get(event_id)
+        if rows is None:
+            rows = np.sort(np.frombuffer(self._event_rows.get(event_id, array("i")), dtype=np.int32)).astype(np.int64)
+            self._event_arrays[event_id] = rows
+        return rows
+
+    def _interest_ids(self, row):
+        start = self._starts[row]
+        return self._flat[start:start + self._lengths[row]]
+
+    def _interests(self, row):
+        spellings = self._spellings[row]
+        if spellings is not None:
+            return list(spellings)
+        return [self.vocabulary.terms[term] for term in self._interest_ids(row).tolist()]
+
+    def _gather(self, rows):
+        """Interest ids of rows, concatenated, and the offset of each row's slice"""
+        lengths = self._lengths[rows].astype(np.int64)
+        offsets = np.zeros(len(rows), dtype=np.int64)
+        if len(rows):
+            np.cumsum(lengths[:-1], out=offsets[1:])
+        positions = np.repeat(self._starts[rows] - offsets, lengths) + np.arange(int(lengths.sum()), dtype=np.int64)
+        return self._flat[positions], offsets
+
+    def _score_until(self, target_ids, candidates, deadline):
+        # Scores of the candidates scored before the deadline, in order
+        batch_size = MATCH_BATCH_SIZE if deadline is not None else len(candidates)
+        scores = []
+        for start in range(0, len(candidates), batch_size):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            scores.append(self._score(target_ids, *self._gather(candidates[start:start + batch_size])))
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+    def _jaccard(self, target_ids, candidates):
+        # Overlap of the term ids, which already fold case and spacing
+        target = set(target_ids.tolist())
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for i, row in enumerate(candidates):
+            ids = set(self._interest_ids(row).tolist())
+            scores[i] = len(target & ids) / len(target | ids)
+        return scores
+
+    def _score(self, target_ids, flat, offsets):
+        # Each distinct candidate interest is looked up against the target's once
+        vocabulary, inverse = np.unique(flat, return_inverse=True)
+        similarities = self.vocabulary.similarities(vocabulary, target_ids)
+        return np.maximum.reduceat(similarities[inverse], offsets, axis=0).mean(axis=1)
+
+    def _signals(self, rows):
+        signals = {signal: values[rows] for signal, values in self._categorical.items()}
+        signals.update({signal: None if values is None else values[rows] for signal, values in self._texts.items()})
+        return signals
+
+    # --- Stats ---
+
+    def nbytes(self):
+        """Bytes held by the columns (capacity included), not counting the interned strings or the vocabulary"""
+        with self._lock:
+            arrays = [self._starts, self._lengths, self._flat, *self._categorical.values(), *self._text_hashes.values()]
+            arrays += [values for values in self._texts.values() if values is not None]
+            return sum(values.nbytes for values in arrays)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._rows),
+                "events": len(self._event_rows),
+                "interest_ids": self._flat_size - self._garbage,
+                "column_bytes": self.nbytes(),
+                "changes_applied": self.changes_applied,
+                "ready": int(self.ready),
+            }
+
+
+def _parse(user, categorical, texts):
+    """(id, name, interests, events, categorical values, texts) of a profile, keeping only what is matched on"""
+    interests = [str(interest).strip() for interest in user.get("interests") or [] if str(interest).strip()]
+    return (
+        str(user["id"]),
+        user.get("name"),
+        interests,
+        tuple(dict.fromkeys(user.get("signedUpEventIds") or [])),
+        {signal: normalize_interest(user[signal]) if user.get(signal) else None for signal in categorical},
+        {signal: profile_text(user, signal) for signal in texts},
+    )
+
+
+def _grown(values, capacity, fill):
+    grown = np.full((capacity, *values.shape[1:]), fill, dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
+
+
+def _error(message):
+    # Same shape as find_top_similar_users' errors
+    return json.dumps({"error": message}, indent=4)
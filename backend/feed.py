@@ -0,0 +1,94 @@
+import asyncio
+
+from repository import encode_cursor
+from sync import CREATED_AT_FIELD
+
+# Fields of the referenced documents a feed card shows
+AUTHOR_FIELDS = ["id", "name", "avatarUrl"]
+EVENT_FIELDS = ["id", "name", "time", "location", "imageUrl"]
+COMMUNITY_FIELDS = ["id", "name", "imageUrl"]
+
+# Firestore caps the number of values in an "in" filter
+IN_FILTER_LIMIT = 30
+
+
+async def community_feed(repo, community_id, limit, start_after=None):
+    """
+    One page of a community's feed, newest first
+
+    Returns:
+        (items, next_cursor)
+    """
+    posts, next_cursor = await repo.page(
+        "posts", limit=limit, start_after=start_after, order_by=CREATED_AT_FIELD, descending=True,
+        filters=[("communityId", "==", community_id)],
+    )
+    return await resolve_posts(repo, posts), next_cursor
+
+
+async def home_feed(repo, community_ids, limit, start_after=None):
+    """
+    One page of the posts of every community a user has joined, newest first
+
+    More communities than an "in" filter takes are queried in chunks
+    concurrently; every chunk is ordered by createdAt and then document id,
+    so merging them and cutting at limit gives the same page a single query
+    would.
+
+    Returns:
+        (items, next_cursor)
+    """
+    community_ids = list(dict.fromkeys(community_ids))
+    if not community_ids:
+        return [], None
+    chunks = [community_ids[i:i + IN_FILTER_LIMIT] for i in range(0, len(community_ids), IN_FILTER_LIMIT)]
+    pages = await asyncio.gather(*(
+        repo.page(
+            "posts", limit=limit, start_after=start_after, order_by=CREATED_AT_FIELD, descending=True,
+            filters=[("communityId", "in", chunk)],
+        )
+        for chunk in chunks
+    ))
+    posts = sorted(
+        (post for chunk_posts, _ in pages for post in chunk_posts),
+        key=lambda post: (post[CREATED_AT_FIELD], post["id"]),
+        reverse=True,
+    )
+    more = len(posts) > limit or any(cursor for _, cursor in pages)
+    posts = posts[:limit]
+    next_cursor = encode_cursor([posts[-1][CREATED_AT_FIELD], posts[-1]["id"]]) if more and posts else None
+    return await resolve_posts(repo, posts, include_community=True), next_cursor
+
+
+async def resolve_posts(repo, posts, include_community=False):
+    """
+    Turn posts into ready-to-render feed items
+
+    Authors, events and (optionally) communities are fetched with one batched
+    get_all per collection, concurrently, and only the fields a card shows.
+    Posts whose author or event no longer exists are dropped, as the app
+    skips them when rendering.
+    """
+    lookups = [
+        repo.get_all("users", (post.get("authorId") for post in posts), fields=AUTHOR_FIELDS),
+        repo.get_all("events", (post.get("eventId") for post in posts if post.get("type") == "event"), fields=EVENT_FIELDS),
+    ]
+    if include_community:
+        lookups.append(repo.get_all("communities", (post.get("communityId") for post in posts), fields=COMMUNITY_FIELDS))
+    authors, events, *rest = await asyncio.gather(*lookups)
+    communities = rest[0] if rest else {}
+
+    items = []
+    for post in posts:
+        author = authors.get(post.get("authorId"))
+        if author is None:
+            continue
+        item = {**post, "author": author, "event": None}
+        if post.get("type") == "event":
+            item["event"] = events.get(post.get("eventId"))
+            if item["event"] is None:
+                continue
+        if include_community:
+            item["community"] = communities.get(post.get("communityId"))
+        items.append(item)
+    return items
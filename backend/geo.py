@@ -0,0 +1,122 @@
+import asyncio
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Precision stored on events (a cell of about 4.8 x 4.8 m); queries use prefixes of it
+GEOHASH_PRECISION = 9
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Most range queries a nearby search fans out to
+MAX_QUERY_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Standard base32 geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, value, even = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            interval[0] = middle
+        else:
+            value *= 2
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def with_geohash(event):
+    """The event with its "geohash" field set from latitude/longitude (None without both)"""
+    latitude, longitude = event.get("latitude"), event.get("longitude")
+    if latitude is None or longitude is None:
+        return {**event, "geohash": None}
+    return {**event, "geohash": encode_geohash(latitude, longitude)}
+
+
+def _cell_degrees(precision):
+    """(height, width) in degrees of a geohash cell"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lng_bits
+
+
+def query_prefixes(latitude, longitude, radius_km):
+    """
+    Geohash prefixes whose cells together cover the circle
+
+    Uses the longest prefix for which at most MAX_QUERY_CELLS cells cover the
+    circle's bounding box, i.e. cells about half the radius across, so the
+    cells read are only a few times the circle's area. The cells are found by
+    encoding a grid of points no further apart than a cell.
+    """
+    lat_span = radius_km / KM_PER_DEGREE
+    lng_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    south, north = max(latitude - lat_span, -90.0), min(latitude + lat_span, 90.0)
+    west, east = longitude - lng_span, longitude + lng_span
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = _cell_degrees(precision)
+        rows, columns = math.ceil((north - south) / height) + 1, math.ceil((east - west) / width) + 1
+        if rows * columns <= MAX_QUERY_CELLS or precision == 1:
+            break
+    prefixes = set()
+    for row in range(rows):
+        lat = min(south + row * height, north)
+        for column in range(columns):
+            lng = min(west + column * width, east)
+            prefixes.add(encode_geohash(lat, (lng + 180.0) % 360.0 - 180.0, precision))
+    return sorted(prefixes)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """Great-circle distances in km from one point to arrays of points"""
+    lat1, lng1 = np.radians(latitude), np.radians(longitude)
+    lat2, lng2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+async def nearby_events(repo, latitude, longitude, radius_km, limit=None):
+    """
+    Events within radius_km of a point, nearest first
+
+    One range query per covering geohash prefix, run concurrently, so the
+    reads grow with the number of events in the few cells around the point
+    rather than with the whole collection. The candidates are then filtered
+    by exact distance in one vectorized pass.
+
+    Returns:
+        events with a "distanceKm" field added
+    """
+    prefixes = query_prefixes(latitude, longitude, radius_km)
+    pages = await asyncio.gather(*(
+        repo.page("events", order_by="geohash", filters=[("geohash", ">=", prefix), ("geohash", "<", prefix + "~")])
+        for prefix in prefixes
+    ))
+    candidates = list({event["id"]: event for documents, _ in pages for event in documents}.values())
+    if not candidates:
+        return []
+
+    distances = haversine_km(
+        latitude,
+        longitude,
+        np.array([event["latitude"] for event in candidates], dtype=np.float64),
+        np.array([event["longitude"] for event in candidates], dtype=np.float64),
+    )
+    inside = np.flatnonzero(distances <= radius_km)
+    order = inside[np.argsort(distances[inside], kind="stable")]
+    if limit is not None:
+        order = order[:limit]
+    return [{**candidates[i], "distanceKm": float(distances[i])} for i in order]
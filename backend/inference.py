@@ -0,0 +1,172 @@
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import metrics
+
+
+class InferenceExecutor:
+    """
+    Dedicated model worker that coalesces concurrent encode calls into batches.
+
+    Callers block in encode() (the routes reach it from the threadpool, never
+    from the event loop) while a single dispatcher thread drains the queue: it
+    takes the oldest request, keeps collecting for up to max_wait seconds or
+    until max_batch texts are waiting, runs the model once and hands every
+    caller its slice of the result.
+
+    In "thread" mode the model runs on the dispatcher thread. In "process" mode
+    it is loaded and run in a separate model-server process, so inference never
+    holds the web worker's GIL or competes with request parsing for it.
+
+    Args:
+        load_model: picklable callable returning an object with encode(list of str)
+        mode: "thread" or "process"
+        max_batch: most texts per model call (a single larger request is not split)
+        max_wait: seconds to wait for more requests once one is queued
+    """
+
+    def __init__(self, load_model, mode="thread", max_batch=64, max_wait=0.005):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference mode '{mode}'")
+        self.load_model = load_model
+        self.mode = mode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.ready = False
+        self.error = None
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._process = None
+        self._connection = None
+        self._model = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self.mode == "process":
+                # spawn, not fork: torch does not survive being forked with threads running
+                context = multiprocessing.get_context("spawn")
+                self._connection, child = context.Pipe()
+                self._process = context.Process(target=_serve, args=(child, self.load_model), name="nlp-model-server", daemon=True)
+                self._process.start()
+            self._thread = threading.Thread(target=self._run, name="nlp-inference", daemon=True)
+            self._thread.start()
+
+    def encode(self, texts):
+        """Embed texts on the model worker, batched with other concurrent callers"""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        self.start()
+        future = Future()
+        self._queue.put((texts, future, time.perf_counter()))
+        metrics.set("inference_queue_depth", self._queue.qsize())
+        return future.result()
+
+    def _run(self):
+        carried = None
+        while True:
+            first = carried if carried is not None else self._queue.get()
+            carried = None
+            batch, size = [first], len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if size + len(item[0]) > self.max_batch:
+                    # Does not fit: it opens the next batch instead
+                    carried = item
+                    break
+                batch.append(item)
+                size += len(item[0])
+            metrics.set("inference_queue_depth", self._queue.qsize())
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        for _, _, queued_at in batch:
+            metrics.observe("inference_queue_seconds", started - queued_at)
+        texts = [text for request_texts, _, _ in batch for text in request_texts]
+        try:
+            vectors = self._encode(texts)
+        except Exception as e:
+            self.error = str(e)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        metrics.observe("inference_encode_seconds", time.perf_counter() - started)
+        metrics.inc("inference_batches_total")
+        metrics.inc("inference_batched_texts_total", len(texts))
+        self.ready, self.error = True, None
+        self.batches += 1
+        self.requests += len(batch)
+        self.texts += len(texts)
+
+        offset = 0
+        for request_texts, future, _ in batch:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+    def _encode(self, texts):
+        if self.mode == "process":
+            self._connection.send(texts)
+            ok, value = self._connection.recv()
+            if not ok:
+                raise RuntimeError(value)
+            return value
+        if self._model is None:
+            self._model = self.load_model()
+        return np.asarray(self._model.encode(texts), dtype=np.float32)
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "requests": self.requests,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def close(self):
+        if self._process is not None:
+            self._connection.send(None)
+            self._process.join(timeout=5)
+            self._process = None
+
+
+def _serve(connection, load_model):
+    """Model-server process: encode each batch received on connection until told to stop"""
+    model, error = None, None
+    try:
+        model = load_model()
+    except Exception as e:
+        error = str(e)
+    while True:
+        try:
+            texts = connection.recv()
+        except EOFError:
+            return
+        if texts is None:
+            return
+        if model is None:
+            connection.send((False, error))
+            continue
+        try:
+            connection.send((True, np.asarray(model.encode(texts), dtype=np.float32)))
+        except Exception as e:
+            connection.send((False, str(e)))
@@ -0,0 +1,161 @@
+import threading
+
+import numpy as np
+
+from embedding_cache import normalize_interest
+from tracing import span
+
+# Terms the table starts with room for; it doubles when full
+INITIAL_TERMS = 256
+
+
+class InterestVocabulary:
+    """
+    Canonical interest vocabulary with a precomputed term x term similarity table.
+
+    Interests are normalized (trimmed, single-spaced, case-folded) and
+    deduplicated, and a new interest whose embedding is at least
+    merge_threshold cosine-similar to an existing term is merged into it as
+    an alias, so "Hiking", " hiking" and near-synonyms share one integer id.
+    Every term is embedded once when it is added. Its row and column of the
+    dense float32 cosine similarity table are filled in at the same time, so
+    the max-then-mean interest score becomes table lookups with no model
+    call or matrix product at match time.
+
+    The table grows incrementally. Past max_table_terms terms it stops
+    growing (the table takes max_table_terms^2 * 4 bytes), and lookups
+    involving later terms are computed from the embeddings instead.
+
+    Args:
+        embed: callable mapping a list of interests to a 2D array of embeddings
+        merge_threshold: cosine similarity from which a new interest joins an existing term (above 1 disables merging)
+        max_table_terms: most terms kept in the precomputed table
+    """
+
+    def __init__(self, embed, merge_threshold=0.9, max_table_terms=4096):
+        self.embed = embed
+        self.merge_threshold = merge_threshold
+        self.max_table_terms = max_table_terms
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.terms = []
+            self._ids = {}
+            self._embeddings = None
+            self._table = np.zeros((0, 0), dtype=np.float32)
+            self._table_size = 0
+            self.merged = 0
+
+    def __len__(self):
+        return len(self.terms)
+
+    # --- Terms ---
+
+    def ids(self, interests):
+        """Term ids of interests already in the vocabulary, -1 for unknown ones"""
+        return np.fromiter(
+            (self._ids.get(normalize_interest(interest), -1) for interest in interests),
+            dtype=np.int32,
+            count=len(interests),
+        )
+
+    def add(self, interests):
+        """
+        Term ids of interests, adding (and embedding) the ones not seen before
+
+        Returns:
+            int32 array with one id per interest
+        """
+        interests = list(interests)
+        ids = self.ids(interests)
+        if (ids >= 0).all():
+            return ids
+        # Embedded under their first spelling (the cache keys by normalized text
+        # anyway), outside the lock so lookups are not held up by the model
+        spellings = {}
+        for interest in interests:
+            spellings.setdefault(normalize_interest(interest), str(interest).strip())
+        new = [key for key in spellings if key not in self._ids]
+        if not new:
+            return self.ids(interests)
+        with span("vocabulary.embed", interests=len(new)):
+            vectors = _normalize(np.asarray(self.embed([spellings[key] for key in new]), dtype=np.float32))
+        with self._lock:
+            for key, vector in zip(new, vectors):
+                if key not in self._ids:
+                    self._ids[key] = self._add_term(spellings[key], vector)
+        return self.ids(interests)
+
+    def _add_term(self, term, vector):
+        count = len(self.terms)
+        if count and self.merge_threshold <= 1.0:
+            similarities = self._embeddings[:count] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.merge_threshold:
+                self.merged += 1
+                return best
+
+        if self._embeddings is None:
+            self._embeddings = np.zeros((INITIAL_TERMS, len(vector)), dtype=np.float32)
+        elif count == len(self._embeddings):
+            self._embeddings = _grown(self._embeddings, 2 * count)
+        self._embeddings[count] = vector
+        self.terms.append(term)
+        if count < self.max_table_terms:
+            self._extend_table(count)
+        return count
+
+    def _extend_table(self, term_id):
+        # Only the new term's row and column are computed
+        if term_id >= len(self._table):
+            capacity = min(max(INITIAL_TERMS, 2 * len(self._table)), self.max_table_terms)
+            table = np.zeros((capacity, capacity), dtype=np.float32)
+            table[:self._table_size, :self._table_size] = self._table[:self._table_size, :self._table_size]
+            self._table = table
+        row = self._embeddings[:term_id + 1] @ self._embeddings[term_id]
+        self._table[term_id, :term_id + 1] = row
+        self._table[:term_id + 1, term_id] = row
+        self._table_size = term_id + 1
+
+    # --- Similarities ---
+
+    def similarities(self, rows, columns):
+        """
+        Cosine similarities of term ids rows x columns, from the table when it covers them
+
+        Returns:
+            float32 array of shape (len(rows), len(columns))
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        with self._lock:
+            table, size, embeddings = self._table, self._table_size, self._embeddings
+        if not len(rows) or not len(columns):
+            return np.zeros((len(rows), len(columns)), dtype=np.float32)
+        if rows.max() < size and columns.max() < size:
+            return table[rows[:, None], columns[None, :]]
+        return embeddings[rows] @ embeddings[columns].T
+
+    def stats(self):
+        with self._lock:
+            return {
+                "terms": len(self.terms),
+                "aliases": len(self._ids),
+                "merged": self.merged,
+                "table_terms": self._table_size,
+                "table_bytes": self._table.nbytes,
+            }
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _grown(values, capacity):
+    grown = np.zeros((capacity, *values.shape[1:]), dtype=values.dtype)
+    grown[:len(values)] = values
+    return grown
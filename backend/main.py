@@ -1,189 +1,234 @@
-from fastapi import FastAPI, Request
+import time
+
+_app_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import math
 import os
 import json
+from urllib.parse import urlencode
 from dotenv import load_dotenv
-from nlp import find_top_similar_users
 
+# Loaded before the backend modules so their env-driven settings see .env
 load_dotenv()
 
-app = FastAPI()
+from admission import Overloaded, RouteBudget
+from bulk_import import ImportFormatError, iter_json_array, iter_ndjson
+from change_feed import FILTER_FIELDS as CHANGE_FEED_FILTERS, ChangeFeed, SubscriberLimitError
+from fake_firestore import FakeFirestore
+from feature_store import FeatureStore
+from feed import community_feed, home_feed
+from geo import nearby_events, with_geohash
+from google.api_core.exceptions import AlreadyExists, NotFound
+from match_store import MatchStore
+from membership import SHARDS_FIELD, Membership
+from metrics import metrics
+from mock_data import MOCK_USERS, MOCK_COMMUNITIES, MOCK_EVENTS, MOCK_POSTS
+from nlp import find_top_similar_users, encode_interests, encode_texts, embedding_cache, inference, interest_vocabulary, model_status, run_model, start_background_warm_up, text_embedding_cache
+from repository import Repository, parse_collection_limits
+from response_cache import MemoryCacheBackend, ResponseCache, etag_matches
+from search_index import COLLECTIONS as SEARCH_COLLECTIONS, SEARCH_FIELDS, SearchIndex
+from sync import SERVER_FIELDS, SYNC_COLLECTIONS, VersionClock, sync
+from tracing import TracingMiddleware, configure_opentelemetry, span
+from user_index import UserIndex
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # NLP_WARMUP=lazy defers the model load to the first matching request
+    if os.getenv("NLP_WARMUP", "background") == "background":
+        start_background_warm_up()
+    feature_store.listen(listen_db.collection("users"), on_change=_sync_matches)
+    # The search index is fed by the same listeners, so it sees every
+    # worker's (and the console's) writes
+    for collection in CHANGE_FEED_COLLECTIONS:
+        on_change = _search_listener(collection) if collection in SEARCH_FIELDS else None
+        change_feed.listen(collection, listen_db.collection(collection), on_change=on_change)
+    search_watches = [_listen_for_search(collection) for collection in SEARCH_FIELDS if collection not in CHANGE_FEED_COLLECTIONS]
+    refresher = asyncio.create_task(match_store.run_refresher(_load_event_attendees, MATCH_MAX_AGE))
+    if os.getenv("MATCH_PRECOMPUTE", "on-demand") == "all":
+        asyncio.create_task(_schedule_all_events())
+    yield
+    refresher.cancel()
+    feature_store.close()
+    change_feed.close()
+    for watch in search_watches:
+        watch.unsubscribe()
+    if search_index.path is not None:
+        await asyncio.get_running_loop().run_in_executor(search_executor, search_index.save)
+    match_store.close()
+    if inference is not None:
+        inference.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Per-route latency, stage timings and Firestore/cache counts on /metrics;
+# TRACE_SAMPLE_RATE > 0 also exports that fraction of requests as OTLP traces
+app.add_middleware(TracingMiddleware)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+if TRACE_SAMPLE_RATE > 0:
+    configure_opentelemetry(TRACE_SAMPLE_RATE)
 
 import firebase_admin
-from firebase_admin import credentials, auth, firestore
+from firebase_admin import credentials, auth, firestore, firestore_async
 
-firebase_config_json = os.getenv("FIREBASE_ADMIN_CONFIG_JSON")
-if firebase_config_json:
-    cred = credentials.Certificate(json.loads(firebase_config_json))
+# FIRESTORE_BACKEND=memory runs against an in-process fake instead of Firestore;
+# FIRESTORE_EMULATOR_HOST is honoured by the real client for emulator runs
+FIRESTORE_BACKEND = os.getenv("FIRESTORE_BACKEND", "firestore")
+if FIRESTORE_BACKEND == "memory":
+    db = FakeFirestore(latency=float(os.getenv("FAKE_FIRESTORE_LATENCY", "0")))
+    listen_db = db
 else:
-    cred = credentials.Certificate("firebaseAdminConfig.json")
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
-# Mock data dictionaries
-MOCK_USERS = [
-    {
-        "id": "user-2",
-        "email": "jane@test.com",
-        "password": "password",
-        "name": "Jane Doe",
-        "year": 3,
-        "faculty": "Arts and Social Sciences",
-        "major": "Psychology",
-        "hometown": "Vancouver",
-        "interests": ["Hiking", "Photography", "Baking", "Movies"],
-        "bio": "Just a psych major trying to understand the world, one cup of coffee at a time. Love capturing moments and exploring new trails!",
-        "privatePrompts": {
-            "prompt1": "A perfect weekend for me is being outdoors.",
-            "prompt2": "I'm looking for friends who are open-minded and love to laugh.",
-        },
-        "joinedCommunityIds": ["comm-1", "comm-3"],
-        "signedUpEventIds": ["event-1", "event-3"],
-        "postIds": ["post-1", "post-3", "post-4"],
-        "avatarUrl": "https://picsum.photos/seed/jane/200",
-    },
-    {
-        "id": "user-3",
-        "email": "sam@test.com",
-        "password": "password",
-        "name": "Sam Wilson",
-        "year": 5,
-        "faculty": "Engineering",
-        "major": "Mechanical Engineering",
-        "hometown": "Toronto",
-        "interests": ["Robotics", "3D Printing", "Cycling", "Sci-Fi"],
-        "bio": "Building the future, one gear at a time. Avid cyclist and sci-fi enthusiast. Let's talk tech!",
-        "privatePrompts": {
-            "prompt1": "Something that fascinates me is the potential of AI.",
-            "prompt2": "I connect best with people who are passionate about their hobbies.",
-        },
-        "joinedCommunityIds": ["comm-2"],
-        "signedUpEventIds": ["event-1", "event-2"],
-        "postIds": ["post-2"],
-        "avatarUrl": "https://picsum.photos/seed/sam/200",
-    },
-]
-
-MOCK_COMMUNITIES = [
-    {
-        "id": "comm-1",
-        "name": "Fishing Club",
-        "description": "For all angling enthusiasts, from beginners to pros.",
-        "memberCount": 78,
-        "imageUrl": "https://picsum.photos/seed/fishing/600/400",
-        "members": ["user-2"],
-        "postIds": ["post-1"],
-    },
-    {
-        "id": "comm-2",
-        "name": "Fun Bouldering",
-        "description": "Climb, connect, and conquer new heights together.",
-        "memberCount": 123,
-        "imageUrl": "https://picsum.photos/seed/bouldering/600/400",
-        "members": ["user-3"],
-        "postIds": ["post-2"],
-    },
-    {
-        "id": "comm-3",
-        "name": "Movie Buffs",
-        "description": "Discussing everything from blockbusters to indie gems.",
-        "memberCount": 210,
-        "imageUrl": "https://picsum.photos/seed/movie/600/400",
-        "members": ["user-2"],
-        "postIds": ["post-3", "post-4"],
-    },
-    {
-        "id": "comm-4",
-        "name": "Startup Grind",
-        "description": "Connect with fellow entrepreneurs and build the future.",
-        "memberCount": 95,
-        "imageUrl": "https://picsum.photos/seed/startup/600/400",
-        "members": [],
-        "postIds": [],
-    },
-]
-
-MOCK_EVENTS = [
-    {
-        "id": "event-1",
-        "name": "The Peak Social Hike",
-        "time": "Today, 5pm",
-        "location": "Sai Ying Pun MTR Exit A2",
-        "communityId": "comm-1",
-        "description": "Join us for a scenic hike up The Peak! A great way to meet new people and enjoy the amazing Hong Kong skyline. We'll meet at the MTR exit and head up together. All fitness levels welcome.",
-        "imageUrl": "https://picsum.photos/seed/hike/200/200",
-        "attendees": ["user-2", "user-3"],
-    },
-    {
-        "id": "event-2",
-        "name": "West Kowloon 5k Run",
-        "time": "Tomorrow, 6pm",
-        "location": "West Kowloon Cultural District",
-        "communityId": "comm-2",
-        "description": "Let's go for a casual 5k run along the beautiful West Kowloon waterfront. A perfect way to de-stress and stay active. We'll end with some stretching and social time.",
-        "imageUrl": "https://picsum.photos/seed/run/200/200",
-        "attendees": ["user-3"],
-    },
-    {
-        "id": "event-3",
-        "name": "Inception Screening",
-        "time": "Friday, 8pm",
-        "location": "Campus Cinema",
-        "communityId": "comm-3",
-        "description": "Join the Movie Buffs for a special screening of Christopher Nolan's masterpiece, Inception. Popcorn will be provided! We'll have a short discussion after the film.",
-        "imageUrl": "https://picsum.photos/seed/cinema/200/200",
-        "attendees": ["user-2"],
-    },
-    {
-        "id": "event-4",
-        "name": "Pitch Night",
-        "time": "Next Tuesday, 7pm",
-        "location": "Innovation Hub",
-        "communityId": "comm-4",
-        "description": "Have a startup idea? Come pitch it to fellow entrepreneurs and get valuable feedback. Or just come to listen and get inspired!",
-        "imageUrl": "https://picsum.photos/seed/pitch/200/200",
-        "attendees": [],
-    },
-]
-
-MOCK_POSTS = [
-    {
-        "id": "post-1",
-        "type": "event",
-        "authorId": "user-2",
-        "communityId": "comm-1",
-        "timestamp": "2h ago",
-        "eventId": "event-1",
-        "content": "",
-    },
-    {
-        "id": "post-2",
-        "type": "text",
-        "authorId": "user-3",
-        "communityId": "comm-2",
-        "timestamp": "5h ago",
-        "content": "Just finished a new climbing route at the gym! Feeling accomplished. Anyone else hit a PR recently?",
-    },
-    {
-        "id": "post-3",
-        "type": "event",
-        "authorId": "user-2",
-        "communityId": "comm-3",
-        "timestamp": "1d ago",
-        "eventId": "event-3",
-        "content": "",
-    },
-    {
-        "id": "post-4",
-        "type": "text",
-        "authorId": "user-2",
-        "communityId": "comm-3",
-        "timestamp": "2d ago",
-        "content": "Just rewatched Blade Runner 2049. What a masterpiece. What are your thoughts on it?",
-    },
-]
+    firebase_config_json = os.getenv("FIREBASE_ADMIN_CONFIG_JSON")
+    if firebase_config_json:
+        cred = credentials.Certificate(json.loads(firebase_config_json))
+    else:
+        cred = credentials.Certificate("firebaseAdminConfig.json")
+    firebase_admin.initialize_app(cred)
+    db = firestore_async.client()
+    # The async client cannot listen for changes; snapshot listeners use the sync one
+    listen_db = firestore.client()
+
+# Writes to the synced collections are stamped with updatedAt and a version,
+# and deletes leave tombstones, so GET /sync can return what changed
+version_clock = VersionClock(tombstone_ttl=float(os.getenv("SYNC_TOMBSTONE_DAYS", "30")) * 86400)
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+
+repo = Repository(
+    db,
+    max_concurrency=int(os.getenv("FIRESTORE_MAX_CONCURRENCY", "32")),
+    collection_limits=parse_collection_limits(os.getenv("FIRESTORE_COLLECTION_LIMITS")),
+    versions=version_clock,
+)
+
+# Profile-embedding index of event attendees, fed by the feature store's
+# listener, to shortlist candidates on large events with USER_INDEX_MODE=ivf;
+# "exact" (default) and "off" score every attendee, so no index is kept
+USER_INDEX_MODE = os.getenv("USER_INDEX_MODE", "exact")
+user_index = None if USER_INDEX_MODE != "ivf" else UserIndex(
+    encode_interests,
+    mode=USER_INDEX_MODE,
+    include_text=os.getenv("USER_INDEX_INCLUDE_TEXT", "").lower() in ("1", "true", "yes"),
+)
+
+# Columnar matching features of every user, kept in sync by a listener on the
+# users collection, so live matching reads neither Firestore nor profile dicts
+feature_store = FeatureStore(
+    interest_vocabulary,
+    encode_texts,
+    index=user_index,
+    shortlist_size=int(os.getenv("MATCH_SHORTLIST_SIZE", "200")),
+)
+
+# Document-level deltas for SSE and WebSocket clients, from one snapshot
+# listener per collection, so clients stop re-downloading whole lists
+CHANGE_FEED_COLLECTIONS = [c.strip() for c in os.getenv("CHANGE_FEED_COLLECTIONS", "communities,events,posts,users").split(",") if c.strip()]
+CHANGE_FEED_KEEPALIVE = float(os.getenv("CHANGE_FEED_KEEPALIVE", "15"))
+change_feed = ChangeFeed(
+    max_buffer=int(os.getenv("CHANGE_FEED_BUFFER", "256")),
+    history=int(os.getenv("CHANGE_FEED_HISTORY", "1024")),
+    max_subscribers=int(os.getenv("CHANGE_FEED_MAX_SUBSCRIBERS", "10000")),
+)
+
+# Atomic join/leave; MEMBERSHIP_STORAGE=subcollection keeps member ids out of
+# the community and event documents
+MEMBERSHIP_STORAGE = os.getenv("MEMBERSHIP_STORAGE", "array")
+community_members = Membership(repo, "communities", "joinedCommunityIds", "members", "memberCount", MEMBERSHIP_STORAGE)
+event_attendees = Membership(repo, "events", "signedUpEventIds", "attendees", storage=MEMBERSHIP_STORAGE)
+
+# Precomputed top-k matches per event attendee, built in the background and
+# then kept current incrementally from the users listener
+match_store = MatchStore(
+    interest_vocabulary,
+    k=int(os.getenv("MATCH_TOP_K", "10")),
+    pool_threshold=int(os.getenv("MATCH_POOL_THRESHOLD", "2000")),
+    max_workers=int(os.getenv("MATCH_POOL_WORKERS", "0")) or None,
+)
+MATCH_MAX_AGE = float(os.getenv("MATCH_MAX_AGE", "600"))
+
+# Search over communities, events and posts, updated by their write routes.
+# Segments are kept in SEARCH_INDEX_PATH (in memory for the in-memory Firestore)
+# and rebuilt from Firestore at startup when there are none yet
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "" if FIRESTORE_BACKEND == "memory" else "search_index")
+search_index = SearchIndex(
+    SEARCH_INDEX_PATH or None,
+    embed=run_model if os.getenv("SEARCH_SEMANTIC", "1").lower() in ("1", "true", "yes") else None,
+    embed_query=encode_texts,
+    lexical_weight=float(os.getenv("SEARCH_LEXICAL_WEIGHT", "0.5")),
+    compact_every=int(os.getenv("SEARCH_COMPACT_EVERY", "1000")),
+)
+# One worker, so index updates are applied in the order of the writes
+search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+# Concurrency budgets and deadlines for the routes that can run the model: a
+# burst beyond them is turned away with 429/503 and Retry-After instead of
+# tying up the worker threads the cheap routes need
+match_budget = RouteBudget(
+    "find-similar-users",
+    max_in_flight=int(os.getenv("MATCH_MAX_IN_FLIGHT", "2")),
+    max_queued=int(os.getenv("MATCH_MAX_QUEUED", "32")),
+    deadline=float(os.getenv("MATCH_DEADLINE_SECONDS", "2")) or None,
+)
+search_budget = RouteBudget(
+    "search",
+    max_in_flight=int(os.getenv("SEARCH_MAX_IN_FLIGHT", "16")),
+    max_queued=int(os.getenv("SEARCH_MAX_QUEUED", "64")),
+    deadline=float(os.getenv("SEARCH_DEADLINE_SECONDS", "2")) or None,
+)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.reason}, headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+# Read-through cache for the read-mostly endpoints, invalidated by the write routes
+response_cache = ResponseCache(
+    MemoryCacheBackend(max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "512"))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "30")),
+)
+
+
+def _component_stats():
+    stats = []
+    components = (
+        ("embedding_cache_", embedding_cache),
+        ("text_embedding_cache_", text_embedding_cache),
+        ("interest_vocabulary_", interest_vocabulary),
+        ("feature_store_", feature_store),
+        ("change_feed_", change_feed),
+        ("admission_match_", match_budget),
+        ("admission_search_", search_budget),
+        ("match_store_", match_store),
+        ("response_cache_", response_cache),
+        ("search_index_", search_index),
+    ) + ((("inference_", inference),) if inference is not None else ()) + ((("user_index_", user_index),) if user_index is not None else ())
+    for prefix, component in components:
+        for name, value in component.stats().items():
+            if isinstance(value, (int, float)):
+                stats.append((prefix + name, {}, value))
+    return stats
+
+
+metrics.register_collector(_component_stats)
+metrics.describe("nlp_startup_seconds", "Time spent in each cold-start stage of the matcher")
+metrics.describe("match_recompute_seconds", "Time to rebuild an event's match lists (full) or apply one attendee change (incremental)")
+metrics.describe("match_store_max_staleness_seconds", "Age of the least recently refreshed event's match lists")
+metrics.describe("feature_store_apply_seconds", "Time to apply one batch of user changes from the users listener")
+metrics.describe("change_feed_publish_seconds", "Time to fan one batch of listener changes out to the change feed's subscribers")
+metrics.describe("match_degraded_total", "Live matches answered with a degraded result to meet their deadline, by how they were degraded")
+metrics.describe("search_degraded_total", "Searches ranked on keywords alone because their deadline had passed before the query embedding")
+metrics.describe("inference_queue_seconds", "Time an encode request waited for its model batch")
+metrics.describe("inference_encode_seconds", "Model time per batch on the inference executor")
+metrics.describe("app_startup_seconds", "Time from the start of the main module import to the app being importable")
 
 class PrivatePrompts(BaseModel):
     prompt1: str
@@ -205,6 +250,9 @@ class User(BaseModel):
     signedUpEventIds: Optional[List[str]] = None
     avatarUrl: Optional[str] = None
     postIds: Optional[List[str]] = None
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+    version: Optional[int] = None
 
 class Community(BaseModel):
     id: Optional[str] = None
@@ -214,6 +262,9 @@ class Community(BaseModel):
     imageUrl: Optional[str] = None
     members: Optional[List[str]] = None
     postIds: Optional[List[str]] = None
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+    version: Optional[int] = None
 
 class Event(BaseModel):
     id: Optional[str] = None
@@ -226,6 +277,9 @@ class Event(BaseModel):
     attendees: Optional[List[str]] = None
     longitude: Optional[float] = None
     latitude: Optional[float] = None
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+    version: Optional[int] = None
 
 class Post(BaseModel):
     id: Optional[str] = None
@@ -235,50 +289,67 @@ class Post(BaseModel):
     timestamp: Optional[str] = None
     eventId: Optional[str] = None
     content: Optional[str] = None
+    createdAt: Optional[str] = None
+    updatedAt: Optional[str] = None
+    version: Optional[int] = None
 
 
+# Cheap probes are async so they never wait for a worker thread behind matching
 @app.get("/")
-def health_check():
+async def health_check():
     return {"message": "Server is running"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Ready once the matching model has loaded; liveness stays on /"""
+    status = model_status()
+    return JSONResponse(status_code=200 if status["loaded"] else 503, content={
+        "ready": status["loaded"],
+        "model": status,
+        "startup": {key: value for key, value in metrics.snapshot().items() if "startup_seconds" in key},
+    })
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.patch("/users/{user_id}")
-def update_user(user_id: str, user: User):
-    user_list = db.collection("users")
-    user_snapshot = user_list.where("id", "==", user_id).get()[0]
-    user_ref = db.collection("users").document(user_snapshot.id)
+async def update_user(user_id: str, user: User):
     # Only update fields that are provided (not None)
-    update_data = {k: v for k, v in user.model_dump().items() if v is not None}
-    user_ref.update(update_data)
+    update_data = {k: v for k, v in user.model_dump(exclude=SERVER_FIELDS).items() if v is not None}
+    await _add_interests(update_data.get("interests"))
+    if not await repo.update("users", user_id, update_data):
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
     return {"message": "User updated successfully"}
 
+async def _add_interests(interests):
+    # Interests are mapped to vocabulary ids at write time: new ones are embedded
+    # and added to the similarity table before the users listener sees the write
+    if interests:
+        await run_in_threadpool(interest_vocabulary.add, interests)
+
+def _sync_matches(user_id, user, previous_events, changed):
+    # Called by the users listener after each change it applied to the feature
+    # store; only attendees whose events or match-relevant fields changed are rescored
+    events = set((user or {}).get("signedUpEventIds") or [])
+    for event_id in previous_events - events:
+        match_store.remove_attendee(event_id, user_id)
+    for event_id in events:
+        if changed or event_id not in previous_events:
+            match_store.upsert_attendee(event_id, user)
+
 @app.post("/populate-mock-data")
-def populate_mock_data():
+async def populate_mock_data():
     """Populate Firestore with all mock data"""
-    imported = {"users": [], "communities": [], "events": [], "posts": []}
-    
-    # Import users
-    for user in MOCK_USERS:
-        user_data = user.copy()
-        _, doc_ref = db.collection("users").add(user_data)
-        imported["users"].append(doc_ref.id)
+    # One batched write per collection, all four collections concurrently
+    mock_data = {"users": MOCK_USERS, "communities": MOCK_COMMUNITIES, "events": MOCK_EVENTS, "posts": MOCK_POSTS}
+    results = await asyncio.gather(*(
+        repo.bulk_create(collection, [document.copy() for document in documents])
+        for collection, documents in mock_data.items()
+    ))
+    imported = dict(zip(mock_data, results))
     
-    # Import communities
-    for community in MOCK_COMMUNITIES:
-        community_data = community.copy()
-        _, doc_ref = db.collection("communities").add(community_data)
-        imported["communities"].append(doc_ref.id)
-    
-    # # Import events
-    for event in MOCK_EVENTS:
-        event_data = event.copy()
-        _, doc_ref = db.collection("events").add(event_data)
-        imported["events"].append(doc_ref.id)
-    
-    # # Import posts
-    for post in MOCK_POSTS:
-        post_data = post.copy()
-        _, doc_ref = db.collection("posts").add(post_data)
-        imported["posts"].append(doc_ref.id)
+    response_cache.invalidate("communities", "events", "posts", "feeds", *(f"community:{c['id']}" for c in MOCK_COMMUNITIES))
     
     return {
         "message": "Mock data populated successfully",
@@ -291,74 +362,661 @@ def populate_mock_data():
         }
     }
 
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+BULK_MAX_IN_FLIGHT = int(os.getenv("BULK_MAX_IN_FLIGHT", "8"))
+
+@app.post("/import/{collection}")
+async def import_collection(collection: str, request: Request):
+    """
+    Bulk-import documents streamed as NDJSON (application/x-ndjson) or a JSON array
+    
+    Documents are parsed as the body arrives and written with batched writes
+    keyed by their "id" field, so re-running the same import is idempotent.
+    """
+    if collection not in COLLECTION_MODELS:
+        raise HTTPException(status_code=404, detail=f"Unknown collection '{collection}'")
+    content_type = request.headers.get("content-type", "")
+    documents = iter_ndjson(request.stream()) if "ndjson" in content_type else iter_json_array(request.stream())
+
+    started = time.perf_counter()
+    writer = repo.batch_writer(collection, BULK_BATCH_SIZE, BULK_MAX_IN_FLIGHT)
+    imported_communities = []
+    try:
+        async for document in documents:
+            if collection == "events":
+                document = with_geohash(document)
+            doc_id = await writer.set(document)
+            if collection == "communities":
+                imported_communities.append(doc_id)
+    except ImportFormatError as e:
+        await writer.close()
+        raise HTTPException(status_code=400, detail=f"{e} ({writer.written} documents were written)")
+    written = await writer.close()
+    elapsed = time.perf_counter() - started
+
+    response_cache.invalidate(collection, "feeds", *(f"community:{community_id}" for community_id in imported_communities))
+    metrics.inc("bulk_import_documents_total", written, collection=collection)
+    return {
+        "collection": collection,
+        "written": written,
+        "seconds": elapsed,
+        "docs_per_second": written / elapsed if elapsed else None,
+    }
+
 @app.get("/communities/{community_id}")
-def get_individual_community(community_id: str):
-    community_list = db.collection("communities")
-    community_snapshot = community_list.where("id", "==", community_id).get()[0]
-    community_ref = db.collection("communities").document(community_snapshot.id)
-    community = community_ref.get()
-    return community.to_dict()
+async def get_individual_community(request: Request, community_id: str):
+    async def load():
+        community = await repo.get("communities", community_id)
+        if not community.exists:
+            raise HTTPException(status_code=404, detail=f"Community {community_id} not found")
+        return (await community_members.with_member_counts([community.to_dict()]))[0], {}
+
+    return await _cached_json(request, [f"community:{community_id}"], load)
 
 @app.patch("/communities/{community_id}")
-def update_community(community_id: str, newCommunity: Community):
-    community_list = db.collection("communities")
-    community_snapshot = community_list.where("id", "==", community_id).get()[0]
-    community_ref = db.collection("communities").document(community_snapshot.id)
-    community_ref.update(newCommunity.model_dump())
+async def update_community(community_id: str, newCommunity: Community):
+    # Only the fields sent are written, in one round trip
+    update_data = newCommunity.model_dump(exclude_unset=True, exclude={"id", *SERVER_FIELDS})
+    if not await repo.update("communities", community_id, update_data):
+        raise HTTPException(status_code=404, detail=f"Community {community_id} not found")
+    # Community fields are embedded in feed items
+    response_cache.invalidate("communities", f"community:{community_id}", "feeds")
     return {"message": "Community updated successfully"}
 
+MAX_PAGE_SIZE = 1000
+MEMBER_PAGE_SIZE = 100
+
+@app.post("/communities/{community_id}/members/{user_id}")
+async def join_community(community_id: str, user_id: str):
+    """Add a member atomically; joining twice changes nothing"""
+    return await _change_membership(community_members, community_id, user_id, join=True)
+
+@app.delete("/communities/{community_id}/members/{user_id}")
+async def leave_community(community_id: str, user_id: str):
+    return await _change_membership(community_members, community_id, user_id, join=False)
+
+@app.get("/communities/{community_id}/members")
+async def get_community_members(
+    response: Response,
+    community_id: str,
+    limit: int = Query(MEMBER_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+):
+    return await _list_members(response, community_members, community_id, limit, start_after)
+
+@app.put("/communities/{community_id}/member-count-shards")
+async def shard_member_count(community_id: str, shards: int = Query(..., description="Number of counter shards")):
+    """
+    Spread a hot community's memberCount over counter shards, so concurrent
+    joins stop contending on one document
+    """
+    try:
+        await community_members.shard_counter(community_id, shards)
+    except NotFound:
+        raise HTTPException(status_code=404, detail=f"Community {community_id} not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Member count sharded successfully", "shards": shards}
+
+@app.post("/events/{event_id}/attendees/{user_id}")
+async def sign_up_for_event(event_id: str, user_id: str):
+    """RSVP atomically; signing up twice changes nothing"""
+    return await _change_membership(event_attendees, event_id, user_id, join=True)
+
+@app.delete("/events/{event_id}/attendees/{user_id}")
+async def cancel_event_sign_up(event_id: str, user_id: str):
+    return await _change_membership(event_attendees, event_id, user_id, join=False)
+
+@app.get("/events/{event_id}/attendees")
+async def get_event_attendees(
+    response: Response,
+    event_id: str,
+    limit: int = Query(MEMBER_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+):
+    return await _list_members(response, event_attendees, event_id, limit, start_after)
+
+async def _change_membership(membership, parent_id, user_id, join):
+    try:
+        changed, _ = await membership.join(parent_id, user_id) if join else await membership.leave(parent_id, user_id)
+    except NotFound as e:
+        raise HTTPException(status_code=404, detail=e.message)
+    if changed:
+        if membership is community_members:
+            response_cache.invalidate("communities", f"community:{parent_id}")
+        else:
+            response_cache.invalidate("events")
+    return {"message": "Membership updated successfully", "changed": changed}
+
+async def _list_members(response, membership, parent_id, limit, start_after):
+    try:
+        result = await membership.members(parent_id, limit, start_after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"{parent_id} not found in {membership.collection}")
+    ids, next_cursor = result
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return ids
+
+async def list_params(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size; omit for the whole collection"),
+    start_after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    order_by: Optional[str] = Query(None, description="Field to sort on, prefixed with '-' for descending"),
+):
+    return {"limit": limit, "start_after": start_after, "fields": fields, "order_by": order_by}
+
+async def _list_collection(collection, model, params, always_fields=()):
+    """
+    Shared body of the list endpoints: paginates, projects and orders server-side
+    
+    With no parameters the whole collection is returned as before. When a page
+    is full the cursor for the next one is sent in the X-Next-Cursor header, so
+    the body stays a plain list for existing clients.
+    
+    always_fields are selected along with any requested projection, for
+    the caller's own use.
+    
+    Returns:
+        (documents, headers)
+    """
+    fields = None
+    if params["fields"]:
+        fields = [field.strip() for field in params["fields"].split(",") if field.strip()]
+        unknown = [field for field in fields if field.split(".")[0] not in model.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        fields = list(dict.fromkeys(fields + list(always_fields)))
+
+    order_by = params["order_by"]
+    descending = bool(order_by and order_by.startswith("-"))
+    if order_by:
+        order_by = order_by.lstrip("-")
+        if order_by not in model.model_fields:
+            raise HTTPException(status_code=400, detail=f"Cannot order by unknown field '{order_by}'")
+
+    try:
+        documents, next_cursor = await repo.page(
+            collection,
+            limit=params["limit"],
+            start_after=params["start_after"],
+            fields=fields,
+            order_by=order_by,
+            descending=descending,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return documents, ({"X-Next-Cursor": next_cursor} if next_cursor else {})
+
+async def _cached_json(request, tags, load):
+    """
+    Serve a JSON response through the response cache
+    
+    Args:
+        request: incoming request; its path and query form the cache key
+        tags: data the response depends on, invalidated by the write routes
+        load: coroutine function returning (data, headers) on a miss
+    
+    Returns:
+        the cached body with an ETag, or 304 when If-None-Match matches it
+    """
+    key = request.url.path + "?" + urlencode(sorted(request.query_params.multi_items()))
+    # Addressed before loading: a write during the load bumps a generation and
+    # the entry stored below, possibly built from the old data, is never served
+    entry_key = response_cache.entry_key(key, tags)
+    entry = response_cache.get(entry_key)
+    metrics.inc("response_cache_requests_total", route=request.scope["route"].path, result="miss" if entry is None else "hit")
+    if entry is None:
+        data, headers = await load()
+        with span("serialize"):
+            body = json.dumps(jsonable_encoder(data), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        # Firestore bills one read per returned document, and at least one per query
+        reads = max(len(data), 1) if isinstance(data, list) else 1
+        entry = response_cache.put(entry_key, body, headers, reads)
+
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
 @app.get("/users")
-def get_users():
-    users_ref = db.collection("users")
-    docs = users_ref.stream()
-    return [doc.to_dict() for doc in docs]
+async def get_users(response: Response, params: dict = Depends(list_params)):
+    documents, headers = await _list_collection("users", User, params)
+    response.headers.update(headers)
+    return documents
 
 @app.get("/communities")
-def get_communities():
-    communities_ref = db.collection("communities")
-    docs = communities_ref.stream()
-    return [doc.to_dict() for doc in docs]
+async def get_communities(request: Request, params: dict = Depends(list_params)):
+    async def load():
+        # id and the shard count are needed to add sharded member counts up
+        documents, headers = await _list_collection("communities", Community, params, always_fields=["id", SHARDS_FIELD])
+        return await community_members.with_member_counts(documents), headers
+
+    return await _cached_json(request, ["communities"], load)
 
 @app.get("/events")
-def get_events():
-    events_ref = db.collection("events")
-    docs = events_ref.stream()
-    return [doc.to_dict() for doc in docs]
+async def get_events(request: Request, params: dict = Depends(list_params)):
+    return await _cached_json(request, ["events"], lambda: _list_collection("events", Event, params))
+
+MAX_NEARBY_RADIUS_KM = 200
+
+@app.get("/events/nearby")
+async def get_nearby_events(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(5.0, gt=0, le=MAX_NEARBY_RADIUS_KM, description="Radius in km"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Events within radius km of a point, nearest first, each with its distanceKm
+    
+    Served from the geohash stored on every event, so only events in the
+    cells around the point are read. Events without coordinates never match.
+    """
+    async def load():
+        return await nearby_events(repo, lat, lng, radius, limit), {}
+
+    return await _cached_json(request, ["events"], load)
 
 @app.get("/posts")
-def get_posts():
-    posts_ref = db.collection("posts")
-    docs = posts_ref.stream()
-    return [doc.to_dict() for doc in docs]
+async def get_posts(request: Request, params: dict = Depends(list_params)):
+    return await _cached_json(request, ["posts"], lambda: _list_collection("posts", Post, params))
+
+@app.get("/sync")
+async def sync_collections(
+    since: Optional[str] = Query(None, description="Token from the previous sync; omit to load everything"),
+    collections: Optional[str] = Query(None, description="Comma-separated collections; omit for all"),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Most changed documents per collection"),
+):
+    """
+    What changed in the collections since the last sync, in one round trip
+    
+    Returns {"token", "hasMore", "reset", "changes"} where changes maps each
+    collection that changed to {"upserted": [documents], "deleted": [ids]}.
+    Apply the deletes, then the upserts, and pass token as since next time;
+    call again straight away while hasMore is true. "reset" means since is
+    too old to sync from and the lists must be reloaded without it.
+    """
+    names = [name.strip() for name in collections.split(",") if name.strip()] if collections else list(SYNC_COLLECTIONS)
+    unknown = [name for name in names if name not in SYNC_COLLECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot sync: {', '.join(unknown)}")
+    try:
+        result = await sync(repo, version_clock, names, since, limit, SYNC_OVERLAP_SECONDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _json_response(result)
+
+def _change_filter(collections, community_id, event_id):
+    """Validated (collections, kind, value) of a change feed subscription"""
+    if community_id and event_id:
+        raise HTTPException(status_code=400, detail="Filter by community_id or event_id, not both")
+    kind, value = ("community", community_id) if community_id else ("event", event_id) if event_id else (None, None)
+    if collections:
+        names = [name.strip() for name in collections.split(",") if name.strip()]
+        unknown = [name for name in names if name not in CHANGE_FEED_COLLECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"No change feed for: {', '.join(unknown)}")
+        unfiltered = [name for name in names if kind is not None and kind not in CHANGE_FEED_FILTERS[name]]
+        if unfiltered:
+            raise HTTPException(status_code=400, detail=f"Cannot filter {', '.join(unfiltered)} by {kind}")
+    else:
+        names = [name for name in CHANGE_FEED_COLLECTIONS if kind is None or kind in CHANGE_FEED_FILTERS[name]]
+    if change_feed.full:
+        raise HTTPException(status_code=503, detail="Too many change feed subscribers", headers={"Retry-After": "5"})
+    return names, kind, value
+
+@app.get("/changes")
+async def stream_changes(
+    request: Request,
+    collections: Optional[str] = Query(None, description="Comma-separated collections; omit for all"),
+    community_id: Optional[str] = Query(None, description="Only changes of this community"),
+    event_id: Optional[str] = Query(None, description="Only changes of this event"),
+    since: Optional[str] = Query(None, description="Resume after this cursor (or send Last-Event-ID)"),
+):
+    """
+    Server-Sent Events stream of document changes
+    
+    Each message is {"cursor", "collection", "type", "id", "data"} with type
+    added, modified or removed (data is null for removed); with a filter,
+    "added"/"removed" also mean a document started or stopped matching it.
+    The first message is {"type": "ready"}: load the lists after it, then
+    apply the deltas. {"type": "reset"} means deltas were dropped (the client
+    fell behind, or resumed from a cursor no longer kept) and the lists
+    must be reloaded.
+    """
+    names, kind, value = _change_filter(collections, community_id, event_id)
+    since = since or request.headers.get("last-event-id")
+
+    async def events():
+        # Subscribed once streaming starts, so the response owns the subscription
+        try:
+            subscription = change_feed.subscribe(names, kind, value, since)
+        except SubscriberLimitError:
+            return
+        try:
+            while True:
+                messages = await subscription.get(CHANGE_FEED_KEEPALIVE)
+                if messages is None:
+                    return
+                yield b"".join(message.sse for message in messages) if messages else b": keep-alive\n\n"
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/changes/ws")
+async def stream_changes_ws(
+    websocket: WebSocket,
+    collections: Optional[str] = None,
+    community_id: Optional[str] = None,
+    event_id: Optional[str] = None,
+    since: Optional[str] = None,
+):
+    """The /changes stream over a WebSocket, one JSON message per text frame"""
+    try:
+        names, kind, value = _change_filter(collections, community_id, event_id)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008, reason=e.detail)
+        return
+    await websocket.accept()
+    try:
+        subscription = change_feed.subscribe(names, kind, value, since)
+    except SubscriberLimitError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+
+    async def watch_disconnect():
+        # Clients send nothing; reading is how the close is noticed
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        except WebSocketDisconnect:
+            pass
+        finally:
+            subscription.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while (messages := await subscription.get()) is not None:
+            for message in messages:
+                await websocket.send_text(message.json)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        change_feed.unsubscribe(subscription)
+
+FEED_PAGE_SIZE = 20
+MAX_FEED_PAGE_SIZE = 100
+
+@app.get("/communities/{community_id}/feed")
+async def get_community_feed(
+    request: Request,
+    community_id: str,
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=MAX_FEED_PAGE_SIZE),
+    start_after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+):
+    """
+    Ready-to-render posts of a community, with their author and event embedded
+    
+    Cached per community and page; new posts and events in the community
+    invalidate it. Edits to authors' names or avatars show up within the cache TTL.
+    """
+    async def load():
+        try:
+            items, next_cursor = await community_feed(repo, community_id, limit, start_after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return items, ({"X-Next-Cursor": next_cursor} if next_cursor else {})
+
+    return await _cached_json(request, ["feeds", f"feed:{community_id}"], load)
+
+@app.get("/users/{user_id}/feed")
+async def get_home_feed(
+    request: Request,
+    user_id: str,
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=MAX_FEED_PAGE_SIZE),
+    start_after: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header"),
+):
+    """
+    Home feed: posts of every community the user has joined, each with its
+    author, event and community embedded
+    
+    Shares invalidation with the community feeds, so a new post only
+    invalidates the home feeds of that community's members.
+    """
+    user = await repo.get("users", user_id)
+    if not user.exists:
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+    community_ids = user.get("joinedCommunityIds") or []
+
+    async def load():
+        try:
+            items, next_cursor = await home_feed(repo, community_ids, limit, start_after)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return items, ({"X-Next-Cursor": next_cursor} if next_cursor else {})
+
+    return await _cached_json(request, ["feeds"] + [f"feed:{community_id}" for community_id in community_ids], load)
+
+MAX_SEARCH_RESULTS = 100
+
+@app.get("/search")
+async def search_content(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[str] = Query(None, description="Comma-separated collections to search: communities, events, posts"),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    semantic: bool = Query(True, description="Re-rank with embeddings; false for keyword matching only"),
+):
+    """
+    Communities, events and posts matching a free-text query, best first
+    
+    Results carry the type, id and title of each match; the documents
+    themselves are fetched from their own endpoints. Writes, from any
+    worker, show up in results once the search index's snapshot listeners
+    have indexed them, usually within milliseconds.
+    """
+    collections = None
+    if types:
+        collections = [collection.strip() for collection in types.split(",") if collection.strip()]
+        unknown = [collection for collection in collections if collection not in SEARCH_COLLECTIONS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown types: {', '.join(unknown)}")
+    async with search_budget.admit() as deadline:
+        return await run_in_threadpool(search_index.search, q, collections, limit, semantic, deadline)
+
+def _search_listener(collection):
+    """
+    Snapshot listener callback keeping collection's documents in the search index
+
+    Runs on the listener thread and only queues the work, so the listener is
+    never held up by the model. The first snapshot holds every document: it
+    builds the index, or catches a saved one up with the writes made while
+    it was not running (SEARCH_BUILD=off skips building one from scratch).
+    """
+    build = os.getenv("SEARCH_BUILD", "background") == "background"
+
+    def on_change(documents, initial):
+        if initial:
+            if search_index.loaded or build:
+                snapshot = [{**document, "id": doc_id} for doc_id, document in documents.items() if document is not None]
+                _queue_search(_sync_search, collection, snapshot)
+            return
+        upserted = [{**document, "id": doc_id} for doc_id, document in documents.items() if document is not None]
+        removed = [doc_id for doc_id, document in documents.items() if document is None]
+        if upserted:
+            _queue_search(search_index.upsert_many, collection, upserted)
+        for doc_id in removed:
+            _queue_search(search_index.remove, collection, doc_id)
+
+    return on_change
+
+def _listen_for_search(collection):
+    """Listener feeding only the search index, for a collection the change feed does not listen to"""
+    on_change = _search_listener(collection)
+    initial = [True]
+
+    def on_snapshot(documents, changes, read_time):
+        try:
+            on_change({change.document.id: None if change.type.name == "REMOVED" else change.document.to_dict() for change in changes}, initial[0])
+        except Exception:
+            metrics.inc("search_index_errors_total")
+        initial[0] = False
+
+    return listen_db.collection(collection).on_snapshot(on_snapshot)
+
+def _sync_search(collection, documents):
+    upserted, removed = search_index.sync(collection, documents)
+    if (upserted or removed) and search_index.path is not None:
+        search_index.save()
+
+def _queue_search(function, *args):
+    # One search executor thread, so changes are applied in listener order
+    search_executor.submit(function, *args).add_done_callback(_count_search_errors)
+
+def _count_search_errors(future):
+    if not future.cancelled() and future.exception() is not None:
+        metrics.inc("search_index_errors_total")
+
+COLLECTION_MODELS = {"users": User, "communities": Community, "events": Event, "posts": Post}
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+@app.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    after_id: Optional[str] = Query(None, description="Resume after this document id"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export"),
+):
+    """
+    Stream a whole collection for analytics and backups
+    
+    Documents are written in document id order as they are read, one page at
+    a time, so memory stays flat whatever the collection size and a slow
+    client simply slows the reads down. After a dropped connection, pass the
+    id of the last document received as after_id to resume.
+    """
+    if collection not in COLLECTION_MODELS:
+        raise HTTPException(status_code=404, detail=f"Unknown collection '{collection}'")
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+    async def ndjson():
+        async for _, document in repo.iter_documents(collection, after_id, EXPORT_PAGE_SIZE, field_list):
+            yield json.dumps(document, default=str, ensure_ascii=False) + "\n"
+
+    async def json_array():
+        yield "["
+        first = True
+        async for _, document in repo.iter_documents(collection, after_id, EXPORT_PAGE_SIZE, field_list):
+            yield ("" if first else ",") + json.dumps(document, default=str, ensure_ascii=False)
+            first = False
+        yield "]"
+
+    if format == "json":
+        return StreamingResponse(json_array(), media_type="application/json")
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 @app.get("/find-similar-users")
-def find_similar_users(request: Request):
+async def find_similar_users(request: Request, top_n: int = Query(1, ge=1, description="Number of matches to return")):
     user_id = request.query_params.get("user_id")
     event_id = request.query_params.get("event_id")
-    users_ref = db.collection("users").where("signedUpEventIds", "array_contains", event_id)
-    docs = users_ref.stream()
-    users_data = {"users": [doc.to_dict() for doc in docs]}
-    return find_top_similar_users(users_data, user_id)
+    top_n = min(top_n, match_store.k)
+    with span("match.lookup"):
+        matches = match_store.lookup(event_id, user_id, top_n)
+    if matches is not None:
+        metrics.inc("match_lookups_total", source="precomputed")
+        return _json_response(matches)
+
+    # Not built yet: answer live this time and precompute the event in the background
+    if not match_store.has_event(event_id):
+        match_store.schedule(event_id)
+    # Live answers go through the route's budget; precomputed ones never wait
+    async with match_budget.admit() as deadline:
+        metrics.inc("match_lookups_total", source="live")
+        # Scoring is CPU-bound and the feature store's lock is held while it
+        # runs or applies changes, so both stay off the event loop
+        matches = await run_in_threadpool(_match_from_features, user_id, event_id, top_n, deadline)
+        if matches is not None:
+            return _json_response(matches)
+        # Not in the feature store (yet): before the users listener's first sync, or
+        # a sign-up the listener has not delivered; read the attendees instead
+        attendees = await _load_event_attendees(event_id)
+        return _json_response(await run_in_threadpool(
+            find_top_similar_users, {"users": attendees}, user_id, top_n, deadline=deadline,
+        ))
+
+def _json_response(data):
+    # Serialized here rather than by FastAPI so it shows up as its own stage
+    with span("serialize"):
+        return JSONResponse(jsonable_encoder(data))
+
+def _match_from_features(user_id, event_id, top_n, deadline):
+    # None when the feature store does not have user_id as an attendee of event_id
+    if not feature_store.attends(user_id, event_id):
+        return None
+    return feature_store.match(user_id, event_id, top_n, deadline=deadline)
+
+async def _load_event_attendees(event_id):
+    attendees = await repo.where("users", "signedUpEventIds", "array_contains", event_id)
+    # Thousands of attendees take long enough to copy out that it holds up
+    # the event loop, so it is done on a worker thread
+    return await run_in_threadpool(lambda: [doc.to_dict() for doc in attendees])
+
+async def _schedule_all_events():
+    async for event_id, _ in repo.iter_documents("events", fields=[]):
+        match_store.schedule(event_id)
+
+async def _create(collection, data):
+    # A client-supplied id must not replace someone else's document
+    try:
+        return await repo.create(collection, data)
+    except AlreadyExists:
+        raise HTTPException(status_code=409, detail=f"{collection[:-1].capitalize()} {data['id']} already exists")
 
 @app.post("/users")
-def create_user(user: User):
-    _, doc_ref = db.collection("users").add(user.model_dump())
-    return {"message": "User created successfully", "user_id": doc_ref.id}
+async def create_user(user: User):
+    await _add_interests(user.interests)
+    doc_id = await _create("users", user.model_dump(exclude=SERVER_FIELDS))
+    return {"message": "User created successfully", "user_id": doc_id}
 
 @app.post("/events")
-def create_event(event: Event):
-    _, doc_ref = db.collection("events").add(event.model_dump())
-    return {"message": "Event created successfully", "event_id": doc_ref.id}
+async def create_event(event: Event):
+    doc_id = await _create("events", with_geohash(event.model_dump(exclude=SERVER_FIELDS)))
+    response_cache.invalidate("events", *([f"feed:{event.communityId}"] if event.communityId else []))
+    return {"message": "Event created successfully", "event_id": doc_id}
 
 @app.post("/posts")
-def create_post(post: Post):
-    _, doc_ref = db.collection("posts").add(post.model_dump())
-    return {"message": "Post created successfully", "post_id": doc_ref.id}
+async def create_post(post: Post):
+    doc_id = await _create("posts", post.model_dump(exclude=SERVER_FIELDS))
+    response_cache.invalidate("posts", *([f"feed:{post.communityId}"] if post.communityId else []))
+    return {"message": "Post created successfully", "post_id": doc_id}
+
+@app.delete("/posts/{post_id}")
+async def delete_post(post_id: str):
+    post = await repo.delete("posts", post_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail=f"Post {post_id} not found")
+    response_cache.invalidate("posts", *([f"feed:{post['communityId']}"] if post.get("communityId") else []))
+    return {"message": "Post deleted successfully"}
 
 @app.patch("/events/{event_id}")
-def update_event(event_id: str, updatedEvent: Event):
-    event_list = db.collection("events")
-    event_snapshot = event_list.where("id", "==", event_id).get()[0]
-    event_ref = db.collection("events").document(event_snapshot.id)
-    event_ref.update(updatedEvent.model_dump())
+async def update_event(event_id: str, updatedEvent: Event):
+    # Only the fields sent are written. The geohash is redone when either
+    # coordinate is, which is the only case that reads the event first
+    update_data = updatedEvent.model_dump(exclude_unset=True, exclude={"id", *SERVER_FIELDS})
+    if "latitude" in update_data or "longitude" in update_data:
+        snapshot = await repo.get("events", event_id)
+        if not snapshot.exists:
+            raise HTTPException(status_code=404, detail=f"Event {event_id} not found")
+        update_data["geohash"] = with_geohash({**snapshot.to_dict(), **update_data})["geohash"]
+    if not await repo.update("events", event_id, update_data):
+        raise HTTPException(status_code=404, detail=f"Event {event_id} not found")
+    # Event cards are embedded in feed items
+    response_cache.invalidate("events", "feeds")
     return {"message": "Event updated successfully"}
+
+metrics.set("app_startup_seconds", time.perf_counter() - _app_started)
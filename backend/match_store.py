@@ -0,0 +1,467 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+
+from metrics import metrics
+from nlp import SIMILARITY_WEIGHTS, TEXT_SIGNALS, profile_signals, top_n_indices, weighted_similarity
+
+# Profile fields behind the non-interest signals
+PROFILE_SIGNAL_FIELDS = ("bio", "privatePrompts", "major", "faculty", "hometown")
+
+
+def score_rows(vocab_similarities, flat_ids, offsets, lengths, targets, k, weights=None, signals=None):
+    """
+    Top-k candidates for each target attendee, by max-then-mean interest similarity
+
+    Pure NumPy so it can run in worker processes without the model: each
+    target's interest rows of the vocabulary similarity matrix are gathered
+    against every attendee's interests, reduced with a segmented max per
+    attendee and averaged over the target's interests.
+
+    Args:
+        vocab_similarities: (vocab, vocab) cosine similarities of the event's interests
+        flat_ids: vocabulary ids of all attendees' interests, concatenated
+        offsets: start of each attendee's slice in flat_ids
+        lengths: number of interests per attendee
+        targets: attendee positions to score
+        k: matches kept per target
+        weights: signal weights, when other signals than interests are weighted
+        signals: profile_signals of all attendees, for those other signals
+
+    Returns:
+        (ids, scores) arrays of shape (len(targets), k), padded with -1 / -inf
+    """
+    ids = np.full((len(targets), k), -1, dtype=np.int32)
+    scores = np.full((len(targets), k), -np.inf, dtype=np.float32)
+    candidate_columns = vocab_similarities[:, flat_ids]
+    for row, target in enumerate(targets):
+        target_ids = flat_ids[offsets[target]:offsets[target] + lengths[target]]
+        per_candidate = np.maximum.reduceat(candidate_columns[target_ids], offsets, axis=1).mean(axis=0)
+        if signals:
+            per_candidate = weighted_similarity(per_candidate[None, :], weights, _rows(signals, [target]), signals)[0]
+        per_candidate[target] = -np.inf
+        best = top_n_indices(per_candidate, k)
+        best = [candidate for candidate in best if np.isfinite(per_candidate[candidate])]
+        ids[row, :len(best)] = best
+        scores[row, :len(best)] = per_candidate[best]
+    return ids, scores
+
+
+class _EventMatches:
+    """Per-event state: attendee layout, interest vocabulary and top-k table"""
+
+    def __init__(self, k):
+        self.k = k
+        self.user_ids = []
+        self.positions = {}
+        self.profiles = []
+        self.clean_interests = []
+        self.interest_ids = []
+        self.vocabulary = {}
+        self.vocab_similarities = None
+        self.signals = {}
+        self.top_ids = np.zeros((0, k), dtype=np.int32)
+        self.top_scores = np.zeros((0, k), dtype=np.float32)
+        self.refreshed_at = time.time()
+        self.layout()
+
+    def layout(self):
+        self.lengths = np.fromiter((len(ids) for ids in self.interest_ids), dtype=np.int64, count=len(self.interest_ids))
+        self.offsets = np.zeros(len(self.lengths), dtype=np.int64)
+        if len(self.lengths):
+            np.cumsum(self.lengths[:-1], out=self.offsets[1:])
+        self.flat_ids = np.fromiter((i for ids in self.interest_ids for i in ids), dtype=np.int64, count=int(self.lengths.sum()))
+
+
+class _Published:
+    """Read-only copy of an event's matches, replaced whole after every change"""
+
+    __slots__ = ("positions", "profiles", "clean_interests", "top_ids", "top_scores")
+
+    def __init__(self, state):
+        self.positions = dict(state.positions)
+        self.profiles = list(state.profiles)
+        self.clean_interests = list(state.clean_interests)
+        self.top_ids = state.top_ids.copy()
+        self.top_scores = state.top_scores.copy()
+
+
+class MatchStore:
+    """
+    Precomputed "people to meet" lists for every attendee of an event.
+
+    An event is built once in full, then kept current incrementally: when an
+    attendee joins, leaves or changes interests only their own row and their
+    column in every other row are rescored, and only rows where they dropped
+    out of the top k are recomputed. Scores match find_top_similar_users since
+    both use max-then-mean over the same interest vocabulary's similarity
+    table; each event keeps the block of that table for its own interests.
+
+    Full builds of events with at least pool_threshold attendees are split
+    across a process pool; workers only receive NumPy arrays, never the model.
+    When weights include bio, prompt or categorical signals they are kept per
+    attendee next to the interests and folded into the same scores.
+
+    Builds and updates work on the event's state under a lock, then publish
+    a copy of its matches; lookup() only reads the published copy, so
+    requests never wait for a rescore.
+
+    Args:
+        vocabulary: InterestVocabulary the interests are mapped to
+        k: matches stored per attendee
+        weights: signal weights (default nlp.SIMILARITY_WEIGHTS)
+        pool_threshold: attendee count from which full builds use the process pool
+        max_workers: size of the process pool
+    """
+
+    def __init__(self, vocabulary, k=10, weights=None, pool_threshold=2000, max_workers=None):
+        self.vocabulary = vocabulary
+        self.k = k
+        self.weights = dict(SIMILARITY_WEIGHTS if weights is None else weights)
+        self.uses_signals = any(weight for signal, weight in self.weights.items() if signal != "interests")
+        self.pool_threshold = pool_threshold
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self._events = {}
+        self._published = {}
+        self._building = set()
+        self._changed_while_building = set()
+        self._lock = threading.RLock()
+        self._pool = None
+        self._queue = None
+        self._queued = set()
+
+    # --- Lookups ---
+
+    def has_event(self, event_id):
+        return event_id in self._events
+
+    def lookup(self, event_id, user_id, top_n=1):
+        """
+        Stored matches in find_top_similar_users' response format, or None if
+        the event has not been built or the user has no row in it
+        """
+        published = self._published.get(event_id)
+        if published is None or user_id not in published.positions:
+            return None
+        position = published.positions[user_id]
+        target = published.profiles[position]
+        matches = []
+        for candidate, score in zip(published.top_ids[position][:top_n].tolist(), published.top_scores[position][:top_n].tolist()):
+            if candidate < 0:
+                break
+            profile = published.profiles[candidate]
+            matches.append({
+                "id": profile["id"],
+                "name": profile.get("name") or "Unknown",
+                "similarity_score": score,
+                "interests": profile.get("interests") or [],
+            })
+        return {
+            "target_user": {
+                "id": user_id,
+                "name": target.get("name") or "Unknown",
+                "interests": published.clean_interests[position],
+            },
+            "top_matches": matches,
+        }
+
+    # --- Full builds ---
+
+    def rebuild_event(self, event_id, attendees):
+        """Compute every attendee's top-k for an event from scratch"""
+        started = time.perf_counter()
+        with self._lock:
+            self._building.add(event_id)
+            self._changed_while_building.discard(event_id)
+        try:
+            state = _EventMatches(self.k)
+            # Unseen interests are added to the vocabulary in one batch
+            self.vocabulary.add([interest for attendee in attendees for interest in _clean(attendee.get("interests") or [])])
+            for attendee in attendees:
+                self._append(state, attendee)
+            state.layout()
+            self._refresh_vocabulary(state)
+            if self.uses_signals:
+                state.signals = profile_signals(state.profiles, self.weights)
+
+            targets = np.arange(len(state.user_ids))
+            if len(targets) >= self.pool_threshold and self.max_workers > 1:
+                state.top_ids, state.top_scores = self._score_in_pool(state, targets)
+            else:
+                state.top_ids, state.top_scores = self._score(state, targets)
+            state.refreshed_at = time.time()
+        finally:
+            with self._lock:
+                self._building.discard(event_id)
+        with self._lock:
+            self._events[event_id] = state
+            self._published[event_id] = _Published(state)
+            stale = event_id in self._changed_while_building
+            self._changed_while_building.discard(event_id)
+        metrics.observe("match_recompute_seconds", time.perf_counter() - started, kind="full")
+        metrics.inc("match_recomputed_rows_total", len(state.user_ids), kind="full")
+        return not stale
+
+    def _score(self, state, targets):
+        if not len(targets):
+            return np.zeros((0, self.k), dtype=np.int32), np.zeros((0, self.k), dtype=np.float32)
+        return score_rows(
+            state.vocab_similarities, state.flat_ids, state.offsets, state.lengths, targets, self.k,
+            self.weights, state.signals,
+        )
+
+    def _score_in_pool(self, state, targets):
+        if self._pool is None:
+            # spawn, not fork: the listener, inference and torch threads are running
+            self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        chunks = np.array_split(targets, self.max_workers * 4)
+        futures = [
+            self._pool.submit(
+                score_rows, state.vocab_similarities, state.flat_ids, state.offsets, state.lengths, chunk, self.k,
+                self.weights, state.signals,
+            )
+            for chunk in chunks if len(chunk)
+        ]
+        results = [future.result() for future in futures]
+        return np.concatenate([ids for ids, _ in results]), np.concatenate([scores for _, scores in results])
+
+    # --- Incremental updates ---
+
+    def upsert_attendee(self, event_id, user):
+        """
+        Add or refresh one attendee of a built event, rescoring only their row
+        and column. Returns False if the event is not built (nothing to do).
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if event_id in self._building:
+                self._changed_while_building.add(event_id)
+                return False
+            state = self._events.get(event_id)
+            if state is None:
+                return False
+            user_id = user.get("id")
+            interests = _clean(user.get("interests") or [])
+            if not interests:
+                return self.remove_attendee(event_id, user_id)
+
+            position = state.positions.get(user_id)
+            previous = None
+            if position is None:
+                position = self._append(state, user)
+                state.top_ids = np.vstack([state.top_ids, np.full((1, self.k), -1, dtype=np.int32)])
+                state.top_scores = np.vstack([state.top_scores, np.full((1, self.k), -np.inf, dtype=np.float32)])
+            else:
+                previous = self._column_scores(state, position)
+                state.profiles[position] = _profile(user)
+                state.clean_interests[position] = interests
+                state.interest_ids[position] = self._interest_ids(state, interests)
+            state.layout()
+            self._refresh_vocabulary(state)
+            if self.uses_signals:
+                self._set_signals(state, position)
+
+            rescored = self._rescore_attendee(state, position, previous)
+            state.refreshed_at = time.time()
+            self._published[event_id] = _Published(state)
+        metrics.observe("match_recompute_seconds", time.perf_counter() - started, kind="incremental")
+        metrics.inc("match_recomputed_rows_total", rescored, kind="incremental")
+        return True
+
+    def remove_attendee(self, event_id, user_id):
+        """Drop an attendee from a built event and repair the rows that listed them"""
+        with self._lock:
+            if event_id in self._building:
+                self._changed_while_building.add(event_id)
+                return False
+            state = self._events.get(event_id)
+            if state is None or user_id not in state.positions:
+                return False
+            position = state.positions[user_id]
+            affected = np.flatnonzero((state.top_ids == position).any(axis=1))
+
+            keep = np.ones(len(state.user_ids), dtype=bool)
+            keep[position] = False
+            remap = np.full(len(state.user_ids) + 1, -1, dtype=np.int32)
+            remap[:-1][keep] = np.arange(keep.sum(), dtype=np.int32)
+            state.top_ids = remap[state.top_ids[keep]]
+            state.top_scores = state.top_scores[keep]
+            state.signals = {signal: None if values is None else values[keep] for signal, values in state.signals.items()}
+            for name in ("user_ids", "profiles", "clean_interests", "interest_ids"):
+                values = getattr(state, name)
+                del values[position]
+            state.positions = {user: index for index, user in enumerate(state.user_ids)}
+            state.layout()
+
+            affected = remap[affected]
+            affected = affected[affected >= 0]
+            if len(affected):
+                ids, scores = self._score(state, affected)
+                state.top_ids[affected], state.top_scores[affected] = ids, scores
+            state.refreshed_at = time.time()
+            self._published[event_id] = _Published(state)
+            metrics.inc("match_recomputed_rows_total", len(affected), kind="incremental")
+            return True
+
+    def _rescore_attendee(self, state, position, previous):
+        # Their own row
+        ids, scores = self._score(state, np.array([position]))
+        state.top_ids[position], state.top_scores[position] = ids[0], scores[0]
+
+        # Their column in everyone else's row
+        column = self._column_scores(state, position)
+        listed = (state.top_ids == position).any(axis=1)
+        kth = state.top_scores[:, -1]
+        dirty = []
+        for row in np.flatnonzero(listed | (column > kth)).tolist():
+            if row == position:
+                continue
+            if listed[row] and previous is not None and column[row] < previous[row]:
+                # Their score went down and someone outside the top k may now beat it
+                dirty.append(row)
+                continue
+            row_ids = state.top_ids[row]
+            slot = np.flatnonzero(row_ids == position)
+            slot = slot[0] if len(slot) else self.k - 1
+            row_ids[slot] = position
+            state.top_scores[row, slot] = column[row]
+            order = np.lexsort((np.where(row_ids < 0, np.iinfo(np.int32).max, row_ids), -state.top_scores[row]))
+            state.top_ids[row] = row_ids[order]
+            state.top_scores[row] = state.top_scores[row][order]
+
+        if dirty:
+            ids, scores = self._score(state, np.array(dirty))
+            state.top_ids[dirty], state.top_scores[dirty] = ids, scores
+        return 1 + len(dirty)
+
+    def _column_scores(self, state, position):
+        """Score of every attendee (as target) against one attendee (as candidate)"""
+        candidate_ids = state.flat_ids[state.offsets[position]:state.offsets[position] + state.lengths[position]]
+        best_per_interest = state.vocab_similarities[:, candidate_ids].max(axis=1)
+        column = (np.add.reduceat(best_per_interest[state.flat_ids], state.offsets) / state.lengths).astype(np.float32)
+        if state.signals:
+            column = weighted_similarity(column[:, None], self.weights, state.signals, _rows(state.signals, [position]))[:, 0]
+        return column
+
+    def _set_signals(self, state, position):
+        """Write one attendee's signal row, growing the arrays when they were just appended"""
+        n = len(state.user_ids)
+        for signal, row in profile_signals([state.profiles[position]], self.weights).items():
+            values = state.signals.get(signal)
+            if signal in TEXT_SIGNALS:
+                if values is None:
+                    if row is None:
+                        state.signals[signal] = None
+                        continue
+                    values = np.zeros((n, row.shape[1]), dtype=np.float32)
+                elif len(values) < n:
+                    values = np.vstack([values, np.zeros((n - len(values), values.shape[1]), dtype=np.float32)])
+                values[position] = 0.0 if row is None else row[0]
+            else:
+                if values is None:
+                    values = np.empty(0, dtype=object)
+                if len(values) < n:
+                    values = np.concatenate([values, np.full(n - len(values), None, dtype=object)])
+                values[position] = row[0]
+            state.signals[signal] = values
+
+    # --- Layout helpers ---
+
+    def _append(self, state, user):
+        interests = _clean(user.get("interests") or [])
+        if not user.get("id") or not interests or user["id"] in state.positions:
+            return state.positions.get(user.get("id"))
+        position = len(state.user_ids)
+        state.positions[user["id"]] = position
+        state.user_ids.append(user["id"])
+        state.profiles.append(_profile(user))
+        state.clean_interests.append(interests)
+        state.interest_ids.append(self._interest_ids(state, interests))
+        return position
+
+    def _interest_ids(self, state, interests):
+        # Event-local ids of the vocabulary's term ids, in order of first use
+        return [state.vocabulary.setdefault(term, len(state.vocabulary)) for term in self.vocabulary.add(interests).tolist()]
+
+    def _refresh_vocabulary(self, state):
+        if state.vocab_similarities is not None and len(state.vocab_similarities) == len(state.vocabulary):
+            return
+        terms = np.fromiter(state.vocabulary, dtype=np.int64, count=len(state.vocabulary))
+        state.vocab_similarities = self.vocabulary.similarities(terms, terms)
+
+    # --- Background refresh ---
+
+    def schedule(self, event_id):
+        """Queue an event for a full build by run_refresher (call from the event loop)"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if event_id and event_id not in self._queued:
+            self._queued.add(event_id)
+            self._queue.put_nowait(event_id)
+
+    async def run_refresher(self, load_attendees, max_age=600.0):
+        """
+        Build queued events forever; events older than max_age are re-queued
+
+        Args:
+            load_attendees: coroutine function returning an event's attendee dicts
+            max_age: seconds before a built event is rebuilt from Firestore
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                event_id = await asyncio.wait_for(self._queue.get(), timeout=max_age / 4)
+            except asyncio.TimeoutError:
+                now = time.time()
+                for stale_event, state in list(self._events.items()):
+                    if now - state.refreshed_at > max_age:
+                        self.schedule(stale_event)
+                continue
+            self._queued.discard(event_id)
+            try:
+                attendees = await load_attendees(event_id)
+                complete = await loop.run_in_executor(None, self.rebuild_event, event_id, attendees)
+                if not complete:
+                    self.schedule(event_id)
+            except Exception:
+                metrics.inc("match_refresh_errors_total")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            ages = [now - state.refreshed_at for state in self._events.values()]
+            return {
+                "events": len(self._events),
+                "attendees": sum(len(state.user_ids) for state in self._events.values()),
+                "queued": len(self._queued),
+                "max_staleness_seconds": max(ages) if ages else 0.0,
+            }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def _clean(interests):
+    return [str(interest).strip() for interest in interests if str(interest).strip()]
+
+
+def _profile(user):
+    return {
+        "id": user.get("id"),
+        "name": user.get("name"),
+        "interests": user.get("interests") or [],
+        **{field: user.get(field) for field in PROFILE_SIGNAL_FIELDS if user.get(field)},
+    }
+
+
+def _rows(signals, positions):
+    return {signal: None if values is None else values[positions] for signal, values in signals.items()}
@@ -0,0 +1,186 @@
+import asyncio
+import random
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP, ArrayRemove, ArrayUnion, Increment
+
+from repository import decode_cursor, encode_cursor
+from tracing import count
+
+STORAGES = ("array", "subcollection")
+
+# Parent field holding the number of counter shards, and the subcollection they live in
+SHARDS_FIELD = "memberCountShards"
+COUNTERS = "counters"
+MAX_SHARDS = 100
+
+
+class Membership:
+    """
+    Atomic join/leave between users and the documents they belong to
+    (communities, events), instead of the app PATCHing whole member arrays.
+
+    Every change is one transaction that reads only the user document, which
+    makes join and leave idempotent, and writes both sides with ArrayUnion/
+    ArrayRemove and the count with Increment. Concurrent joins of the same
+    community therefore never read or rewrite its member list and cannot
+    lose each other's updates.
+
+    With storage "array" the member ids stay in the parent's array field,
+    where the app reads them today. With "subcollection" each member is a
+    document under {collection}/{id}/{member_field} instead, so the parent
+    document stays the same size however many people join (existing arrays
+    are not migrated).
+
+    A parent with a memberCountShards field spreads its count over that many
+    documents in its "counters" subcollection; each join increments a random
+    one, so a hot document takes a fraction of the count writes. The total is
+    the parent's own count plus the shards. With array storage the parent is
+    still written on every join, so sharding pays off together with
+    subcollection storage.
+
+    Args:
+        repo: Repository
+        collection: parent collection, e.g. "communities"
+        user_field: the user's list of parent ids, e.g. "joinedCommunityIds"
+        member_field: the parent's member ids (array field or subcollection name)
+        count_field: the parent's member count field, or None if it keeps none
+        storage: "array" or "subcollection"
+    """
+
+    def __init__(self, repo, collection, user_field, member_field, count_field=None, storage="array"):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown membership storage '{storage}'")
+        self.repo = repo
+        self.collection = collection
+        self.user_field = user_field
+        self.member_field = member_field
+        self.count_field = count_field
+        self.storage = storage
+
+    def _reference(self, parent_id):
+        return self.repo.collection(self.collection).document(parent_id)
+
+    async def join(self, parent_id, user_id):
+        return await self._change(parent_id, user_id, True)
+
+    async def leave(self, parent_id, user_id):
+        return await self._change(parent_id, user_id, False)
+
+    async def _change(self, parent_id, user_id, join):
+        """
+        Add or remove a member
+
+        Raises:
+            NotFound: the parent or the user does not exist
+
+        Returns:
+            (changed, the user's list of parent ids after the change)
+        """
+        parent = await self.repo.get(self.collection, parent_id)
+        if not parent.exists:
+            raise NotFound(f"{self.collection} document {parent_id} not found")
+        shards = (parent.get(SHARDS_FIELD) or 0) if self.count_field else 0
+        parent_ref = self._reference(parent_id)
+        user_ref = self.repo.collection("users").document(user_id)
+        transform = ArrayUnion if join else ArrayRemove
+
+        async def apply(transaction):
+            user = await user_ref.get(transaction=transaction)
+            if not user.exists:
+                raise NotFound(f"User {user_id} not found")
+            ids = user.get(self.user_field) or []
+            if (parent_id in ids) == join:
+                return False, ids, 0
+
+            transaction.update(user_ref, self.repo.stamped("users", {self.user_field: transform([parent_id])}))
+            parent_changes = {}
+            writes = 1
+            if self.storage == "subcollection":
+                member_ref = parent_ref.collection(self.member_field).document(user_id)
+                if join:
+                    transaction.set(member_ref, {"userId": user_id, "joinedAt": SERVER_TIMESTAMP})
+                else:
+                    transaction.delete(member_ref)
+                writes += 1
+            else:
+                parent_changes[self.member_field] = transform([user_id])
+            if self.count_field and shards:
+                shard_ref = parent_ref.collection(COUNTERS).document(str(random.randrange(shards)))
+                transaction.set(shard_ref, {"count": Increment(1 if join else -1)}, merge=True)
+                writes += 1
+            elif self.count_field:
+                parent_changes[self.count_field] = Increment(1 if join else -1)
+            if parent_changes:
+                transaction.update(parent_ref, self.repo.stamped(self.collection, parent_changes))
+                writes += 1
+            return True, (ids + [parent_id] if join else [i for i in ids if i != parent_id]), writes
+
+        changed, ids, writes = await self.repo.transaction(apply)
+        count("firestore_reads")
+        count("firestore_writes", writes)
+        return changed, ids
+
+    async def members(self, parent_id, limit, start_after=None):
+        """
+        One page of member ids in id order, from whichever storage is in use
+
+        Returns:
+            (user ids, next_cursor), or None if the parent does not exist
+        """
+        parent = await self.repo.get(self.collection, parent_id)
+        if not parent.exists:
+            return None
+        if self.storage == "subcollection":
+            documents, next_cursor = await self.repo.page(
+                f"{self.collection}/{parent_id}/{self.member_field}", limit=limit, start_after=start_after, fields=["userId"],
+            )
+            return [document["userId"] for document in documents], next_cursor
+
+        ids = sorted(set(parent.get(self.member_field) or []))
+        if start_after:
+            after = decode_cursor(start_after, 1)[0]
+            ids = [user_id for user_id in ids if user_id > after]
+        page = ids[:limit]
+        return page, (encode_cursor([page[-1]]) if len(ids) > limit else None)
+
+    async def with_member_counts(self, documents):
+        """
+        Fold the shard totals into count_field of the documents with a sharded
+        counter, and drop the internal shard field from every document
+
+        Documents need their "id" to be looked up; shards of all the
+        documents are read concurrently, one batched get_all each.
+        """
+        sharded = [document for document in documents if document.get(SHARDS_FIELD) and document.get("id")]
+        totals = await asyncio.gather(*(self._shard_total(document["id"], document[SHARDS_FIELD]) for document in sharded))
+        for document, total in zip(sharded, totals):
+            document[self.count_field] = (document.get(self.count_field) or 0) + total
+        for document in documents:
+            document.pop(SHARDS_FIELD, None)
+        return documents
+
+    async def _shard_total(self, parent_id, shards):
+        found = await self.repo.get_all(f"{self.collection}/{parent_id}/{COUNTERS}", (str(shard) for shard in range(shards)))
+        return sum(shard.get("count") or 0 for shard in found.values())
+
+    async def shard_counter(self, parent_id, shards):
+        """
+        Spread the parent's count over shards counter documents from now on
+
+        Shards can only be added: a removed shard's count would no longer be
+        summed.
+
+        Raises:
+            NotFound: the parent does not exist
+            ValueError: shards is out of range or fewer than already in use
+        """
+        if not 1 <= shards <= MAX_SHARDS:
+            raise ValueError(f"shards must be between 1 and {MAX_SHARDS}")
+        parent = await self.repo.get(self.collection, parent_id)
+        if not parent.exists:
+            raise NotFound(f"{self.collection} document {parent_id} not found")
+        current = parent.get(SHARDS_FIELD) or 0
+        if shards < current:
+            raise ValueError(f"Already using {current} shards; shards can only be added")
+        await self.repo.update(self.collection, parent_id, {SHARDS_FIELD: shards})
@@ -0,0 +1,128 @@
+import threading
+from collections import defaultdict
+
+# Upper bounds (seconds) for latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+
+    Counters only go up, gauges hold the last value set, and histograms keep
+    cumulative bucket counts plus a running sum. Every series is identified by
+    its name and a set of label key/values. Collectors are callables polled at
+    render time for values that live elsewhere (e.g. cache statistics).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def register_collector(self, collector):
+        """Add a callable returning (name, labels_dict, value) gauges at render time"""
+        self._collectors.append(collector)
+
+    def value(self, name, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            return self._gauges.get(key)
+
+    def snapshot(self):
+        """Counters and gauges as a plain dict, for JSON endpoints"""
+        with self._lock:
+            data = {}
+            for (name, labels), value in list(self._counters.items()) + list(self._gauges.items()):
+                data[_series(name, labels)] = value
+            return data
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: {**value, "buckets": list(value["buckets"])} for key, value in self._histograms.items()}
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                gauges[self._key(name, labels)] = value
+
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.extend(self._header(name, kind))
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f"{_series(name, labels)} {_number(value)}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.extend(self._header(name, "histogram"))
+            for (series_name, labels), histogram in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f"{_series(name + '_bucket', labels + (('le', _number(bound)),))} {count}")
+                lines.append(f"{_series(name + '_bucket', labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{_series(name + '_sum', labels)} {_number(histogram['sum'])}")
+                lines.append(f"{_series(name + '_count', labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name, kind):
+        lines = []
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+        return lines
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f"{name}{{{rendered}}}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry shared by the backend modules
+metrics = Metrics()
@@ -0,0 +1,65 @@
+"""
+One-off migration: re-key documents by their app-level "id" field.
+
+populate_mock_data and the create routes used to call collection.add(), which
+stores every document under a random Firestore id, so each lookup had to query
+where("id", "==", ...) first. The routes now read and write document(id)
+directly. This script copies every document whose Firestore id differs from its
+"id" field to document(id) and deletes the original, one batch per document.
+Documents without an "id" field get their Firestore id written into it.
+When a document keyed by the id already exists (e.g. populate-mock-data was
+run twice) it is kept and the duplicate is removed.
+
+Usage (from the backend folder, with the same credentials as the server):
+    python migrate_document_ids.py [--dry-run] [--collections users events]
+"""
+import argparse
+import asyncio
+import json
+
+from main import db
+
+COLLECTIONS = ["users", "communities", "events", "posts"]
+
+
+async def migrate_collection(name, dry_run=False):
+    summary = {"keyed": 0, "moved": 0, "duplicates_removed": 0, "id_added": 0}
+    collection = db.collection(name)
+    snapshots = [snapshot async for snapshot in collection.stream()]
+    existing = {snapshot.id for snapshot in snapshots}
+
+    for snapshot in snapshots:
+        data = snapshot.to_dict() or {}
+        app_id = data.get("id")
+        if app_id == snapshot.id:
+            summary["keyed"] += 1
+            continue
+
+        batch = db.batch()
+        if not app_id:
+            batch.update(snapshot.reference, {"id": snapshot.id})
+            summary["id_added"] += 1
+        elif app_id in existing:
+            batch.delete(snapshot.reference)
+            summary["duplicates_removed"] += 1
+        else:
+            batch.set(collection.document(app_id), data)
+            batch.delete(snapshot.reference)
+            existing.add(app_id)
+            summary["moved"] += 1
+        if not dry_run:
+            await batch.commit()
+
+    return summary
+
+
+async def migrate(collections, dry_run=False):
+    return {name: await migrate_collection(name, dry_run) for name in collections}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-key Firestore documents by their app-level id")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--collections", nargs="+", default=COLLECTIONS)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(migrate(args.collections, args.dry_run)), indent=4))
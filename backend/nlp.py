@@ -1,7 +1,17 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import time
+
+_module_started = time.perf_counter()
+
 import numpy as np
 import json
+import os
+import threading
+
+from embedding_cache import EmbeddingCache, normalize_interest
+from inference import InferenceExecutor
+from interest_vocabulary import InterestVocabulary
+from metrics import metrics
+from tracing import span
 
 # import firebase_admin
 # from firebase_admin import firestore, credentials
@@ -34,18 +44,212 @@ import json
 # users_data = json.dumps(all_documents, indent=4, ensure_ascii=False)
 
 
-# Load a pre-trained model
-model = SentenceTransformer('all-MiniLM-L6-v2')
+# Pre-trained model, loaded lazily by get_model() so importing this module
+# (and answering health checks) does not pay for torch and the weights.
+# NLP_MODEL_BACKEND=onnx serves the int8-quantized ONNX export on CPU instead.
+MODEL_NAME = 'all-MiniLM-L6-v2'
+MODEL_BACKEND = os.getenv("NLP_MODEL_BACKEND", "torch")
+ONNX_MODEL_FILE = os.getenv("NLP_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# Inference runs on a dedicated executor that batches concurrent requests:
+# NLP_EXECUTOR=thread (default) keeps the model in this process, "process"
+# moves it to a model-server process and "inline" encodes on the caller.
+NLP_EXECUTOR = os.getenv("NLP_EXECUTOR", "thread")
+
+_model = None
+_model_lock = threading.Lock()
+_model_error = None
+
+
+def load_model():
+    """
+    Construct the sentence transformer (also used by the model-server process)
+    """
+    started = time.perf_counter()
+    from sentence_transformers import SentenceTransformer
+    imported = time.perf_counter()
+    metrics.set("nlp_startup_seconds", imported - started, stage="import_sentence_transformers")
+
+    if MODEL_BACKEND == "onnx":
+        loaded_model = SentenceTransformer(
+            MODEL_NAME,
+            device="cpu",
+            backend="onnx",
+            model_kwargs={"file_name": ONNX_MODEL_FILE},
+        )
+    else:
+        loaded_model = SentenceTransformer(MODEL_NAME)
+    metrics.set("nlp_startup_seconds", time.perf_counter() - imported, stage="model_load")
+    return loaded_model
+
+
+def get_model():
+    """
+    Return the sentence transformer, loading it on first use
+    """
+    global _model, _model_error
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is None:
+            try:
+                loaded_model = load_model()
+            except Exception as e:
+                _model_error = str(e)
+                raise
+            _model_error = None
+            _model = loaded_model
+    return _model
+
+
+inference = None
+if NLP_EXECUTOR != "inline":
+    inference = InferenceExecutor(
+        get_model if NLP_EXECUTOR == "thread" else load_model,
+        mode=NLP_EXECUTOR,
+        max_batch=int(os.getenv("NLP_MAX_BATCH", "64")),
+        max_wait=float(os.getenv("NLP_MAX_WAIT_MS", "5")) / 1000,
+    )
+
+
+def run_model(texts):
+    """
+    Embed texts with the model, through the inference executor when there is one
+    """
+    with span("model.encode", texts=len(texts)):
+        if inference is None:
+            return get_model().encode(texts)
+        return inference.encode(texts)
+
+
+def warm_up_model():
+    """
+    Load the model and run one inference so the first real request is fast
+    """
+    if NLP_EXECUTOR != "process":
+        get_model()
+    if metrics.value("nlp_startup_seconds", stage="first_inference") is None:
+        started = time.perf_counter()
+        run_model(["warm up"])
+        metrics.set("nlp_startup_seconds", time.perf_counter() - started, stage="first_inference")
+
+
+def start_background_warm_up():
+    """
+    Warm the model up on a daemon thread; failures are reported by model_status()
+    """
+    def run():
+        try:
+            warm_up_model()
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=run, name="nlp-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def model_status():
+    return {
+        "model": MODEL_NAME,
+        "backend": MODEL_BACKEND,
+        "executor": NLP_EXECUTOR,
+        "loaded": _model is not None or (inference is not None and inference.ready),
+        "error": _model_error or (inference.error if inference is not None else None),
+    }
+
+
+# Interest embeddings are cached per (model, normalized interest); set
+# EMBEDDING_CACHE_PATH to a sqlite file to keep them across restarts.
+# Quantized embeddings differ slightly, so the backend is part of the key.
+embedding_cache = EmbeddingCache(
+    MODEL_NAME if MODEL_BACKEND == "torch" else f"{MODEL_NAME}:{MODEL_BACKEND}",
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+    path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+)
+
+
+def encode_interests(interests):
+    """
+    Embed a list of interests, only running the model for ones not cached yet
+    """
+    return embedding_cache.encode(interests, run_model)
+
+
+# Canonical interests and their precomputed similarity table, filled as
+# interests are first seen (profile writes, the users listener); near-synonyms
+# at or above INTEREST_MERGE_THRESHOLD share a term, 1.01 turns merging off
+interest_vocabulary = InterestVocabulary(
+    encode_interests,
+    merge_threshold=float(os.getenv("INTEREST_MERGE_THRESHOLD", "0.9")),
+    max_table_terms=int(os.getenv("INTEREST_TABLE_TERMS", "4096")),
+)
+
+
+# Bios and prompts get their own cache so long texts cannot evict the (much
+# reused) interest vectors; entries are addressed by content, so a profile's
+# text is encoded once per edit rather than once per query.
+text_embedding_cache = EmbeddingCache(
+    embedding_cache.model_name,
+    max_entries=int(os.getenv("TEXT_EMBEDDING_CACHE_SIZE", "50000")),
+    path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+)
+
 
-def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribute="interests"):
+def encode_texts(texts):
+    """
+    Embed profile texts (bios, prompts), only running the model for ones not cached yet
+    """
+    return text_embedding_cache.encode(texts, run_model)
+
+
+# Signals find_top_similar_users can combine, and their weights (MATCH_WEIGHTS,
+# e.g. "interests=1,bio=0.5,major=0.2"); the default is interests only
+TEXT_SIGNALS = ("bio", "prompts")
+CATEGORICAL_SIGNALS = ("major", "faculty", "hometown")
+SIGNALS = ("interests",) + TEXT_SIGNALS + CATEGORICAL_SIGNALS
+
+
+def parse_similarity_weights(value):
+    """Parse MATCH_WEIGHTS; raises ValueError for unknown signals"""
+    weights = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, weight = item.split("=", 1)
+            name = name.strip()
+            if name not in SIGNALS:
+                raise ValueError(f"Unknown similarity signal '{name}'")
+            weights[name] = float(weight)
+    return weights or {"interests": 1.0}
+
+
+SIMILARITY_WEIGHTS = parse_similarity_weights(os.getenv("MATCH_WEIGHTS"))
+
+# Candidates embedded and scored per batch when matching has a deadline,
+# which is checked before every batch
+MATCH_BATCH_SIZE = int(os.getenv("MATCH_BATCH_SIZE", "1024"))
+
+
+metrics.set("nlp_startup_seconds", time.perf_counter() - _module_started, stage="import_nlp")
+
+
+def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribute="interests", weights=None, deadline=None):
     """
     Find top N most similar users to the target user
     
+    With a deadline the result degrades instead of overrunning it, and lists
+    how under "degraded": "partial" when only the candidates of the batches
+    scored in time were ranked, "jaccard" when there was no time for the model
+    at all and interests were compared by exact-match overlap, and "signals"
+    when the bio/prompt signals were left out.
+    
     Args:
         users_data: JSON object containing list of users
         target_user_id: string ID of the target user
         top_n: number of top matches to return
         interest_attribute: attribute name for interests list
+        weights: signal weights, see parse_similarity_weights (default SIMILARITY_WEIGHTS)
+        deadline: optional time.monotonic() value to finish by
     
     Returns:
         JSON string with top N similar users (formatted with indent)
@@ -73,7 +277,8 @@ def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribu
         # Clean target interests
         target_interests = [str(interest).strip() for interest in target_interests if str(interest).strip()]
         
-        similarities = []
+        candidates = []
+        candidate_interests = []
         
         for user in users_list:
             # Skip target user
@@ -89,22 +294,42 @@ def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribu
             if not user_interests:
                 continue
             
-            # Calculate similarity
-            similarity = compare_interests_transformer(target_interests, user_interests)
-            
-            similarities.append({
-                "user": user,
-                "similarity_score": similarity
-            })
+            candidates.append(user)
+            candidate_interests.append(user_interests)
         
-        if not similarities:
+        if not candidates:
             return json.dumps({"error": "No similar users found"}, indent=4)
         
-        # Sort by similarity score (descending)
-        similarities.sort(key=lambda x: x['similarity_score'], reverse=True)
+        # Score every candidate in one batched pass (batches with a deadline)
+        scores = score_candidates(target_interests, candidate_interests, deadline)
+        degraded = []
+        if not len(scores):
+            # Out of time before the first batch: exact matches need no model
+            scores = jaccard_similarity(target_interests, candidate_interests)
+            degraded.append("jaccard")
+        elif len(scores) < len(candidates):
+            candidates = candidates[:len(scores)]
+            degraded.append("partial")
+        weights = SIMILARITY_WEIGHTS if weights is None else weights
+        if deadline is not None and time.monotonic() >= deadline and any(weights.get(signal) for signal in TEXT_SIGNALS):
+            # Text signals need the model; the categorical ones are cheap
+            weights = {signal: weight for signal, weight in weights.items() if signal not in TEXT_SIGNALS}
+            degraded.append("signals")
+        if any(weight for signal, weight in weights.items() if signal != "interests"):
+            with span("match.signals"):
+                scores = weighted_similarity(
+                    scores[None, :],
+                    weights,
+                    profile_signals([target_user], weights),
+                    profile_signals(candidates, weights),
+                )[0]
         
-        # Get top N
-        top_matches = similarities[:top_n]
+        # Get top N (descending score, ties keep input order)
+        with span("match.rank"):
+            top_matches = [
+                {"user": candidates[i], "similarity_score": scores[i]}
+                for i in top_n_indices(scores, top_n)
+            ]
         
         # Format results
         results = {
@@ -125,6 +350,10 @@ def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribu
                 "similarity_score": float(match['similarity_score']),
                 "interests": user.get(interest_attribute, [])
             })
+        if degraded:
+            results["degraded"] = degraded
+            for reason in degraded:
+                metrics.inc("match_degraded_total", reason=reason)
         
         # return json.dumps(results, indent=4, ensure_ascii=False)
         return results
@@ -133,6 +362,198 @@ def find_top_similar_users(users_data, target_user_id, top_n=1, interest_attribu
         return json.dumps({"error": f"An error occurred: {str(e)}"}, indent=4)
 
 
+def score_candidates(target_interests, candidate_interests, deadline=None):
+    """
+    Score many candidates against one target with table lookups
+    
+    Interests are mapped to interest_vocabulary ids (embedding only ones never
+    seen before), the target-vs-unique similarities are read from its
+    precomputed table, and each candidate's rows are reduced with a segmented
+    max followed by a mean, which is the same max-then-mean score
+    compare_interests_transformer gives for a single pair.
+    
+    With a deadline, candidates are scored MATCH_BATCH_SIZE at a time and no
+    batch is started once it has passed, so only the first candidates may be
+    scored.
+    
+    Args:
+        target_interests: cleaned list of the target user's interests
+        candidate_interests: list of non-empty cleaned interest lists, one per candidate
+        deadline: optional time.monotonic() value
+    
+    Returns:
+        float32 array with one score per candidate scored, in order
+    """
+
+    if not candidate_interests:
+        return np.zeros(0, dtype=np.float32)
+    if not target_interests:
+        return np.zeros(len(candidate_interests), dtype=np.float32)
+    
+    batch_size = MATCH_BATCH_SIZE if deadline is not None else len(candidate_interests)
+    scores = []
+    for start in range(0, len(candidate_interests), batch_size):
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        scores.append(_score_batch(target_interests, candidate_interests[start:start + batch_size]))
+    return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+def _score_batch(target_interests, candidate_interests):
+    # Term ids for every interest; only unseen ones are embedded
+    flat_interests = [interest for interests in candidate_interests for interest in interests]
+    with span("match.embed", interests=len(target_interests) + len(flat_interests)):
+        ids = interest_vocabulary.add(target_interests + flat_interests)
+    target_ids, flat_ids = ids[:len(target_interests)], ids[len(target_interests):]
+    
+    # Per-candidate offsets into the flattened interest rows
+    lengths = np.fromiter((len(interests) for interests in candidate_interests), dtype=np.int64, count=len(candidate_interests))
+    offsets = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    
+    with span("match.score", candidates=len(candidate_interests)):
+        vocabulary, inverse = np.unique(flat_ids, return_inverse=True)
+        similarity_rows = interest_vocabulary.similarities(vocabulary, target_ids)[inverse]
+        
+        # Max over each candidate's interests, then mean over the target's interests
+        max_similarities = np.maximum.reduceat(similarity_rows, offsets, axis=0)
+        return max_similarities.mean(axis=1)
+
+
+def jaccard_similarity(target_interests, candidate_interests):
+    """
+    Exact-match overlap of normalized interests (intersection over union), one score per candidate
+    
+    The fallback when there is no time left for the model: it needs no
+    embeddings, but "Hiking" and "Trekking" count as unrelated.
+    """
+    target = {normalize_interest(interest) for interest in target_interests}
+    scores = np.zeros(len(candidate_interests), dtype=np.float32)
+    for i, interests in enumerate(candidate_interests):
+        candidate = {normalize_interest(interest) for interest in interests}
+        scores[i] = len(target & candidate) / len(target | candidate)
+    return scores
+
+
+def profile_text(user, signal):
+    """The text behind a text signal: the bio, or both private prompts joined"""
+    if signal == "prompts":
+        prompts = user.get("privatePrompts") or {}
+        values = prompts.values() if isinstance(prompts, dict) else prompts
+        text = " ".join(str(value).strip() for value in values if value and str(value).strip())
+    else:
+        text = str(user.get(signal) or "").strip()
+    return text or None
+
+
+def profile_signals(users, weights):
+    """
+    Per-user inputs for every weighted non-interest signal
+    
+    Text signals become unit-length embedding rows (zero rows for users without
+    the text) and categorical signals become arrays of normalized values (None
+    when missing), so weighted_similarity can compare whole sets at once.
+    
+    Returns:
+        dict mapping signal name to an array with one row/value per user
+    """
+
+    signals = {}
+    for signal in TEXT_SIGNALS:
+        if not weights.get(signal):
+            continue
+        texts = [profile_text(user, signal) for user in users]
+        present = [i for i, text in enumerate(texts) if text]
+        vectors = None
+        if present:
+            encoded = normalize_rows(encode_texts([texts[i] for i in present]))
+            vectors = np.zeros((len(users), encoded.shape[1]), dtype=np.float32)
+            vectors[present] = encoded
+        signals[signal] = vectors
+    for signal in CATEGORICAL_SIGNALS:
+        if not weights.get(signal):
+            continue
+        values = np.empty(len(users), dtype=object)
+        values[:] = [normalize_interest(user[signal]) if user.get(signal) else None for user in users]
+        signals[signal] = values
+    return signals
+
+
+def weighted_similarity(interest_scores, weights, target_signals, candidate_signals):
+    """
+    Combine interest scores with the other weighted signals for targets x candidates
+    
+    Text signals are cosine similarities of the profile embeddings, categorical
+    ones are 1 for an exact match (of normalized values, or of integer codes
+    with -1 for missing). A signal the target lacks is left out of its
+    weighted mean; a candidate lacking it scores 0 there.
+    
+    Args:
+        interest_scores: (targets, candidates) max-then-mean interest scores
+        weights: signal weights
+        target_signals: profile_signals of the targets
+        candidate_signals: profile_signals of the candidates
+    
+    Returns:
+        float32 array of shape (targets, candidates)
+    """
+
+    interest_weight = weights.get("interests", 0.0)
+    total = interest_weight * np.asarray(interest_scores, dtype=np.float32)
+    norm = np.full((total.shape[0], 1), interest_weight, dtype=np.float32)
+    for signal in TEXT_SIGNALS:
+        targets, candidates = target_signals.get(signal), candidate_signals.get(signal)
+        if not weights.get(signal) or targets is None:
+            continue
+        present = targets.any(axis=1, keepdims=True)
+        norm += weights[signal] * present
+        if candidates is not None:
+            total += weights[signal] * (targets @ candidates.T)
+    for signal in CATEGORICAL_SIGNALS:
+        targets, candidates = target_signals.get(signal), candidate_signals.get(signal)
+        if not weights.get(signal) or targets is None:
+            continue
+        if targets.dtype.kind in "iu":
+            # Integer codes (the feature store's), -1 when missing
+            present = (targets >= 0)[:, None]
+        else:
+            present = (targets != None)[:, None]  # noqa: E711 (elementwise on object arrays)
+        norm += weights[signal] * present
+        total += weights[signal] * ((targets[:, None] == candidates[None, :]) & present)
+    norm[norm == 0] = 1.0
+    return total / norm
+
+
+def normalize_rows(matrix):
+    """
+    Scale each row to unit length so dot products are cosine similarities
+    """
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_n_indices(scores, top_n):
+    """
+    Indices of the top_n highest scores, best first
+    
+    Uses np.argpartition so only the selected slice is sorted; ties are
+    broken by position to match a stable descending sort of the full list.
+    """
+
+    if top_n <= 0 or len(scores) == 0:
+        return []
+    if top_n < len(scores):
+        kth_score = scores[np.argpartition(-scores, top_n - 1)[:top_n]].min()
+        selected = np.flatnonzero(scores >= kth_score)
+    else:
+        selected = np.arange(len(scores))
+    order = np.lexsort((selected, -scores[selected]))
+    return selected[order][:top_n].tolist()
+
+
 def compare_interests_transformer(interests1, interests2):
     """
     Compare two lists of interests using sentence transformers
@@ -141,12 +562,9 @@ def compare_interests_transformer(interests1, interests2):
     if not interests1 or not interests2:
         return 0.0
     
-    # Encode both interest lists
-    embeddings1 = model.encode(interests1)
-    embeddings2 = model.encode(interests2)
-    
-    # Calculate pairwise similarities
-    similarity_matrix = cosine_similarity(embeddings1, embeddings2)
+    # Pairwise cosine similarities from the vocabulary's table (interests seen
+    # for the first time are embedded and added to it)
+    similarity_matrix = interest_vocabulary.similarities(interest_vocabulary.add(interests1), interest_vocabulary.add(interests2))
     
     # Return maximum similarity for each interest and take average
     max_similarities = np.max(similarity_matrix, axis=1)
@@ -0,0 +1,377 @@
+import asyncio
+import base64
+import json
+from contextlib import asynccontextmanager
+
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.async_transaction import async_transactional
+
+from tracing import count, span
+
+# Field path of the document id; documents are keyed by their app-level id
+DOCUMENT_ID = "__name__"
+
+
+class Repository:
+    """
+    Async data-access layer over a Firestore AsyncClient (or FakeFirestore).
+
+    All routes share one client, and therefore one gRPC channel, and each
+    collection gets its own semaphore so a burst against one collection cannot
+    starve the others of in-flight requests.
+
+    Args:
+        client: firestore AsyncClient or FakeFirestore
+        max_concurrency: default number of in-flight calls per collection
+        collection_limits: optional per-collection overrides of max_concurrency
+        versions: optional sync.VersionClock; creates, updates and batched
+            writes to its collections are then stamped with a version and
+            updatedAt (created documents with createdAt too), and delete()
+            leaves a tombstone
+    """
+
+    def __init__(self, client, max_concurrency=32, collection_limits=None, versions=None):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.collection_limits = dict(collection_limits or {})
+        self.versions = versions
+        self._semaphores = {}
+
+    def collection(self, name):
+        return self.client.collection(name)
+
+    def stamped(self, collection, data, created=False):
+        """data with a new version and updatedAt (and createdAt when created) when collection is versioned"""
+        return self.versions.stamp(collection, data, created) if self.versions is not None else data
+
+    @asynccontextmanager
+    async def limit(self, collection):
+        semaphore = self._semaphores.get(collection)
+        if semaphore is None:
+            limit = self.collection_limits.get(collection, self.max_concurrency)
+            semaphore = self._semaphores[collection] = asyncio.Semaphore(limit)
+        async with semaphore:
+            yield
+
+    async def list(self, collection, query=None):
+        """All documents of a collection (or of a query on it) as dicts"""
+        query = query if query is not None else self.collection(collection)
+        async with self.limit(collection), span("firestore.list", collection=collection):
+            documents = [doc.to_dict() async for doc in query.stream()]
+        count("firestore_reads", max(len(documents), 1))
+        return documents
+
+    async def page(self, collection, limit=None, start_after=None, fields=None, order_by=None, descending=False, filters=None):
+        """
+        One page of a collection, ordered server-side and optionally projected
+
+        Results are ordered by order_by (if given) and then by document id, so
+        the cursor is unambiguous even when order_by values repeat. Ordering
+        on one field plus the document id is served by Firestore's single-field
+        indexes, so no composite index is needed.
+
+        Args:
+            collection: collection name
+            limit: page size, or None for everything after the cursor
+            start_after: cursor token returned with the previous page
+            fields: list of field paths to return (maps to select())
+            order_by: field to sort on before the document id
+            descending: sort direction
+            filters: optional (field, op, value) filters, e.g. [("communityId", "==", "comm-1")]
+
+        Returns:
+            (documents, next_cursor) where next_cursor is None on the last page
+        """
+        direction = "DESCENDING" if descending else "ASCENDING"
+        order_fields = [order_by, DOCUMENT_ID] if order_by else [DOCUMENT_ID]
+        query = self.collection(collection)
+        for field, op, value in filters or ():
+            query = query.where(field, op, value)
+        for field in order_fields:
+            query = query.order_by(field, direction=direction)
+        if start_after:
+            query = query.start_after(dict(zip(order_fields, decode_cursor(start_after, len(order_fields)))))
+        if fields is not None:
+            # The sort field has to come back to build the next cursor
+            selected = list(dict.fromkeys(fields + ([order_by] if order_by else [])))
+            query = query.select(selected)
+        if limit is not None:
+            query = query.limit(limit)
+
+        documents = []
+        last = None
+        async with self.limit(collection), span("firestore.page", collection=collection):
+            async for snapshot in query.stream():
+                last = snapshot
+                data = snapshot.to_dict()
+                if fields is not None and order_by and order_by not in fields:
+                    data.pop(order_by, None)
+                documents.append(data)
+        count("firestore_reads", max(len(documents), 1))
+
+        next_cursor = None
+        if last is not None and limit is not None and len(documents) == limit:
+            values = [last.get(order_by)] if order_by else []
+            next_cursor = encode_cursor(values + [last.id])
+        return documents, next_cursor
+
+    async def iter_documents(self, collection, after_id=None, page_size=500, fields=None):
+        """
+        Yield (document id, data) for a whole collection in document id order
+
+        Documents are fetched one page at a time, so memory stays bounded by
+        page_size and the next page is only requested once the consumer has
+        taken the previous one. The collection's concurrency slot is only held
+        while a page is being read, never while a slow consumer drains it.
+
+        Args:
+            collection: collection name
+            after_id: resume after this document id
+            page_size: documents per Firestore query
+            fields: optional list of field paths to return
+        """
+        while True:
+            query = self.collection(collection).order_by(DOCUMENT_ID).limit(page_size)
+            if after_id is not None:
+                query = query.start_after({DOCUMENT_ID: after_id})
+            if fields is not None:
+                query = query.select(fields)
+
+            async with self.limit(collection), span("firestore.page", collection=collection):
+                snapshots = [snapshot async for snapshot in query.stream()]
+            count("firestore_reads", max(len(snapshots), 1))
+            for snapshot in snapshots:
+                yield snapshot.id, snapshot.to_dict()
+            if len(snapshots) < page_size:
+                return
+            after_id = snapshots[-1].id
+
+    def batch_writer(self, collection, batch_size=500, max_in_flight=8):
+        return BatchWriter(self.client, collection, batch_size, max_in_flight, stamp=lambda data: self.stamped(collection, data, created=True))
+
+    async def bulk_create(self, collection, documents, batch_size=500, max_in_flight=8):
+        """
+        Write many documents keyed by their app-level id using batched writes
+
+        Documents are set, so one whose id exists replaces it; this is for
+        loading trusted data (imports, mock data), not for client requests.
+
+        Returns:
+            list of document ids, in input order
+        """
+        writer = self.batch_writer(collection, batch_size, max_in_flight)
+        ids = [await writer.set(document) for document in documents]
+        await writer.close()
+        return ids
+
+    async def where(self, collection, field, op, value):
+        """Snapshots matching a single-field filter"""
+        async with self.limit(collection), span("firestore.where", collection=collection):
+            snapshots = await self.collection(collection).where(field, op, value).get()
+        count("firestore_reads", max(len(snapshots), 1))
+        return snapshots
+
+    async def get_all(self, collection, ids, fields=None):
+        """
+        Fetch many documents by id with one batched read instead of one get each
+
+        Args:
+            collection: collection name
+            ids: document ids; duplicates and empty ids are skipped
+            fields: optional list of field paths to return
+
+        Returns:
+            dict of document id to data, for the documents that exist
+        """
+        ids = list(dict.fromkeys(doc_id for doc_id in ids if doc_id))
+        if not ids:
+            return {}
+        references = [self.collection(collection).document(doc_id) for doc_id in ids]
+        found = {}
+        async with self.limit(collection), span("firestore.get_all", collection=collection):
+            async for snapshot in self.client.get_all(references, field_paths=fields):
+                if snapshot.exists:
+                    found[snapshot.id] = snapshot.to_dict()
+        count("firestore_reads", len(ids))
+        return found
+
+    async def get(self, collection, doc_id):
+        async with self.limit(collection), span("firestore.get", collection=collection):
+            snapshot = await self.collection(collection).document(doc_id).get()
+        count("firestore_reads")
+        return snapshot
+
+    async def create(self, collection, data):
+        """
+        Write a new document keyed by its app-level id, generating one when it is missing
+
+        Unlike the batched writers this never replaces an existing document.
+
+        Raises:
+            AlreadyExists: a document with that id exists
+
+        Returns:
+            the document id, which is also stored in the "id" field
+        """
+        doc_ref = self.collection(collection).document(data.get("id") or None)
+        if not data.get("id"):
+            data = {**data, "id": doc_ref.id}
+        async with self.limit(collection), span("firestore.create", collection=collection):
+            await doc_ref.create(self.stamped(collection, data, created=True))
+        count("firestore_writes")
+        return doc_ref.id
+
+    async def update(self, collection, doc_id, data):
+        """
+        Patch a document in one write
+
+        Returns:
+            False if the document does not exist
+        """
+        async with self.limit(collection), span("firestore.update", collection=collection):
+            try:
+                await self.collection(collection).document(doc_id).update(self.stamped(collection, data))
+            except NotFound:
+                return False
+        count("firestore_writes")
+        return True
+
+    async def delete(self, collection, doc_id):
+        """
+        Delete a document, leaving a tombstone in the same batch when collection is versioned
+
+        Returns:
+            the deleted document's data, or None if it does not exist
+        """
+        snapshot = await self.get(collection, doc_id)
+        if not snapshot.exists:
+            return None
+        batch = self.client.batch()
+        batch.delete(self.collection(collection).document(doc_id))
+        writes = 1
+        if self.versions is not None and collection in self.versions.collections:
+            tombstones, tombstone_id, tombstone = self.versions.tombstone(collection, doc_id)
+            batch.set(self.collection(tombstones).document(tombstone_id), tombstone)
+            writes += 1
+        async with self.limit(collection), span("firestore.delete", collection=collection):
+            await batch.commit()
+        count("firestore_writes", writes)
+        return snapshot.to_dict()
+
+
+    async def transaction(self, function, *args, max_attempts=5):
+        """
+        Run function(transaction, *args) in a Firestore transaction
+
+        Firestore aborts a transaction when another one wrote a document it
+        read; the whole function is then re-run with fresh reads, up to
+        max_attempts times, so it must not have side effects beyond the
+        transaction's own writes.
+
+        Returns:
+            what function returned on the attempt that committed
+        """
+        transaction = self.client.transaction(max_attempts=max_attempts)
+        with span("firestore.transaction"):
+            return await async_transactional(function)(transaction, *args)
+
+
+class BatchWriter:
+    """
+    Buffers document writes into WriteBatches and commits several at once.
+
+    Firestore caps a batch at 500 writes; full batches are committed in the
+    background with at most max_in_flight commits outstanding, and set()
+    waits for a slot when that limit is reached, so a fast producer cannot
+    buffer unbounded data. Writes are set() by document id, which makes
+    re-running an import idempotent.
+
+    Args:
+        client: firestore AsyncClient or FakeFirestore
+        collection: collection name
+        batch_size: writes per batch, at most 500
+        max_in_flight: concurrent batch commits
+        stamp: optional function applied to every document before it is written
+    """
+
+    def __init__(self, client, collection, batch_size=500, max_in_flight=8, stamp=None):
+        self.client = client
+        self.collection = client.collection(collection)
+        self.stamp = stamp
+        self.batch_size = min(batch_size, 500)
+        self.max_in_flight = max_in_flight
+        self.written = 0
+        self._batch = client.batch()
+        self._pending = 0
+        self._in_flight = set()
+
+    async def set(self, data):
+        """
+        Queue a document, generating its id when it has none
+
+        The document is set, replacing any existing one with the same id, as
+        bulk imports re-run over the same data expect.
+
+        Returns:
+            the document id
+        """
+        doc_ref = self.collection.document(data.get("id") or None)
+        if not data.get("id"):
+            data = {**data, "id": doc_ref.id}
+        self._batch.set(doc_ref, self.stamp(data) if self.stamp is not None else data)
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            await self._flush()
+        return doc_ref.id
+
+    async def _flush(self):
+        if not self._pending:
+            return
+        batch, writes = self._batch, self._pending
+        self._batch, self._pending = self.client.batch(), 0
+        while len(self._in_flight) >= self.max_in_flight:
+            done, self._in_flight = await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        self._in_flight.add(asyncio.ensure_future(self._commit(batch, writes)))
+
+    async def _commit(self, batch, writes):
+        with span("firestore.batch_commit"):
+            await batch.commit()
+        count("firestore_writes", writes)
+        self.written += writes
+
+    async def close(self):
+        """Commit what is buffered and wait for every outstanding batch"""
+        await self._flush()
+        in_flight, self._in_flight = self._in_flight, set()
+        await asyncio.gather(*in_flight)
+        return self.written
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe page token holding the last document's sort values"""
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, expected_length):
+    """Inverse of encode_cursor; raises ValueError for malformed tokens"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != expected_length:
+        raise ValueError("Cursor does not match the requested ordering")
+    return values
+
+
+def parse_collection_limits(value):
+    """Parse FIRESTORE_COLLECTION_LIMITS, e.g. "users=16,posts=64" """
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
@@ -0,0 +1,143 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCacheBackend:
+    """
+    In-process TTL + LRU store used by ResponseCache.
+
+    A shared backend (e.g. Redis) can be dropped in by implementing the same
+    four methods; the in-process one is the local stand-in and the default.
+
+    Args:
+        max_entries: entries kept before the least recently used are evicted
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CachedResponse:
+    def __init__(self, body, headers, reads):
+        self.body = body
+        self.headers = headers
+        self.reads = reads
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+class ResponseCache:
+    """
+    Read-through cache of serialized JSON responses with tag-based invalidation.
+
+    Every entry is stored under its request key plus the current generation of
+    each tag it depends on (e.g. "communities", "community:comm-1"). A write
+    bumps the generations of the tags it affects, so stale entries can no
+    longer be addressed and simply age out of the LRU; this works the same
+    with a shared backend, where deleting by pattern would not. Callers take
+    the entry key before building a response and store it under that key,
+    so a response built while its data was being written is stored under
+    the old generations and never served.
+
+    Args:
+        backend: MemoryCacheBackend or compatible store
+        ttl: seconds an entry stays valid even without invalidation
+    """
+
+    def __init__(self, backend=None, ttl=30.0):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saved_reads = 0
+
+    def entry_key(self, key, tags):
+        """
+        Address of key's entry at the current generations of tags
+
+        Args:
+            key: request key (path and normalized query)
+            tags: names of the data the response is built from
+        """
+        generations = ",".join(f"{tag}@{self.backend.counter('tag:' + tag)}" for tag in sorted(tags))
+        return f"{key}|{generations}"
+
+    def get(self, entry_key):
+        entry = self.backend.get(entry_key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.saved_reads += entry.reads
+        return entry
+
+    def put(self, entry_key, body, headers=None, reads=1):
+        """
+        Store a serialized response
+
+        Args:
+            entry_key: entry_key() taken before the response was built
+            body: JSON bytes
+            headers: extra headers to replay on hits
+            reads: Firestore document reads it took to build, for metrics
+        """
+        entry = CachedResponse(body, dict(headers or {}), reads)
+        self.backend.set(entry_key, entry, self.ttl)
+        return entry
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.incr("tag:" + tag)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_reads": self.saved_reads,
+        }
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value covers etag"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
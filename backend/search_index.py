@@ -0,0 +1,529 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from metrics import metrics
+from tracing import span
+
+# Fields indexed per collection; the first one is the result's title
+SEARCH_FIELDS = {
+    "communities": ("name", "description"),
+    "events": ("name", "description", "location"),
+    "posts": ("content",),
+}
+COLLECTIONS = tuple(SEARCH_FIELDS)
+TITLE_LENGTH = 120
+# Documents embedded per model call when indexing
+EMBED_BATCH_SIZE = 256
+
+STOPWORDS = frozenset("a an and are as at be by for from has in is it of on or the this to with".split())
+_TOKEN = re.compile(r"\w+")
+
+# BM25 parameters
+K1, B = 1.2, 0.75
+
+
+def tokenize(text):
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def document_text(collection, document):
+    return " ".join(str(document[field]) for field in SEARCH_FIELDS[collection] if document.get(field))
+
+
+# A document added since the last compaction, held in memory
+_Entry = namedtuple("_Entry", "collection id title terms length embedding seq digest")
+
+
+class _Segment:
+    """
+    Immutable, compacted part of the index: postings of every term stored
+    contiguously in one array, sliced by term offsets. Loaded from disk the
+    arrays are memory-mapped, so only the postings a query touches are paged in.
+    """
+
+    def __init__(self, keys, titles, terms, offsets, postings, frequencies, lengths, types, embeddings, digests=None):
+        self.keys = keys
+        self.titles = titles
+        self.numbers = {key: number for number, key in enumerate(keys)}
+        self.terms = terms
+        self.term_ids = {term: index for index, term in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.types = types
+        self.embeddings = embeddings
+        # Digest of each document's indexed text, None in segments written before digests
+        self.digests = digests if digests is not None else [None] * len(keys)
+        self.total_length = float(np.sum(lengths)) if len(lengths) else 0.0
+
+    @classmethod
+    def empty(cls):
+        return cls(
+            [], [], [], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32),
+            np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int8), None,
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def postings_of(self, term):
+        """(document numbers, term frequencies) of a term"""
+        index = self.term_ids.get(term)
+        if index is None:
+            return None, None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.postings[start:end], self.frequencies[start:end]
+
+    def document_frequency(self, term):
+        index = self.term_ids.get(term)
+        return 0 if index is None else int(self.offsets[index + 1] - self.offsets[index])
+
+    def write(self, directory):
+        os.makedirs(directory)
+        with open(os.path.join(directory, "documents.json"), "w", encoding="utf-8") as f:
+            json.dump({"keys": self.keys, "titles": self.titles, "terms": self.terms, "digests": self.digests}, f, ensure_ascii=False)
+        arrays = {
+            "offsets": self.offsets, "postings": self.postings, "frequencies": self.frequencies,
+            "lengths": self.lengths, "types": self.types,
+        }
+        if self.embeddings is not None:
+            arrays["embeddings"] = self.embeddings
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "documents.json"), encoding="utf-8") as f:
+            documents = json.load(f)
+
+        def array(name):
+            file = os.path.join(directory, f"{name}.npy")
+            return np.load(file, mmap_mode="r") if os.path.exists(file) else None
+
+        return cls(
+            [tuple(key) for key in documents["keys"]], documents["titles"], documents["terms"],
+            array("offsets"), array("postings"), array("frequencies"), array("lengths"), array("types"), array("embeddings"),
+            documents.get("digests"),
+        )
+
+
+class SearchIndex:
+    """
+    Full-text index over communities, events and posts, ranked with BM25 and
+    re-ranked by MiniLM embedding similarity.
+
+    Writes go to a small in-memory layer on top of an immutable segment
+    (postings, document lengths and embeddings as NumPy arrays); a replaced
+    or removed document is masked out of the segment until the next
+    compaction merges the layer into a new segment, which runs in the
+    background once compact_every changes have accumulated. With a path,
+    segments are written as .npy files and memory-mapped, so a restart loads
+    the index without re-embedding anything.
+
+    A query scores the segment with vectorized BM25 over the postings of its
+    terms only, takes the best `candidates` lexical matches, and ranks them
+    by lexical_weight * normalized BM25 + (1 - lexical_weight) * cosine
+    similarity to the query embedding. A query with no lexical match falls
+    back to a pure embedding search, so synonyms still find something.
+
+    Args:
+        path: directory for the segments, or None to stay in memory
+        embed: callable mapping a list of strings to a 2D array, or None for lexical only
+        embed_query: callable used for query texts instead of embed, e.g. a cached one
+        lexical_weight: share of the BM25 score in the final ranking
+        candidates: lexical matches re-ranked by embedding
+        compact_every: pending changes that trigger a background compaction
+    """
+
+    def __init__(self, path=None, embed=None, embed_query=None, lexical_weight=0.5, candidates=200, compact_every=1000):
+        self.path = path
+        self.embed = embed
+        self.embed_query = embed_query or embed
+        self.lexical_weight = lexical_weight
+        self.candidates = candidates
+        self.compact_every = compact_every
+
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._compacting = False
+        self._segment_name = None
+        self._base = _Segment.empty()
+        self._alive = np.zeros(0, dtype=bool)
+        self._delta = {}
+        self._delta_df = Counter()
+        self._removed = {}
+        self._seq = 0
+        self.compactions = 0
+        self.load()
+
+    # --- Persistence ---
+
+    def load(self):
+        """Open the current on-disk segment, if there is one"""
+        if self.path is None:
+            return False
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return False
+        with open(current, encoding="utf-8") as f:
+            name = f.read().strip()
+        segment = _Segment.load(os.path.join(self.path, name))
+        with self._lock:
+            self._segment_name = name
+            self._base = segment
+            self._alive = np.ones(len(segment), dtype=bool)
+            self._delta, self._delta_df, self._removed = {}, Counter(), {}
+        return True
+
+    @property
+    def loaded(self):
+        """Whether a segment was loaded from or saved to disk"""
+        return self._segment_name is not None
+
+    def save(self):
+        """
+        Merge the pending changes into a new segment and switch to it
+
+        The merge runs without holding the index lock; changes made meanwhile
+        stay pending on top of the new segment.
+        """
+        with self._save_lock:
+            started = time.perf_counter()
+            with self._lock:
+                seq = self._seq
+                base, alive, delta = self._base, self._alive.copy(), list(self._delta.values())
+                if not delta and alive.all() and (self.path is None or self._segment_name is not None):
+                    return False
+            segment = _merge(base, alive, delta)
+
+            name = None
+            if self.path is not None:
+                name = f"segment-{time.time_ns()}"
+                segment.write(os.path.join(self.path, name))
+                segment = _Segment.load(os.path.join(self.path, name))
+
+            with self._lock:
+                alive = np.ones(len(segment), dtype=bool)
+                pending = {key: entry for key, entry in self._delta.items() if entry.seq > seq}
+                removed = {key: removed_seq for key, removed_seq in self._removed.items() if removed_seq > seq}
+                for key in list(pending) + list(removed):
+                    number = segment.numbers.get(key)
+                    if number is not None:
+                        alive[number] = False
+                previous, self._segment_name = self._segment_name, name
+                self._base, self._alive, self._delta, self._removed = segment, alive, pending, removed
+                self._delta_df = Counter(term for entry in pending.values() for term in entry.terms)
+                self.compactions += 1
+
+            if name is not None:
+                # The switch is the atomic rename of CURRENT; older segments are then unused
+                current = os.path.join(self.path, "CURRENT")
+                with open(current + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(name)
+                os.replace(current + ".tmp", current)
+                if previous is not None:
+                    shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+            metrics.observe("search_index_compaction_seconds", time.perf_counter() - started)
+            return True
+
+    def _maybe_compact(self):
+        # Called with the lock held
+        if self._compacting or len(self._delta) + len(self._removed) < self.compact_every:
+            return
+        self._compacting = True
+
+        def run():
+            try:
+                self.save()
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="search-compaction", daemon=True).start()
+
+    # --- Writes ---
+
+    def upsert(self, collection, document):
+        self.upsert_many(collection, [document])
+
+    def upsert_many(self, collection, documents):
+        """
+        Add or replace documents of one collection; embeddings are computed in one batch
+
+        Documents whose indexed text is unchanged are skipped, so re-sending
+        a document after a write to its other fields costs no model call.
+
+        Returns:
+            number of documents added or replaced
+        """
+        if collection not in SEARCH_FIELDS:
+            return 0
+        documents = [document for document in documents if document.get("id")]
+        texts = [document_text(collection, document) for document in documents]
+        digests = [_digest(text) for text in texts]
+        with self._lock:
+            changed = [i for i, document in enumerate(documents) if self._digest_of((collection, document["id"])) != digests[i]]
+        documents, texts, digests = [documents[i] for i in changed], [texts[i] for i in changed], [digests[i] for i in changed]
+        embeddings = [None] * len(documents)
+        if self.embed is not None and documents:
+            # In batches, so a large snapshot does not hand the model everything at once
+            vectors = [
+                np.asarray(self.embed([text or " " for text in texts[start:start + EMBED_BATCH_SIZE]]), dtype=np.float32)
+                for start in range(0, len(texts), EMBED_BATCH_SIZE)
+            ]
+            embeddings = _normalize(np.concatenate(vectors))
+
+        with self._lock:
+            for document, text, embedding, digest in zip(documents, texts, embeddings, digests):
+                key = (collection, document["id"])
+                self._remove(key)
+                self._seq += 1
+                terms = Counter(tokenize(text))
+                title = str(document.get(SEARCH_FIELDS[collection][0]) or "")[:TITLE_LENGTH]
+                self._delta[key] = _Entry(collection, document["id"], title, terms, sum(terms.values()), embedding, self._seq, digest)
+                self._delta_df.update(terms.keys())
+            self._maybe_compact()
+        return len(documents)
+
+    def sync(self, collection, documents):
+        """
+        Make collection's indexed documents exactly documents (a full snapshot of it)
+
+        Changed and new documents are upserted and indexed ones missing from
+        documents removed, so an index loaded from disk catches up with the
+        writes made while it was not running.
+
+        Returns:
+            (number upserted, number removed)
+        """
+        ids = {document["id"] for document in documents if document.get("id")}
+        with self._lock:
+            indexed = [key for number, key in enumerate(self._base.keys) if key[0] == collection and self._alive[number]]
+            indexed += [key for key in self._delta if key[0] == collection]
+        stale = [doc_id for _, doc_id in indexed if doc_id not in ids]
+        for doc_id in stale:
+            self.remove(collection, doc_id)
+        return self.upsert_many(collection, documents), len(stale)
+
+    def remove(self, collection, doc_id):
+        with self._lock:
+            self._remove((collection, doc_id))
+            self._seq += 1
+            self._removed[(collection, doc_id)] = self._seq
+            self._maybe_compact()
+
+    def _digest_of(self, key):
+        # Called with the lock held; None when key is not indexed
+        entry = self._delta.get(key)
+        if entry is not None:
+            return entry.digest
+        number = self._base.numbers.get(key)
+        if number is None or not self._alive[number]:
+            return None
+        return self._base.digests[number]
+
+    def _remove(self, key):
+        number = self._base.numbers.get(key)
+        if number is not None:
+            self._alive[number] = False
+        entry = self._delta.pop(key, None)
+        if entry is not None:
+            self._delta_df.subtract(entry.terms.keys())
+        self._removed.pop(key, None)
+
+    # --- Queries ---
+
+    def search(self, query, collections=None, limit=20, semantic=True, deadline=None):
+        """
+        Ranked matches of a free-text query
+
+        A search that reaches the query embedding after its deadline skips it
+        and ranks on keywords alone, as with semantic=False.
+
+        Args:
+            query: text to search for
+            collections: collections to search (default all)
+            limit: number of results
+            semantic: re-rank (and fall back) with embeddings
+            deadline: optional time.monotonic() value to finish by
+
+        Returns:
+            list of {"type", "id", "title", "score"}, best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        query_vector = None
+        if semantic and self.embed is not None and deadline is not None and time.monotonic() >= deadline:
+            metrics.inc("search_degraded_total", reason="lexical")
+        elif semantic and self.embed is not None:
+            with span("search.embed"):
+                query_vector = _normalize(np.asarray(self.embed_query([query]), dtype=np.float32))[0]
+        allowed = [COLLECTIONS.index(collection) for collection in (collections or COLLECTIONS)]
+
+        with self._lock, span("search.rank"):
+            base, alive, delta = self._base, self._alive, self._delta
+            visible = alive & np.isin(base.types, allowed) if len(base) else alive
+            delta_entries = [entry for entry in delta.values() if COLLECTIONS.index(entry.collection) in allowed]
+
+            base_scores, delta_scores = self._bm25(terms, base, visible, delta_entries)
+            base_hits = np.flatnonzero(base_scores > 0)
+            if len(base_hits) > self.candidates:
+                base_hits = base_hits[np.argpartition(-base_scores[base_hits], self.candidates - 1)[:self.candidates]]
+            delta_hits = [i for i, score in enumerate(delta_scores) if score > 0]
+            if query_vector is not None and not len(base_hits) and not delta_hits:
+                base_hits, delta_hits = self._nearest(query_vector, base, visible, delta_entries)
+            base_hits = np.sort(base_hits)
+
+            lexical = np.concatenate([base_scores[base_hits], np.asarray([delta_scores[i] for i in delta_hits], dtype=np.float32)])
+            scores = lexical
+            if query_vector is not None:
+                vectors = np.concatenate([
+                    _rows(base.embeddings, base_hits, len(query_vector)),
+                    _vectors([delta_entries[i] for i in delta_hits], len(query_vector)),
+                ])
+                similarity = np.maximum(vectors @ query_vector, 0.0)
+                top = lexical.max() if len(lexical) else 0.0
+                scores = self.lexical_weight * (lexical / top if top > 0 else lexical) + (1 - self.lexical_weight) * similarity
+
+            hits = [(base.keys[n], base.titles[n]) for n in base_hits]
+            hits += [((delta_entries[i].collection, delta_entries[i].id), delta_entries[i].title) for i in delta_hits]
+            order = np.argsort(-scores, kind="stable")[:limit]
+            return [
+                {"type": hits[i][0][0], "id": hits[i][0][1], "title": hits[i][1], "score": float(scores[i])}
+                for i in order
+            ]
+
+    def _bm25(self, terms, base, visible, delta_entries):
+        documents = int(visible.sum()) + len(delta_entries)
+        total_length = base.total_length + sum(entry.length for entry in delta_entries)
+        average_length = total_length / max(len(base) + len(delta_entries), 1) or 1.0
+        base_scores = np.zeros(len(base), dtype=np.float32)
+        delta_scores = [0.0] * len(delta_entries)
+        for term in terms:
+            frequency = base.document_frequency(term) + self._delta_df.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            numbers, tf = base.postings_of(term)
+            if numbers is not None and len(numbers):
+                norm = K1 * (1 - B + B * base.lengths[numbers] / average_length)
+                base_scores[numbers] += idf * tf * (K1 + 1) / (tf + norm)
+            for i, entry in enumerate(delta_entries):
+                tf = entry.terms.get(term)
+                if tf:
+                    delta_scores[i] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * entry.length / average_length))
+        base_scores[~visible] = 0
+        return base_scores, delta_scores
+
+    def _nearest(self, query_vector, base, visible, delta_entries):
+        """The candidates closest to the query embedding, for queries with no lexical match"""
+        similarity = np.full(len(base), -np.inf, dtype=np.float32)
+        if len(base) and base.embeddings is not None:
+            # Chunked so a memory-mapped matrix is streamed rather than copied whole
+            for start in range(0, len(base), 65536):
+                similarity[start:start + 65536] = np.asarray(base.embeddings[start:start + 65536]) @ query_vector
+            similarity[~visible] = -np.inf
+        # Only documents that are actually similar, not every candidate slot
+        count = min(self.candidates, int((similarity > 0).sum()))
+        base_hits = np.argpartition(-similarity, count - 1)[:count] if count else np.zeros(0, dtype=np.int64)
+        scores = _vectors(delta_entries, len(query_vector)) @ query_vector
+        delta_hits = np.flatnonzero(scores > 0)
+        if len(delta_hits) > self.candidates:
+            delta_hits = delta_hits[np.argpartition(-scores[delta_hits], self.candidates - 1)[:self.candidates]]
+        return base_hits, sorted(delta_hits.tolist())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": int(self._alive.sum()) + len(self._delta),
+                "segment_documents": len(self._base),
+                "pending_changes": len(self._delta) + len(self._removed),
+                "terms": len(self._base.terms),
+                "compactions": self.compactions,
+            }
+
+
+def _merge(base, alive, entries):
+    """New segment with the live documents of base followed by entries"""
+    entries = sorted(entries, key=lambda entry: entry.seq)
+    kept = np.flatnonzero(alive)
+    renumber = np.full(len(base), -1, dtype=np.int64)
+    renumber[kept] = np.arange(len(kept))
+
+    terms = sorted(set(base.terms).union(*(entry.terms.keys() for entry in entries)))
+    term_ids = {term: index for index, term in enumerate(terms)}
+
+    # Postings as flat (term, document, frequency) columns, then grouped by term
+    counts = np.diff(np.asarray(base.offsets))
+    base_terms = np.repeat(np.asarray([term_ids[term] for term in base.terms], dtype=np.int64), counts)
+    base_documents = np.asarray(base.postings, dtype=np.int64)
+    keep = alive[base_documents] if len(base_documents) else np.zeros(0, dtype=bool)
+    delta_terms, delta_documents, delta_frequencies = [], [], []
+    for offset, entry in enumerate(entries):
+        for term, frequency in entry.terms.items():
+            delta_terms.append(term_ids[term])
+            delta_documents.append(len(kept) + offset)
+            delta_frequencies.append(frequency)
+    all_terms = np.concatenate([base_terms[keep], np.asarray(delta_terms, dtype=np.int64)])
+    all_documents = np.concatenate([renumber[base_documents[keep]], np.asarray(delta_documents, dtype=np.int64)])
+    all_frequencies = np.concatenate([np.asarray(base.frequencies)[keep], np.asarray(delta_frequencies, dtype=np.float32)])
+    order = np.lexsort((all_documents, all_terms))
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_terms, minlength=len(terms)), out=offsets[1:])
+
+    embeddings = None
+    if base.embeddings is not None or any(entry.embedding is not None for entry in entries):
+        if base.embeddings is not None:
+            dimension = base.embeddings.shape[1]
+        else:
+            dimension = next(len(entry.embedding) for entry in entries if entry.embedding is not None)
+        embeddings = np.concatenate([_rows(base.embeddings, kept, dimension), _vectors(entries, dimension)])
+
+    return _Segment(
+        [base.keys[n] for n in kept] + [(entry.collection, entry.id) for entry in entries],
+        [base.titles[n] for n in kept] + [entry.title for entry in entries],
+        terms,
+        offsets,
+        all_documents[order].astype(np.int32),
+        all_frequencies[order].astype(np.float32),
+        np.concatenate([np.asarray(base.lengths)[kept], np.asarray([entry.length for entry in entries], dtype=np.float32)]).astype(np.float32),
+        np.concatenate([np.asarray(base.types)[kept], np.asarray([COLLECTIONS.index(entry.collection) for entry in entries], dtype=np.int8)]).astype(np.int8),
+        embeddings,
+        [base.digests[n] for n in kept] + [entry.digest for entry in entries],
+    )
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _rows(embeddings, numbers, dimension):
+    # Segments built without embeddings rank on BM25 alone
+    if embeddings is None or not len(numbers):
+        return np.zeros((len(numbers), dimension), dtype=np.float32)
+    return np.asarray(embeddings[numbers], dtype=np.float32)
+
+
+def _vectors(entries, dimension):
+    # Documents indexed without an embedding get a zero row, so they never rank on similarity
+    vectors = np.zeros((len(entries), dimension), dtype=np.float32)
+    for row, entry in enumerate(entries):
+        if entry.embedding is not None:
+            vectors[row] = entry.embedding
+    return vectors
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+metrics.describe("search_index_compaction_seconds", "Time to merge pending search index changes into a new segment")
@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from change_feed import PRIVATE_FIELDS
+from repository import decode_cursor, encode_cursor
+from tracing import count, span
+
+# Collections whose writes are stamped and can be synced
+SYNC_COLLECTIONS = ("users", "communities", "events", "posts")
+VERSION_FIELD = "version"
+UPDATED_AT_FIELD = "updatedAt"
+CREATED_AT_FIELD = "createdAt"
+# Set by the server only; request bodies carrying them have them dropped
+SERVER_FIELDS = frozenset({VERSION_FIELD, UPDATED_AT_FIELD, CREATED_AT_FIELD})
+# One document per deleted document, {collection, id, version, updatedAt, expireAt}
+TOMBSTONES = "tombstones"
+
+
+class VersionClock:
+    """
+    Version stamps for the documents of the synced collections.
+
+    A version is microseconds since the epoch, strictly increasing within the
+    process, so versions order writes and double as timestamps; updatedAt is
+    the same instant as an ISO 8601 string, and a created document also gets
+    it as createdAt, which later writes keep. Versions from several workers
+    are only as ordered as their clocks, which sync() allows for by
+    re-sending the last overlap seconds of changes.
+
+    Deletes leave a tombstone carrying the version of the delete. Its
+    expireAt is tombstone_ttl later, for a Firestore TTL policy on the
+    tombstones collection to remove it; clients that have not synced for
+    longer than that are told to reload everything.
+
+    Args:
+        collections: collections whose writes are stamped
+        tombstone_ttl: seconds tombstones are kept
+    """
+
+    def __init__(self, collections=SYNC_COLLECTIONS, tombstone_ttl=30 * 86400):
+        self.collections = frozenset(collections)
+        self.tombstone_ttl = tombstone_ttl
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def now(self):
+        """The current time as a version, without using it up"""
+        return time.time_ns() // 1000
+
+    def next(self):
+        with self._lock:
+            self._last = max(self.now(), self._last + 1)
+            return self._last
+
+    def stamp(self, collection, data, created=False):
+        """
+        data with a new version and updatedAt (and createdAt when created), when collection is versioned
+
+        A created document's createdAt is only kept from data for trusted
+        writes such as bulk imports; the routes drop SERVER_FIELDS from
+        request bodies before writing.
+        """
+        if collection not in self.collections:
+            return data
+        version = self.next()
+        stamped = {**data, VERSION_FIELD: version, UPDATED_AT_FIELD: _timestamp(version).isoformat()}
+        if created and not data.get(CREATED_AT_FIELD):
+            stamped[CREATED_AT_FIELD] = stamped[UPDATED_AT_FIELD]
+        return stamped
+
+    def tombstone(self, collection, doc_id):
+        """
+        Tombstone of a deleted document
+
+        Returns:
+            (tombstones collection, tombstone document id, data)
+        """
+        version = self.next()
+        deleted_at = _timestamp(version)
+        return TOMBSTONES, f"{collection}:{doc_id}", {
+            "collection": collection,
+            "id": doc_id,
+            VERSION_FIELD: version,
+            UPDATED_AT_FIELD: deleted_at.isoformat(),
+            "expireAt": deleted_at + timedelta(seconds=self.tombstone_ttl),
+        }
+
+
+async def sync(repo, clock, collections, since=None, limit=1000, overlap=5.0):
+    """
+    Documents of collections written and deleted after a sync token
+
+    Each collection is read with one query for the documents after since,
+    ordered by version and then document id, and the deletes with one query
+    on the tombstones, all concurrently, so a sync costs one round trip and
+    reads proportional to the changes rather than to the collections. Without since everything is
+    returned (documents written before versioning need backfill_versions.py).
+
+    The returned token is the version overlap seconds before now, so writes
+    stamped by another worker's clock or still in flight are sent again
+    rather than missed; applying the changes twice is harmless. When a
+    collection returns a full page of limit changes (or there are limit
+    deletes), hasMore is set and the token instead resumes right after the
+    last document of that page, so paging always advances; changes the
+    other collections read past that point are left for the next page. Clients apply
+    the deletes before the upserts, as a document can be deleted and
+    created again with the same id.
+
+    Args:
+        repo: Repository
+        clock: VersionClock stamping the repository's writes
+        collections: names from SYNC_COLLECTIONS
+        since: token from the previous sync
+        limit: most documents returned per collection, and most deletes
+
+    Raises:
+        ValueError: since is not a valid token
+
+    Returns:
+        {"token", "hasMore", "reset", "changes": {collection: {"upserted": [...], "deleted": [ids]}}}
+        with only the collections that changed; "reset" means since is older
+        than the tombstones kept and everything must be reloaded without it
+    """
+    position = _decode_token(since) if since else [0]
+    version = position[0]
+    now = clock.now()
+    if version and version < now - clock.tombstone_ttl * 1_000_000:
+        return {"token": None, "hasMore": False, "reset": True, "changes": {}}
+
+    # A token from a full page is the (version, document id) of its last
+    # document, to resume right after it even among documents sharing a version
+    if len(position) == 2:
+        after = {"start_after": encode_cursor(position)}
+    else:
+        after = {"filters": [(VERSION_FIELD, ">", version)]}
+
+    async def changed(collection):
+        return await repo.page(collection, limit=limit, order_by=VERSION_FIELD, **after)
+
+    async def deleted():
+        if not version:
+            return [], None
+        return await repo.page(TOMBSTONES, limit=limit, order_by=VERSION_FIELD, **after)
+
+    with span("sync.query"):
+        *pages, (tombstones, tombstones_cursor) = await asyncio.gather(*(changed(collection) for collection in collections), deleted())
+    upserted = [documents for documents, _ in pages]
+
+    # The stream that is furthest behind decides where the next sync resumes;
+    # what the other streams read beyond that point is left for the next sync
+    resume = [decode_cursor(cursor, 2) for cursor in [*(cursor for _, cursor in pages), tombstones_cursor] if cursor]
+    if resume:
+        token = min(resume)
+        upserted = [[document for document in documents if [document[VERSION_FIELD], document["id"]] <= token] for documents in upserted]
+        tombstones = [
+            tombstone for tombstone in tombstones
+            if [tombstone[VERSION_FIELD], f"{tombstone['collection']}:{tombstone['id']}"] <= token
+        ]
+    else:
+        token = [max(version, now - int(overlap * 1_000_000))]
+    changes = {}
+    for collection, documents in zip(collections, upserted):
+        removed = [tombstone for tombstone in tombstones if tombstone.get("collection") == collection]
+        if documents or removed:
+            private = PRIVATE_FIELDS.get(collection, ())
+            changes[collection] = {
+                "upserted": [{key: value for key, value in document.items() if key not in private} for document in documents],
+                "deleted": [tombstone["id"] for tombstone in removed],
+            }
+    count("sync_changes", sum(len(delta["upserted"]) + len(delta["deleted"]) for delta in changes.values()))
+    return {"token": encode_cursor(token), "hasMore": bool(resume), "reset": False, "changes": changes}
+
+
+def _decode_token(token):
+    """[version] or [version, document id] of a sync token"""
+    try:
+        position = decode_cursor(token, 2)
+    except ValueError:
+        position = decode_cursor(token, 1)
+    valid = isinstance(position[0], int) and not isinstance(position[0], bool) and position[0] >= 0
+    if not valid or (len(position) == 2 and not (isinstance(position[1], str) and position[1])):
+        raise ValueError("Invalid sync token")
+    return position
+
+
+def _timestamp(version):
+    return datetime.fromtimestamp(version / 1_000_000, tz=timezone.utc)
@@ -0,0 +1,196 @@
+"""
+Synthetic Togather data for load tests, shaped like the MOCK_* fixtures.
+
+Interests, communities and events are drawn from Zipf-like distributions so a
+few are very popular and most are niche, which is what the matcher and the
+membership arrays see in practice. Cross references are consistent: a user's
+joinedCommunityIds / signedUpEventIds / postIds match the communities'
+members, the events' attendees and the posts' authorId.
+
+Usage (writes users.ndjson, communities.ndjson, events.ndjson, posts.ndjson):
+    python synthetic_data.py --users 100000 --out synthetic/
+"""
+import argparse
+import json
+import math
+import os
+import random
+
+from mock_data import MOCK_USERS, MOCK_COMMUNITIES, MOCK_EVENTS, MOCK_POSTS
+
+INTERESTS = [
+    "Hiking", "Photography", "Baking", "Movies", "Robotics", "3D Printing", "Cycling", "Sci-Fi",
+    "Fishing", "Bouldering", "Running", "Startups", "Cooking", "Music", "Guitar", "Piano",
+    "Reading", "Writing", "Poetry", "Chess", "Board Games", "Video Games", "Anime", "K-Pop",
+    "Basketball", "Football", "Tennis", "Badminton", "Swimming", "Yoga", "Meditation", "Gym",
+    "Dancing", "Drawing", "Painting", "Pottery", "Fashion", "Thrifting", "Coffee", "Tea",
+    "Travel", "Languages", "Volunteering", "Debate", "Investing", "Crypto", "AI", "Programming",
+    "Hackathons", "Astronomy", "Birdwatching", "Camping", "Surfing", "Sailing", "Skateboarding", "Theatre",
+    "Stand-up Comedy", "Podcasts", "Gardening", "Cats", "Dogs", "Karaoke", "Film Photography", "Jazz",
+]
+FACULTIES = {
+    "Arts and Social Sciences": ["Psychology", "Sociology", "History", "English Literature"],
+    "Engineering": ["Mechanical Engineering", "Electrical Engineering", "Civil Engineering"],
+    "Science": ["Physics", "Chemistry", "Biology", "Mathematics"],
+    "Business": ["Finance", "Marketing", "Accounting"],
+    "Computing": ["Computer Science", "Information Systems", "Data Science"],
+    "Medicine": ["Medicine", "Nursing", "Pharmacy"],
+}
+HOMETOWNS = [
+    "Hong Kong", "Vancouver", "Toronto", "London", "Singapore", "Sydney", "Shanghai", "Seoul",
+    "Tokyo", "New York", "Kuala Lumpur", "Taipei", "Manila", "Mumbai", "Berlin", "Paris",
+]
+PROMPTS = [
+    "A perfect weekend for me is {interest} with friends.",
+    "Something that fascinates me is {interest}.",
+    "I connect best with people who are into {interest}.",
+    "I'm looking for friends who want to try {interest}.",
+]
+TIMES = ["Today, 5pm", "Tomorrow, 6pm", "Friday, 8pm", "Saturday, 10am", "Next Tuesday, 7pm"]
+LOCATIONS = ["Sai Ying Pun MTR Exit A2", "West Kowloon Cultural District", "Campus Cinema", "Innovation Hub", "Main Library"]
+
+# Centre and spread (degrees) of generated event coordinates, roughly Hong Kong
+LATITUDE, LONGITUDE, SPREAD = 22.3, 114.17, 0.15
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1.0 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def generate_dataset(users=1000, communities=None, events=None, posts_per_user=1.0, seed=0):
+    """
+    Build consistent users, communities, events and posts
+
+    Args:
+        users: number of users
+        communities: number of communities (default users // 50, at least 4)
+        events: number of events (default 2 per community)
+        posts_per_user: mean number of text posts per user
+        seed: random seed, for reproducible datasets
+
+    Returns:
+        dict mapping collection name to a list of documents
+    """
+    rng = random.Random(seed)
+    communities = communities or max(4, users // 50)
+    events = events or communities * 2
+    interest_weights = zipf_weights(len(INTERESTS))
+    community_weights = zipf_weights(communities)
+    event_weights = zipf_weights(events)
+
+    community_docs = []
+    for i in range(communities):
+        template = MOCK_COMMUNITIES[i % len(MOCK_COMMUNITIES)]
+        topic = INTERESTS[i % len(INTERESTS)]
+        community_docs.append({
+            **template,
+            "id": f"comm-{i}",
+            "name": f"{topic} Club {i}",
+            "description": f"A community for people who love {topic.lower()}.",
+            "imageUrl": f"https://picsum.photos/seed/comm{i}/600/400",
+            "members": [],
+            "postIds": [],
+            "memberCount": 0,
+        })
+
+    event_docs = []
+    for i in range(events):
+        template = MOCK_EVENTS[i % len(MOCK_EVENTS)]
+        community = community_docs[rng.randrange(communities)]
+        event_docs.append({
+            **template,
+            "id": f"event-{i}",
+            "name": f"{community['name']} Meetup {i}",
+            "time": rng.choice(TIMES),
+            "location": rng.choice(LOCATIONS),
+            "communityId": community["id"],
+            "imageUrl": f"https://picsum.photos/seed/event{i}/200/200",
+            "attendees": [],
+            "latitude": round(LATITUDE + rng.uniform(-SPREAD, SPREAD), 6),
+            "longitude": round(LONGITUDE + rng.uniform(-SPREAD, SPREAD), 6),
+        })
+
+    user_docs = []
+    post_docs = []
+    for i in range(users):
+        template = MOCK_USERS[i % len(MOCK_USERS)]
+        faculty = rng.choice(list(FACULTIES))
+        interests = list(dict.fromkeys(rng.choices(INTERESTS, weights=interest_weights, k=rng.randint(2, 6))))
+        joined = sorted({community_docs[j]["id"] for j in rng.choices(range(communities), weights=community_weights, k=rng.randint(0, 3))})
+        signed_up = sorted({event_docs[j]["id"] for j in rng.choices(range(events), weights=event_weights, k=rng.randint(0, 4))})
+        user_id = f"user-{i}"
+        user = {
+            **template,
+            "id": user_id,
+            "email": f"user{i}@test.com",
+            "name": f"User {i}",
+            "year": rng.randint(1, 5),
+            "faculty": faculty,
+            "major": rng.choice(FACULTIES[faculty]),
+            "hometown": rng.choice(HOMETOWNS),
+            "interests": interests,
+            "bio": f"{template['bio'].split('.')[0]}. Into {', '.join(interests[:2]).lower()}.",
+            "privatePrompts": {
+                "prompt1": rng.choice(PROMPTS).format(interest=interests[0].lower()),
+                "prompt2": rng.choice(PROMPTS).format(interest=interests[-1].lower()),
+            },
+            "joinedCommunityIds": joined,
+            "signedUpEventIds": signed_up,
+            "postIds": [],
+            "avatarUrl": f"https://picsum.photos/seed/user{i}/200",
+        }
+        user_docs.append(user)
+
+        for community_id in joined:
+            community = community_docs[int(community_id.split("-")[1])]
+            community["members"].append(user_id)
+            community["memberCount"] += 1
+        for event_id in signed_up:
+            event_docs[int(event_id.split("-")[1])]["attendees"].append(user_id)
+
+        for _ in range(_poisson(rng, posts_per_user) if joined else 0):
+            post_id = f"post-{len(post_docs)}"
+            community_id = rng.choice(joined)
+            post = {
+                **MOCK_POSTS[1],
+                "id": post_id,
+                "authorId": user_id,
+                "communityId": community_id,
+                "content": f"Anyone up for some {rng.choice(interests).lower()} this week?",
+            }
+            post_docs.append(post)
+            user["postIds"].append(post_id)
+            community_docs[int(community_id.split("-")[1])]["postIds"].append(post_id)
+
+    return {"users": user_docs, "communities": community_docs, "events": event_docs, "posts": post_docs}
+
+
+def _poisson(rng, mean):
+    # Knuth's method; fine for the small means used here
+    threshold, count, product = math.exp(-mean), 0, rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def write_ndjson(dataset, directory):
+    os.makedirs(directory, exist_ok=True)
+    for collection, documents in dataset.items():
+        with open(os.path.join(directory, f"{collection}.ndjson"), "w", encoding="utf-8") as f:
+            for document in documents:
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Togather dataset as NDJSON")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--communities", type=int)
+    parser.add_argument("--events", type=int)
+    parser.add_argument("--posts-per-user", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic")
+    args = parser.parse_args()
+    dataset = generate_dataset(args.users, args.communities, args.events, args.posts_per_user, args.seed)
+    write_ndjson(dataset, args.out)
+    print(json.dumps({collection: len(documents) for collection, documents in dataset.items()}))
@@ -0,0 +1,191 @@
+import contextvars
+import threading
+import time
+
+from metrics import metrics
+
+_current = contextvars.ContextVar("request_trace", default=None)
+_tracer = None
+
+
+class RequestTrace:
+    """
+    Per-request accumulator of stage timings and counters.
+
+    It lives in a context variable, so code running for the request in the
+    threadpool (which copies the context) adds to the same trace. Stages with
+    the same name are summed, e.g. every Firestore query of a request.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_count(self, name, value):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stages), dict(self.counts)
+
+
+def span(name, **attributes):
+    """
+    Time a block as a stage of the current request (and as an OpenTelemetry
+    span when the request is sampled); outside a request it only runs the block.
+    Works with both "with" and "async with".
+    """
+    return _Span(name, attributes)
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "trace", "otel_span", "started")
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.trace = _current.get()
+        self.otel_span = None
+        if self.trace is None:
+            return self
+        if _tracer is not None:
+            from opentelemetry import trace as otel
+
+            if otel.get_current_span().is_recording():
+                self.otel_span = _tracer.start_as_current_span(self.name, attributes=self.attributes)
+                self.otel_span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add_stage(self.name, time.perf_counter() - self.started)
+            if self.otel_span is not None:
+                self.otel_span.__exit__(*exc_info)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        return self.__exit__(*exc_info)
+
+
+def count(name, value=1):
+    """Add to a per-request counter (Firestore reads, cache hits, ...)"""
+    trace = _current.get()
+    if trace is not None and value:
+        trace.add_count(name, value)
+
+
+def configure_opentelemetry(sample_rate, service_name="togather-backend", endpoint=None):
+    """
+    Export sampled request traces over OTLP/HTTP, e.g. to a local collector
+
+    Needs the opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http
+    packages. Sampling is decided once per request from its trace id, so an
+    unsampled request creates no spans at all.
+
+    Args:
+        sample_rate: fraction of requests to trace, 0 to 1
+        service_name: service.name resource attribute
+        endpoint: OTLP traces endpoint (default: OTEL_EXPORTER_OTLP_ENDPOINT or localhost:4318)
+    """
+    global _tracer
+    try:
+        from opentelemetry import trace as otel
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError as e:
+        raise RuntimeError(
+            "TRACE_SAMPLE_RATE needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http"
+        ) from e
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name}),
+        sampler=ParentBased(TraceIdRatioBased(sample_rate)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint) if endpoint else OTLPSpanExporter()))
+    otel.set_tracer_provider(provider)
+    _tracer = otel.get_tracer(__name__)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware recording latency, stage timings and per-request counters.
+
+    For every request it exports, labelled by route template:
+        http_request_seconds{route,method,status}       end-to-end latency
+        request_stage_seconds{route,stage}              time in each span() stage
+        request_operations_total{route,operation}       summed count() values
+    and adds a Server-Timing header with the stages finished before the
+    response started, so a slow request can be read off in the browser.
+
+    Written as plain ASGI rather than BaseHTTPMiddleware so streaming
+    responses pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current.set(trace)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                stages, _ = trace.snapshot()
+                if stages:
+                    timing = ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items())
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", timing.encode("latin-1"))]}
+            await send(message)
+
+        otel_span = None
+        if _tracer is not None:
+            otel_span = _tracer.start_as_current_span(f"{scope['method']} {scope['path']}")
+            otel_span.__enter__()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            stages, counts = trace.snapshot()
+            metrics.observe("http_request_seconds", time.perf_counter() - started, route=route, method=scope["method"], status=status)
+            for name, seconds in stages.items():
+                metrics.observe("request_stage_seconds", seconds, route=route, stage=name)
+            for name, value in counts.items():
+                metrics.inc("request_operations_total", value, route=route, operation=name)
+            if otel_span is not None:
+                from opentelemetry import trace as otel
+
+                current = otel.get_current_span()
+                current.update_name(f"{scope['method']} {route}")
+                current.set_attribute("http.status_code", status)
+                for name, value in counts.items():
+                    current.set_attribute(f"togather.{name}", value)
+                otel_span.__exit__(None, None, None)
+            _current.reset(token)
+
+
+metrics.describe("http_request_seconds", "End-to-end request latency by route template")
+metrics.describe("request_stage_seconds", "Time spent per request in each traced stage")
+metrics.describe("request_operations_total", "Firestore document reads/writes and embedding cache hits/misses by route")
@@ -0,0 +1,229 @@
+import threading
+
+import numpy as np
+
+
+class UserIndex:
+    """
+    Maintained index of per-user profile embeddings, partitioned by event.
+
+    A profile vector is the mean of a user's normalized interest embeddings
+    (optionally blended with their bio and private prompts). Users are kept
+    in per-event buckets so a query only ever looks at attendees of one event.
+    It is fed full profiles by the FeatureStore's users listener, which then
+    rescores the shortlist a query returns on every signal.
+
+    In "exact" mode a query scores every attendee of the event. In "ivf" mode
+    vectors are assigned to k-means centroids once enough users are indexed,
+    and a query only scores attendees in the n_probe closest lists, so its cost
+    grows with n_probe / n_lists of the event rather than the whole event.
+    Upserts and removals are applied in place; the index never rebuilds.
+
+    Args:
+        embed: callable mapping a list of strings to a 2D array of embeddings
+        mode: "exact" or "ivf"
+        n_lists: number of IVF centroids
+        n_probe: number of IVF lists scanned per query
+        train_size: number of indexed users that triggers IVF training
+        include_text: also pool bio and privatePrompts into the profile vector
+        text_weight: weight of the text embeddings relative to the interests
+    """
+
+    def __init__(self, embed, mode="exact", n_lists=64, n_probe=8, train_size=2048,
+                 include_text=False, text_weight=0.5):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index mode '{mode}'")
+        self.embed = embed
+        self.mode = mode
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_size = train_size
+        self.include_text = include_text
+        self.text_weight = text_weight
+
+        self._lock = threading.RLock()
+        self._vectors = None
+        self._rows = {}
+        self._free_rows = []
+        self._user_ids = []
+        self._user_events = {}
+        self._user_list = {}
+        self._event_lists = {}
+        self._centroids = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    # --- Profile vectors ---
+
+    def profile_vector(self, user):
+        """Mean-pooled, unit-length profile embedding, or None if the user has no interests"""
+        interests = [str(interest).strip() for interest in user.get("interests") or [] if str(interest).strip()]
+        if not interests:
+            return None
+        vector = _normalize(np.asarray(self.embed(interests), dtype=np.float32)).mean(axis=0)
+
+        if self.include_text:
+            texts = []
+            if user.get("bio"):
+                texts.append(str(user["bio"]))
+            prompts = user.get("privatePrompts") or {}
+            texts.extend(str(prompt) for prompt in prompts.values() if prompt)
+            if texts:
+                text_vector = _normalize(np.asarray(self.embed(texts), dtype=np.float32)).mean(axis=0)
+                vector = vector + self.text_weight * text_vector
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # --- Updates ---
+
+    def upsert(self, user):
+        """Insert or refresh a user from a full profile dict"""
+        user_id = user.get("id")
+        if not user_id:
+            return
+        vector = self.profile_vector(user)
+        with self._lock:
+            if vector is None:
+                self._remove(user_id)
+                return
+
+            row = self._rows.get(user_id)
+            if row is None:
+                row = self._allocate_row(vector.shape[0])
+                self._rows[user_id] = row
+            self._vectors[row] = vector
+            self._user_ids[row] = user_id
+
+            list_id = self._nearest_list(vector)
+            events = set(user.get("signedUpEventIds") or [])
+            self._move(row, self._user_events.get(user_id, set()), self._user_list.get(user_id), events, list_id)
+            self._user_events[user_id] = events
+            self._user_list[user_id] = list_id
+
+            if self.mode == "ivf" and self._centroids is None and len(self._rows) >= self.train_size:
+                self._train()
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id):
+        row = self._rows.pop(user_id, None)
+        if row is None:
+            return
+        self._move(row, self._user_events.pop(user_id, set()), self._user_list.pop(user_id, None), set(), None)
+        self._user_ids[row] = None
+        self._free_rows.append(row)
+
+    def _allocate_row(self, dim):
+        if self._free_rows:
+            return self._free_rows.pop()
+        if self._vectors is None:
+            self._vectors = np.zeros((64, dim), dtype=np.float32)
+        row = len(self._user_ids)
+        if row >= self._vectors.shape[0]:
+            grown = np.zeros((self._vectors.shape[0] * 2, dim), dtype=np.float32)
+            grown[:row] = self._vectors[:row]
+            self._vectors = grown
+        self._user_ids.append(None)
+        return row
+
+    def _move(self, row, old_events, old_list, new_events, new_list):
+        for event_id in old_events:
+            if event_id in new_events and old_list == new_list:
+                continue
+            bucket = self._event_lists.get(event_id, {}).get(old_list)
+            if bucket is not None:
+                bucket.discard(row)
+        for event_id in new_events:
+            self._event_lists.setdefault(event_id, {}).setdefault(new_list, set()).add(row)
+
+    # --- IVF ---
+
+    def _nearest_list(self, vector):
+        if self._centroids is None:
+            return 0
+        return int(np.argmax(self._centroids @ vector))
+
+    def _train(self, iterations=10, seed=0):
+        """One-off spherical k-means over the vectors indexed so far"""
+        rows = np.fromiter(self._rows.values(), dtype=np.int64)
+        data = self._vectors[rows]
+        n_lists = min(self.n_lists, len(rows))
+        rng = np.random.default_rng(seed)
+        centroids = data[rng.choice(len(rows), size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for list_id in range(n_lists):
+                members = data[assignment == list_id]
+                if len(members):
+                    centroids[list_id] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        self._centroids = centroids
+
+        # Re-bucket the existing users once; later upserts are assigned directly
+        self._event_lists = {}
+        assignment = np.argmax(data @ centroids.T, axis=1)
+        for row, list_id in zip(rows.tolist(), assignment.tolist()):
+            user_id = self._user_ids[row]
+            self._user_list[user_id] = list_id
+            for event_id in self._user_events.get(user_id, ()):
+                self._event_lists.setdefault(event_id, {}).setdefault(list_id, set()).add(row)
+
+    # --- Queries ---
+
+    def search(self, user_id, event_id, k=100):
+        """
+        Nearest attendees of event_id to user_id's profile
+
+        Returns:
+            list of (user id, score) pairs, best first, excluding user_id;
+            empty if user_id is not an indexed attendee of event_id
+        """
+        with self._lock:
+            row = self._rows.get(user_id)
+            lists = self._event_lists.get(event_id, {})
+            if row is None or not lists or event_id not in self._user_events.get(user_id, ()):
+                return []
+            query = self._vectors[row]
+
+            if self._centroids is None:
+                probe_order = list(lists)
+            else:
+                probe_order = [list_id for list_id in np.argsort(-(self._centroids @ query)).tolist() if list_id in lists]
+
+            # Widen the probe until there are enough candidates to fill k
+            candidates = []
+            n_probe = len(probe_order) if self.mode == "exact" else self.n_probe
+            for position, list_id in enumerate(probe_order):
+                if position >= n_probe and len(candidates) > k:
+                    break
+                candidates.extend(lists[list_id])
+            candidates = np.asarray([candidate for candidate in candidates if candidate != row], dtype=np.int64)
+            if not len(candidates):
+                return []
+
+            scores = self._vectors[candidates] @ query
+            if k < len(candidates):
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(candidates))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self._user_ids[candidates[i]], float(scores[i])) for i in top.tolist()]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "users": len(self._rows),
+                "trained": self._centroids is not None,
+                "lists": 0 if self._centroids is None else len(self._centroids),
+            }
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms